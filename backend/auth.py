@@ -3,19 +3,45 @@ Auth0 Authentication Module
 Handles JWT token verification and role-based access control (RBAC)
 """
 
+import asyncio
+import hashlib
 import json
+import logging
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
 from flask import request
 from functools import wraps
-from jose import jwt
+from urllib.parse import urlparse
 from urllib.request import urlopen
 
+from cache_backends import get_backend
+from instrumentation import phase
+
+logger = logging.getLogger(__name__)
+
 
 # Auth0 Configuration
 AUTH0_DOMAIN = os.environ.get('AUTH0_DOMAIN', 'your-tenant.us.auth0.com')
 ALGORITHMS = json.loads(os.environ.get('ALGORITHMS', '["RS256"]'))
 API_AUDIENCE = os.environ.get('API_AUDIENCE', 'trivia-api')
 
+# JWKS key store configuration
+# JWKS_URL may point at Auth0, a local stand-in server or a file (file:///path or a plain path)
+JWKS_URL = os.environ.get('JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+JWKS_CACHE_TTL = int(os.environ.get('JWKS_CACHE_TTL', '600'))
+JWKS_REFRESH_MARGIN = int(os.environ.get('JWKS_REFRESH_MARGIN', '60'))
+JWKS_MIN_REFETCH_INTERVAL = int(os.environ.get('JWKS_MIN_REFETCH_INTERVAL', '30'))
+JWKS_FETCH_TIMEOUT = float(os.environ.get('JWKS_FETCH_TIMEOUT', '5'))
+
+# Verified token cache configuration
+# TOKEN_CACHE_URL optionally points at a shared backend (e.g. redis://localhost:6379/0)
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '1024'))
+TOKEN_CACHE_MAX_TTL = int(os.environ.get('TOKEN_CACHE_MAX_TTL', '300'))
+TOKEN_CACHE_URL = os.environ.get('TOKEN_CACHE_URL')
+
 
 class AuthError(Exception):
     """
@@ -27,6 +53,253 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+class JWKSKeyStore:
+    """
+    Process-wide cache of the JSON Web Key Set used to verify tokens
+
+    Keys are cached by `kid` for the max-age advertised by the JWKS response
+    (or `default_ttl` when there is none) and refreshed on a background timer
+    shortly before they expire. A token signed with an unknown `kid` triggers
+    a synchronous refetch, at most once every `min_refetch_interval` seconds.
+    If a refresh fails, the previously fetched keys keep being served.
+    """
+    def __init__(self, url, default_ttl=JWKS_CACHE_TTL, refresh_margin=JWKS_REFRESH_MARGIN,
+                 min_refetch_interval=JWKS_MIN_REFETCH_INTERVAL, fetch_timeout=JWKS_FETCH_TIMEOUT):
+        self.url = url
+        self.default_ttl = default_ttl
+        self.refresh_margin = refresh_margin
+        self.min_refetch_interval = min_refetch_interval
+        self.fetch_timeout = fetch_timeout
+        self._keys = {}
+        self._expires_at = 0.0
+        self._last_fetch = None
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def get_key(self, kid):
+        """
+        Returns the RSA key for a `kid`, fetching the key set if needed
+
+        Args:
+            kid (str): Key id from the token header
+
+        Returns:
+            rsa_key (dict): The matching key, or None if the kid is unknown
+
+        Raises:
+            AuthError: If no key set could be fetched at all
+        """
+        if time.monotonic() >= self._expires_at:
+            self._refresh(force=False)
+
+        key = self._keys.get(kid)
+        if key is None and self._refetch_allowed():
+            logger.info("Unknown JWKS kid %s, refetching key set", kid)
+            self._refresh(force=True)
+            key = self._keys.get(kid)
+        return key
+
+    def load(self, jwks, ttl=None):
+        """Replaces the cached keys with the keys of a JWKS document"""
+        keys = {}
+        for key in jwks.get('keys', []):
+            if 'kid' not in key:
+                continue
+            keys[key['kid']] = {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key.get('use', 'sig'),
+                'n': key['n'],
+                'e': key['e']
+            }
+        ttl = self.default_ttl if ttl is None else ttl
+        self._keys = keys
+        self._expires_at = time.monotonic() + ttl
+        self._schedule_refresh(ttl)
+
+    def clear(self):
+        """Drops all cached keys and cancels the background refresh"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._keys = {}
+            self._expires_at = 0.0
+            self._last_fetch = None
+
+    def _refetch_allowed(self):
+        return (self._last_fetch is None or
+                time.monotonic() - self._last_fetch >= self.min_refetch_interval)
+
+    def _refresh(self, force):
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            if not force and time.monotonic() < self._expires_at:
+                return
+            if not self._refetch_allowed():
+                if force or self._keys:
+                    return
+                raise AuthError({
+                    'code': 'jwks_unavailable',
+                    'description': 'Unable to fetch signing keys.'
+                }, 503)
+            self._last_fetch = time.monotonic()
+            try:
+                jwks, ttl = self._fetch()
+            except Exception as e:
+                if self._keys:
+                    logger.warning("JWKS refresh failed, serving cached keys: %s", e)
+                    self._expires_at = time.monotonic() + self.min_refetch_interval
+                    return
+                logger.error("Unable to fetch JWKS: %s", e)
+                raise AuthError({
+                    'code': 'jwks_unavailable',
+                    'description': 'Unable to fetch signing keys.'
+                }, 503)
+            self.load(jwks, ttl)
+
+    def _fetch(self):
+        if not urlparse(self.url).scheme:
+            with open(self.url) as f:
+                return json.load(f), None
+
+        with urlopen(self.url, timeout=self.fetch_timeout) as response:
+            jwks = json.loads(response.read())
+            cache_control = response.headers.get('Cache-Control', '') if response.headers else ''
+        match = re.search(r'max-age=(\d+)', cache_control or '')
+        if not match:
+            return jwks, None
+        # Never refetch more often than the unknown-kid rate limit allows
+        return jwks, max(int(match.group(1)), self.min_refetch_interval)
+
+    def _schedule_refresh(self, ttl):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        delay = ttl - self.refresh_margin
+        if delay <= 0:
+            return
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            self._refresh(force=True)
+        except AuthError:
+            pass
+
+
+jwks_store = JWKSKeyStore(JWKS_URL)
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU cache of verified token payloads keyed by token digest
+
+    Entries expire at the token's `exp` claim (or after `max_ttl` seconds,
+    whichever comes first), so a cached payload never outlives its token.
+    Tokens without an `exp` claim are never cached. When a shared backend
+    is configured, payloads are also stored there so other workers can
+    reuse the verification.
+    """
+    def __init__(self, max_size=TOKEN_CACHE_SIZE, max_ttl=TOKEN_CACHE_MAX_TTL, backend=None):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self.backend = backend
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token):
+        """Returns the cache key for a token"""
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        """
+        Returns the cached payload for a token
+
+        Args:
+            token (str): A JSON Web Token (JWT)
+
+        Returns:
+            payload (dict): The verified payload, or None on a miss
+        """
+        key = self.digest(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                payload, expires_at = entry
+                if now < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._entries[key]
+
+        if self.backend is not None:
+            data = self.backend.get(key)
+            if data is not None:
+                payload = json.loads(data)
+                expires_at = self._expires_at(payload, now)
+                if now < expires_at:
+                    self._store(key, payload, expires_at)
+                    with self._lock:
+                        self.shared_hits += 1
+                    return payload
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, token, payload):
+        """Caches the verified payload of a token until it expires"""
+        now = time.time()
+        expires_at = self._expires_at(payload, now)
+        if expires_at <= now:
+            return
+
+        key = self.digest(token)
+        self._store(key, payload, expires_at)
+        if self.backend is not None and int(expires_at - now) >= 1:
+            self.backend.set(key, json.dumps(payload).encode('utf-8'), int(expires_at - now))
+
+    def clear(self):
+        """Drops all local entries and resets the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.shared_hits = self.misses = 0
+
+    def stats(self):
+        """Returns hit/miss counters and the current size"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'size': len(self._entries)
+            }
+
+    def _expires_at(self, payload, now):
+        exp = payload.get('exp')
+        if not isinstance(exp, (int, float)):
+            return now
+        return min(float(exp), now + self.max_ttl)
+
+    def _store(self, key, payload, expires_at):
+        with self._lock:
+            self._entries[key] = (payload, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+token_cache = VerifiedTokenCache(backend=get_backend(TOKEN_CACHE_URL, prefix='trivia:token:'))
+
+
 def get_token_auth_header():
     """
     Obtains the Access Token from the Authorization Header
@@ -37,8 +310,22 @@ def get_token_auth_header():
     Raises:
         AuthError: If no header is present or header is malformed
     """
-    auth = request.headers.get('Authorization', None)
+    return parse_auth_header(request.headers.get('Authorization', None))
 
+
+def parse_auth_header(auth):
+    """
+    Extracts the bearer token from an Authorization header value
+
+    Args:
+        auth (str): The Authorization header value, or None
+
+    Returns:
+        token (str): The token part of the header
+
+    Raises:
+        AuthError: If no header is present or header is malformed
+    """
     if not auth:
         raise AuthError({
             'code': 'authorization_header_missing',
@@ -112,30 +399,20 @@ def verify_decode_jwt(token):
     Raises:
         AuthError: If the token is invalid, expired, or has incorrect claims
     """
-    # Get the public key from Auth0
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
+    # Imported on first use: jose and its crypto backend add to every worker's boot time
+    from jose import jwt
 
     # Get the data in the header
     unverified_header = jwt.get_unverified_header(token)
 
-    # Choose our key
-    rsa_key = {}
+    # Choose our key from the cached key set
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = jwks_store.get_key(unverified_header['kid'])
 
     # Verify the token
     if rsa_key:
@@ -195,10 +472,49 @@ def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            with phase('auth'):
+                token = get_token_auth_header()
+                payload = token_cache.get(token)
+                if payload is None:
+                    payload = verify_decode_jwt(token)
+                    token_cache.set(token, payload)
+                check_permissions(permission, payload)
             return f(payload, *args, **kwargs)
 
         return wrapper
     return requires_auth_decorator
+
+
+async def verify_auth_header_async(auth, permission=''):
+    """
+    Async counterpart of requires_auth for the ASGI entry point
+
+    Cached tokens are checked on the event loop. Verification of a new
+    token (which may have to fetch the signing keys) and shared cache
+    lookups run in a worker thread, so they never block the loop.
+
+    Args:
+        auth (str): The Authorization header value, or None
+        permission (str): Permission string (e.g., 'get:categories')
+
+    Returns:
+        payload (dict): The verified JWT payload
+
+    Raises:
+        AuthError: If the token is missing, invalid or lacks the permission
+    """
+    token = parse_auth_header(auth)
+    if token_cache.backend is None:
+        payload = token_cache.get(token)
+    else:
+        payload = await asyncio.to_thread(token_cache.get, token)
+
+    if payload is None:
+        payload = await asyncio.to_thread(verify_decode_jwt, token)
+        if token_cache.backend is None:
+            token_cache.set(token, payload)
+        else:
+            await asyncio.to_thread(token_cache.set, token, payload)
+
+    check_permissions(permission, payload)
+    return payload
@@ -0,0 +1,537 @@
+"""
+Trivia API Benchmark
+Seeds a database, starts the API against a local JWKS and measures latency and throughput per route
+
+Usage:
+    python benchmark.py run --questions 100000 --concurrency 1,16,64 --output results.json
+    python benchmark.py compare baseline.json results.json
+    python benchmark.py boot --runs 20
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CATEGORIES = ('Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports')
+PERMISSIONS = ('get:questions', 'get:categories', 'post:questions', 'delete:questions')
+# Words questions are built from, so searches have predictable hits
+WORDS = ('planet', 'river', 'painter', 'empire', 'album', 'league', 'element', 'mountain',
+         'novel', 'battle', 'composer', 'island', 'theorem', 'dynasty', 'stadium', 'film',
+         'ocean', 'sculptor', 'treaty', 'galaxy', 'desert', 'opera', 'champion', 'molecule')
+SEED_BATCH_SIZE = 10000
+
+
+class Scenario:
+    """One route under load: builds a (method, path, body) request for a worker"""
+    def __init__(self, name, method, auth, build, write=False):
+        self.name = name
+        self.method = method
+        self.auth = auth
+        self.build = build
+        self.write = write
+
+
+def _page(rng, total, per_page=10):
+    return rng.randint(1, max(1, min(total // per_page, 1000)))
+
+
+SCENARIOS = {
+    scenario.name: scenario for scenario in (
+        Scenario('categories', 'GET', True, lambda rng, n: ('/categories', None)),
+        Scenario('questions_page', 'GET', True,
+                 lambda rng, n: (f'/questions?page={_page(rng, n)}', None)),
+        Scenario('questions_cursor', 'GET', True,
+                 lambda rng, n: (f'/questions?cursor={_cursor(rng.randint(0, n))}&include_total=false',
+                                 None)),
+        Scenario('category_questions', 'GET', False,
+                 lambda rng, n: (f'/categories/{rng.randint(1, len(CATEGORIES))}/questions'
+                                 f'?page={_page(rng, n // len(CATEGORIES))}', None)),
+        Scenario('search', 'POST', False,
+                 lambda rng, n: ('/questions/search', {'searchTerm': rng.choice(WORDS)})),
+        Scenario('quiz', 'POST', False,
+                 lambda rng, n: ('/quizzes', {
+                     'previous_questions': [rng.randint(1, n) for _ in range(5)],
+                     'quiz_category': _quiz_category(rng)})),
+        Scenario('quiz_session', 'POST', False,
+                 lambda rng, n: ('/quizzes/sessions', {'quiz_category': _quiz_category(rng)})),
+        Scenario('create_question', 'POST', True,
+                 lambda rng, n: ('/questions', {
+                     'question': f'Benchmark {_sentence(rng)}?',
+                     'answer': rng.choice(WORDS),
+                     'category': rng.randint(1, len(CATEGORIES)),
+                     'difficulty': rng.randint(1, 5)}), write=True),
+        Scenario('export', 'GET', True,
+                 lambda rng, n: (f'/questions/export?category={rng.randint(1, len(CATEGORIES))}', None)),
+    )
+}
+DEFAULT_SCENARIOS = ('categories', 'questions_page', 'questions_cursor', 'category_questions',
+                     'search', 'quiz', 'quiz_session', 'create_question')
+
+
+def _cursor(after_id):
+    from flaskr.pagination import encode_cursor
+    return encode_cursor(after_id)
+
+
+def _quiz_category(rng):
+    category_id = rng.randint(0, len(CATEGORIES))
+    if category_id == 0:
+        return {'id': 0, 'type': 'click'}
+    return {'id': category_id, 'type': CATEGORIES[category_id - 1]}
+
+
+def _sentence(rng, words=6):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+# Auth0 stand-in
+
+def _b64(number):
+    data = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def create_local_auth(directory):
+    """
+    Signs a token with every permission, with a key whose JWKS is written next to it
+
+    The key is kept in `directory` and reused by later runs, so a server
+    started with JWKS_URL=<directory>/jwks.json keeps trusting the tokens.
+
+    Returns:
+        (jwks_path, token): Point JWKS_URL at jwks_path; send the token as a Bearer token
+    """
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from jose import jwt
+
+    import auth
+
+    key_path = os.path.join(directory, 'signing-key.pem')
+    jwks_path = os.path.join(directory, 'jwks.json')
+    if os.path.exists(key_path):
+        with open(key_path, 'rb') as f:
+            pem = f.read()
+        private_key = serialization.load_pem_private_key(pem, password=None)
+    else:
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                        serialization.NoEncryption())
+        with open(key_path, 'wb') as f:
+            f.write(pem)
+    numbers = private_key.public_key().public_numbers()
+    with open(jwks_path, 'w') as f:
+        json.dump({'keys': [{'kty': 'RSA', 'kid': 'benchmark', 'use': 'sig',
+                             'n': _b64(numbers.n), 'e': _b64(numbers.e)}]}, f)
+
+    now = int(time.time())
+    token = jwt.encode({
+        'iss': f'https://{auth.AUTH0_DOMAIN}/',
+        'aud': auth.API_AUDIENCE,
+        'sub': 'benchmark|1',
+        'iat': now,
+        'exp': now + 24 * 3600,
+        'permissions': list(PERMISSIONS)
+    }, pem, algorithm='RS256', headers={'kid': 'benchmark'})
+    return jwks_path, token
+
+
+# Database
+
+def seed_database(database_url, questions, seed=0):
+    """
+    Creates the schema and fills the database with `questions` generated questions
+
+    Categories are created once; questions are only added up to the
+    requested count, so an existing benchmark database is reused.
+
+    Returns:
+        total (int): Number of questions in the database
+    """
+    os.environ['DATABASE_URL'] = database_url
+    from sqlalchemy import insert
+
+    from flaskr import create_app
+    from models import db, Category, Question
+
+    app = create_app(database_url)
+    rng = random.Random(seed)
+    with app.app_context():
+        if Category.query.count() == 0:
+            for category_type in CATEGORIES:
+                Category(category_type).insert()
+
+        existing = Question.query.count()
+        started = time.perf_counter()
+        while existing < questions:
+            batch = [{
+                'question': f'Which {_sentence(rng)} is number {existing + i}?',
+                'answer': f'{rng.choice(WORDS)} {existing + i}',
+                'category': rng.randint(1, len(CATEGORIES)),
+                'difficulty': rng.randint(1, 5)
+            } for i in range(min(SEED_BATCH_SIZE, questions - existing))]
+            db.session.execute(insert(Question), batch)
+            db.session.commit()
+            existing += len(batch)
+            print(f'seeded {existing}/{questions} questions', file=sys.stderr)
+        if questions and existing == questions:
+            print(f'seeding took {time.perf_counter() - started:.1f}s', file=sys.stderr)
+        total = Question.query.count()
+        db.engine.dispose()
+    return total
+
+
+# Server
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, env, workers, threads):
+    """
+    Starts the API in a subprocess (gunicorn for WSGI, uvicorn for the ASGI entry point)
+
+    Returns:
+        (process, base_url)
+    """
+    port = _free_port()
+    if kind == 'asgi':
+        command = [sys.executable, '-m', 'uvicorn', '--factory', 'flaskr.asgi:create_asgi_app',
+                   '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers),
+                   '--log-level', 'warning']
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+                   '--workers', str(workers), '--threads', str(threads), '--log-level', 'warning',
+                   'flaskr:create_app()']
+    log = open(os.path.join(tempfile.gettempdir(), f'trivia-benchmark-{port}.log'), 'w')
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=log)
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server exited with {process.returncode}, see {log.name}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/categories/1/questions')
+            connection.getresponse().read()
+            connection.close()
+            return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'Server did not start within 60s, see {log.name}')
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# Load generation
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(base_url, scenario, token, questions, concurrency, duration, warmup, seed):
+    """
+    Sends the scenario's requests from `concurrency` threads for `duration` seconds
+
+    Each thread keeps its own keep-alive connection and sends its next
+    request as soon as the previous one completes (closed loop).
+
+    Returns:
+        result (dict): Counts, throughput and latency percentiles in milliseconds
+    """
+    url = urlparse(base_url)
+    headers = {'Content-Type': 'application/json'}
+    if scenario.auth:
+        headers['Authorization'] = f'Bearer {token}'
+
+    latencies = [[] for _ in range(concurrency)]
+    statuses = [{} for _ in range(concurrency)]
+    errors = [0] * concurrency
+    start = threading.Barrier(concurrency + 1)
+    state = {'measure_from': None, 'stop_at': None}
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+        start.wait()
+        while True:
+            now = time.perf_counter()
+            if now >= state['stop_at']:
+                break
+            path, body = scenario.build(rng, questions)
+            data = json.dumps(body).encode('utf-8') if body is not None else None
+            try:
+                connection.request(scenario.method, path, body=data, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    connection.close()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                status = None
+            finished = time.perf_counter()
+            if now < state['measure_from']:
+                continue
+            if status is None:
+                errors[index] += 1
+                continue
+            statuses[index][status] = statuses[index].get(status, 0) + 1
+            latencies[index].append(finished - now)
+        connection.close()
+
+    threads = [threading.Thread(target=worker, args=(index,), daemon=True) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    state['measure_from'] = time.perf_counter() + warmup
+    state['stop_at'] = state['measure_from'] + duration
+    start.wait()
+    for thread in threads:
+        thread.join()
+
+    samples = sorted(latency for worker_latencies in latencies for latency in worker_latencies)
+    status_counts = {}
+    for worker_statuses in statuses:
+        for status, count in worker_statuses.items():
+            status_counts[str(status)] = status_counts.get(str(status), 0) + count
+    failed = sum(count for status, count in status_counts.items() if not status.startswith('2'))
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        'scenario': scenario.name,
+        'method': scenario.method,
+        'concurrency': concurrency,
+        'duration_s': duration,
+        'requests': len(samples),
+        'rps': round(len(samples) / duration, 1),
+        'errors': sum(errors),
+        'non_2xx': failed,
+        'status_counts': status_counts,
+        'latency_ms': {
+            'p50': ms(percentile(samples, 0.50)),
+            'p95': ms(percentile(samples, 0.95)),
+            'p99': ms(percentile(samples, 0.99)),
+            'mean': ms(sum(samples) / len(samples)) if samples else None,
+            'max': ms(samples[-1]) if samples else None,
+        }
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+TABLE_HEADER = f"{'scenario':<20}{'conc':>6}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'failed':>8}"
+
+
+def _print_row(result):
+    latency = result['latency_ms']
+    print(f"{result['scenario']:<20}{result['concurrency']:>6}{result['rps']:>10}"
+          f"{latency['p50'] or '-':>10}{latency['p95'] or '-':>10}{latency['p99'] or '-':>10}"
+          f"{result['non_2xx'] + result['errors']:>8}", file=sys.stderr)
+
+
+def run(args):
+    directory = args.workdir or tempfile.mkdtemp(prefix='trivia-benchmark-')
+    os.makedirs(directory, exist_ok=True)
+    database_url = args.database_url or f"sqlite:///{os.path.join(directory, 'trivia.db')}"
+    jwks_path, token = create_local_auth(directory)
+    total = seed_database(database_url, args.questions, seed=args.seed)
+
+    env = dict(os.environ, DATABASE_URL=database_url, JWKS_URL=jwks_path, RATELIMIT_ENABLED='false')
+    names = args.scenarios.split(',') if args.scenarios else list(DEFAULT_SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    process = None
+    base_url = args.url
+    if base_url is None:
+        process, base_url = start_server(args.server, env, args.workers, args.threads)
+    results = []
+    print(TABLE_HEADER, file=sys.stderr)
+    try:
+        # Writes run last so they do not change the data the reads see
+        for scenario in sorted((SCENARIOS[name] for name in names), key=lambda s: s.write):
+            for concurrency in levels:
+                result = run_scenario(base_url, scenario, token, total, concurrency,
+                                      args.duration, args.warmup, args.seed)
+                results.append(result)
+                _print_row(result)
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    report = {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'database': database_url.split(':', 1)[0],
+        'questions': total,
+        'server': 'external' if args.url else args.server,
+        'workers': args.workers,
+        'threads': args.threads,
+        'seed': args.seed,
+        'results': results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+# Run in a new interpreter per measurement, so nothing is imported or cached yet
+BOOT_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import flaskr
+imported = time.perf_counter()
+flaskr.create_app()
+print(json.dumps({'import': imported - started, 'create_app': time.perf_counter() - imported}))
+"""
+
+
+def boot(args):
+    """Measures how long a new worker process takes to import and create the app"""
+    directory = args.workdir or tempfile.mkdtemp(prefix='trivia-benchmark-')
+    os.makedirs(directory, exist_ok=True)
+    database_url = args.database_url or f"sqlite:///{os.path.join(directory, 'trivia.db')}"
+    seed_database(database_url, args.questions)
+
+    env = dict(os.environ, DATABASE_URL=database_url, LOG_LEVEL='WARNING')
+    if args.no_create_all:
+        env['DB_CREATE_ALL'] = 'false'
+    samples = {'process': [], 'import': [], 'create_app': []}
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', BOOT_SCRIPT], cwd=BACKEND_DIR, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        samples['process'].append(time.perf_counter() - started)
+        for step, seconds in json.loads(output.splitlines()[-1]).items():
+            samples[step].append(seconds)
+
+    report = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'database': database_url.split(':', 1)[0],
+        'create_all': not args.no_create_all,
+        'runs': args.runs,
+        'boot_ms': {step: {
+            'p50': round(percentile(sorted(values), 0.5) * 1000, 1),
+            'min': round(min(values) * 1000, 1),
+            'max': round(max(values) * 1000, 1),
+        } for step, values in samples.items()}
+    }
+    print(json.dumps(report, indent=2))
+
+
+def compare(args):
+    """Prints the change in throughput and p95 per scenario; exits 1 on a regression"""
+    with open(args.baseline) as f:
+        baseline = {(r['scenario'], r['concurrency']): r for r in json.load(f)['results']}
+    with open(args.candidate) as f:
+        candidate = json.load(f)['results']
+
+    regressions = 0
+    print(f"{'scenario':<20}{'conc':>6}{'rps':>18}{'p95 ms':>22}")
+    for result in candidate:
+        before = baseline.get((result['scenario'], result['concurrency']))
+        if before is None or not before['rps'] or not before['latency_ms']['p95']:
+            continue
+        rps_change = (result['rps'] - before['rps']) / before['rps'] * 100
+        p95_change = (result['latency_ms']['p95'] - before['latency_ms']['p95']) / before['latency_ms']['p95'] * 100
+        regressed = rps_change < -args.threshold or p95_change > args.threshold
+        regressions += regressed
+        print(f"{result['scenario']:<20}{result['concurrency']:>6}"
+              f"{before['rps']:>9} {rps_change:+6.1f}%"
+              f"{before['latency_ms']['p95']:>12} {p95_change:+6.1f}%"
+              f"{'  REGRESSION' if regressed else ''}")
+    sys.exit(1 if regressions else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Seed, start the API and measure every scenario')
+    run_parser.add_argument('--questions', type=int, default=1000,
+                            help='Questions in the database (1000 to 1000000)')
+    run_parser.add_argument('--database-url',
+                            help='Database to seed and serve (default: a new SQLite file)')
+    run_parser.add_argument('--workdir', help='Keeps the SQLite database and signing key for '
+                                              'later runs (default: a new temporary directory)')
+    run_parser.add_argument('--scenarios', help=f"Comma-separated, from {', '.join(SCENARIOS)}")
+    run_parser.add_argument('--concurrency', default='1,8,32', help='Comma-separated client threads')
+    run_parser.add_argument('--duration', type=float, default=10, help='Measured seconds per run')
+    run_parser.add_argument('--warmup', type=float, default=2, help='Unmeasured seconds per run')
+    run_parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi',
+                            help='gunicorn (wsgi) or uvicorn with flaskr.asgi (asgi)')
+    run_parser.add_argument('--workers', type=int, default=2, help='Server worker processes')
+    run_parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker')
+    run_parser.add_argument('--url', help='Benchmark a running server instead (it must use the '
+                                          'same database and JWKS_URL=<workdir>/jwks.json)')
+    run_parser.add_argument('--seed', type=int, default=0, help='Random seed of data and requests')
+    run_parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser('compare', help='Compare two JSON reports')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=10,
+                                help='Percent change in rps or p95 reported as a regression')
+    compare_parser.set_defaults(handler=compare)
+
+    boot_parser = commands.add_parser('boot', help='Measure the start-up time of a worker process')
+    boot_parser.add_argument('--runs', type=int, default=10, help='Processes started')
+    boot_parser.add_argument('--questions', type=int, default=1000, help='Questions in the database')
+    boot_parser.add_argument('--database-url',
+                             help='Database to start against (default: a new SQLite file)')
+    boot_parser.add_argument('--workdir', help='Keeps the SQLite database for later runs')
+    boot_parser.add_argument('--no-create-all', action='store_true',
+                             help='Start with DB_CREATE_ALL=false (schema from migrations)')
+    boot_parser.set_defaults(handler=boot)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
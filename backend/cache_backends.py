@@ -0,0 +1,122 @@
+"""
+Shared Cache Backends
+Key/value stores that let in-process caches share entries across gunicorn workers
+"""
+
+import logging
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class RedisBackend:
+    """
+    Redis (or any Redis-compatible server) backed key/value store
+
+    The `redis` package is an optional dependency and is only imported
+    when a backend is configured. Every operation swallows connection
+    errors, so an unavailable server degrades to a cache miss instead of
+    failing the request.
+    """
+    def __init__(self, url, prefix=''):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError(
+                'The redis package is required for a shared cache backend: pip install redis')
+
+        self.url = url
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+
+    def get(self, key):
+        """Returns the stored bytes for a key, or None"""
+        try:
+            return self.client.get(self.prefix + key)
+        except Exception as e:
+            logger.warning("Shared cache get failed: %s", e)
+            return None
+
+    def set(self, key, value, ttl):
+        """Stores bytes under a key for `ttl` seconds"""
+        try:
+            self.client.set(self.prefix + key, value, ex=max(int(ttl), 1))
+        except Exception as e:
+            logger.warning("Shared cache set failed: %s", e)
+
+    def delete(self, key):
+        """Removes a key, returns False if it did not exist"""
+        try:
+            return self.client.delete(self.prefix + key) > 0
+        except Exception as e:
+            logger.warning("Shared cache delete failed: %s", e)
+            return False
+
+    def set_list(self, key, values, ttl, chunk_size=10000):
+        """Stores a list of values under a key for `ttl` seconds, returns False on failure"""
+        key = self.prefix + key
+        try:
+            pipeline = self.client.pipeline()
+            pipeline.delete(key)
+            for start in range(0, len(values), chunk_size):
+                pipeline.rpush(key, *values[start:start + chunk_size])
+            pipeline.expire(key, max(int(ttl), 1))
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logger.warning("Shared cache set_list failed: %s", e)
+            return False
+
+    def list_item(self, key, index, ttl):
+        """
+        Reads one item of a list and renews its `ttl`
+
+        Returns:
+            (item, length): item is None when `index` is past the end, or None
+            when the list does not exist
+        """
+        try:
+            pipeline = self.client.pipeline()
+            pipeline.lindex(self.prefix + key, index)
+            pipeline.llen(self.prefix + key)
+            pipeline.expire(self.prefix + key, max(int(ttl), 1))
+            item, length, exists = pipeline.execute()
+        except Exception as e:
+            logger.warning("Shared cache list_item failed: %s", e)
+            return None
+        return (item, length) if exists else None
+
+    def incr(self, key, ttl):
+        """Atomically increments a counter and renews its `ttl`, returns the new value or None"""
+        try:
+            pipeline = self.client.pipeline()
+            pipeline.incr(self.prefix + key)
+            pipeline.expire(self.prefix + key, max(int(ttl), 1))
+            return pipeline.execute()[0]
+        except Exception as e:
+            logger.warning("Shared cache incr failed: %s", e)
+            return None
+
+
+def get_backend(url, prefix=''):
+    """
+    Builds a shared cache backend from a URL
+
+    Args:
+        url (str): Backend URL (e.g. 'redis://localhost:6379/0'), or None
+        prefix (str): Prefix added to every key
+
+    Returns:
+        backend: A backend instance, or None when no URL is configured
+
+    Raises:
+        ValueError: If the URL scheme is not supported
+    """
+    if not url:
+        return None
+
+    scheme = urlparse(url).scheme
+    if scheme in ('redis', 'rediss', 'unix'):
+        return RedisBackend(url, prefix=prefix)
+
+    raise ValueError(f'Unsupported cache backend: {url}')
@@ -0,0 +1,239 @@
+"""
+Database Connection Pooling
+Pool configuration from the environment, pre-ping by idle interval and pool statistics
+"""
+
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+# queue: pool connections in each worker; pgbouncer: open a connection per
+# checkout and let PgBouncer (transaction pooling) share server connections
+DB_POOL_MODE = os.environ.get('DB_POOL_MODE', 'queue')
+# Connections kept open per worker, and extra connections opened under bursts
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '20'))
+# Seconds a request waits for a connection before failing
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+# Seconds after which a connection is replaced (-1 never)
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '300'))
+# Reuse the most recently returned connection, so idle extras can time out server side
+DB_POOL_USE_LIFO = os.environ.get('DB_POOL_USE_LIFO', 'true').lower() in ('1', 'true', 'yes')
+# Ping a connection on checkout only if it sat idle this many seconds
+# (0 pings on every checkout, -1 never pings)
+DB_POOL_PRE_PING_INTERVAL = float(os.environ.get('DB_POOL_PRE_PING_INTERVAL', '30'))
+
+POOL_MODES = ('queue', 'pgbouncer')
+
+
+class PoolStats:
+    """
+    Checkout counters of one engine's pool
+
+    Wait time is measured around the pool's internal checkout, so it
+    includes time spent blocked on a full pool and opening new
+    connections, but not pings or checkout events.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+            self.connects = 0
+            self.pings = 0
+            self.ping_failures = 0
+
+    def record_checkout(self, wait, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def record_ping(self, ok):
+        with self._lock:
+            self.pings += 1
+            if not ok:
+                self.ping_failures += 1
+
+    def snapshot(self):
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_avg_ms': round(self.wait_total / attempts * 1000, 3) if attempts else 0.0,
+                'wait_max_ms': round(self.wait_max * 1000, 3),
+                'wait_total_s': round(self.wait_total, 3),
+                'connects': self.connects,
+                'pings': self.pings,
+                'ping_failures': self.ping_failures
+            }
+
+
+def timed_pool_class(base, stats):
+    """Returns a subclass of a pool class that records checkout wait times in `stats`"""
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = base._do_get(self)
+        except exc.TimeoutError:
+            stats.record_checkout(time.perf_counter() - started, timed_out=True)
+            raise
+        stats.record_checkout(time.perf_counter() - started)
+        return connection
+
+    # Pools are recreated from their class on dispose(), so the stats survive
+    return type(f'Timed{base.__name__}', (base,), {'_do_get': _do_get, 'stats': stats})
+
+
+def get_engine_options(url, is_async=False, stats=None):
+    """
+    Returns the create_engine keyword arguments of the configured pool
+
+    Args:
+        url (str): The database URL
+        is_async (bool): Whether the options are for an asyncio engine
+        stats (PoolStats): Records checkout wait times when given
+
+    Raises:
+        ValueError: If DB_POOL_MODE is unknown
+    """
+    if DB_POOL_MODE not in POOL_MODES:
+        raise ValueError(f"DB_POOL_MODE must be one of {', '.join(POOL_MODES)}, not {DB_POOL_MODE}")
+
+    url = make_url(url)
+    options = {}
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # In-memory databases live in a single static connection
+        return options
+
+    if DB_POOL_MODE == 'pgbouncer':
+        pool_class = NullPool
+        if is_async and url.get_backend_name() == 'postgresql':
+            # Prepared statements do not survive a transaction-pooled server connection
+            options['connect_args'] = {'statement_cache_size': 0,
+                                       'prepared_statement_cache_size': 0}
+    else:
+        pool_class = AsyncAdaptedQueuePool if is_async else QueuePool
+        options.update({
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_timeout': DB_POOL_TIMEOUT,
+            'pool_recycle': DB_POOL_RECYCLE,
+            'pool_use_lifo': DB_POOL_USE_LIFO,
+            'pool_pre_ping': DB_POOL_PRE_PING_INTERVAL == 0,
+        })
+
+    options['poolclass'] = timed_pool_class(pool_class, stats) if stats is not None else pool_class
+    return options
+
+
+def instrument_engine(engine, stats, pre_ping_interval=DB_POOL_PRE_PING_INTERVAL):
+    """
+    Adds pre-ping by idle interval and connection counting to an engine's pool
+
+    A connection is pinged on checkout only when it has been idle in the
+    pool for `pre_ping_interval` seconds, so busy connections skip the
+    extra round trip. A failed ping discards the connection and the pool
+    retries the checkout with a fresh one.
+    """
+    # Pool events of an asyncio engine are registered on its sync engine
+    engine = getattr(engine, 'sync_engine', engine)
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        stats.record_connect()
+        connection_record.info['idle_since'] = time.monotonic()
+
+    if pre_ping_interval <= 0 or isinstance(engine.pool, NullPool):
+        return engine
+
+    @event.listens_for(engine, 'checkin')
+    def on_checkin(dbapi_connection, connection_record):
+        if connection_record is not None:
+            connection_record.info['idle_since'] = time.monotonic()
+
+    @event.listens_for(engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        idle_since = connection_record.info.get('idle_since', 0.0)
+        if time.monotonic() - idle_since < pre_ping_interval:
+            return
+        try:
+            engine.dialect.do_ping(dbapi_connection)
+        except Exception as e:
+            stats.record_ping(False)
+            logger.warning("Discarding a stale database connection: %s", e)
+            raise exc.DisconnectionError() from e
+        stats.record_ping(True)
+
+    return engine
+
+
+def get_pool_status(engine, stats):
+    """Returns the current state and counters of an engine's pool"""
+    pool = getattr(engine, 'sync_engine', engine).pool
+    if isinstance(pool, QueuePool):
+        status = {
+            'mode': 'queue',
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow,
+            'timeout': pool.timeout(),
+        }
+    elif isinstance(pool, NullPool):
+        status = {'mode': 'pgbouncer'}
+    else:
+        status = {'mode': type(pool).__name__}
+    status.update(stats.snapshot())
+    return status
+
+
+def register_pool(name, engine, stats):
+    """Makes an engine's pool visible in get_pools_status"""
+    pools[name] = (engine, stats)
+
+
+def get_pools_status():
+    """Returns get_pool_status of every registered engine by name"""
+    return {name: get_pool_status(engine, stats) for name, (engine, stats) in list(pools.items())}
+
+
+# Engines of this process ('default' for the Flask app, 'async' for the ASGI entry point)
+pools = {}
+
+
+def dispose_pools_after_fork():
+    """
+    Drops the pooled connections a forked process inherited from its parent
+
+    With `gunicorn --preload` the app is created, and may connect, before
+    the workers are forked. A worker must not share its parent's sockets,
+    so it empties its pools without closing them (closing would also end
+    the parent's sessions); new connections are opened on first use.
+    """
+    for engine, _ in list(pools.values()):
+        getattr(engine, 'sync_engine', engine).dispose(close=False)
+
+
+os.register_at_fork(after_in_child=dispose_pools_after_fork)
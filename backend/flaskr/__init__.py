@@ -1,48 +1,102 @@
+import io
 import os
 import logging
-from flask import Flask, request, abort, jsonify
+import time
+from flask import Flask, Response, request, abort, jsonify, current_app, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-import random
 
-from models import setup_db, Question, Category
+from models import db, setup_db, Question, Category
 from auth import AuthError, requires_auth
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from db_pool import get_pools_status
+from instrumentation import (METRICS_ENABLED, METRICS_PUBLIC, authorize_metrics, boot_step,
+                             init_instrumentation, metrics, record_boot_time)
+from replicas import read_replica
+from structured_logging import configure_logging, init_request_ids
+from .bulk import (BULK_IMPORT_BATCH_SIZE, READERS, BulkImporter, delete_questions,
+                   get_batch_conditions, get_import_format, questions_cli, update_questions,
+                   validate_batch_update, validate_question)
+from .batch import fetch_questions_in_order, parse_question_ids
+from .categories import category_cache
+from .export import ENCODERS, EXPORT_MIMETYPES, export_questions
+from .pagination import (MAX_QUESTIONS_PER_PAGE, QUESTIONS_PER_PAGE, decode_cursor, get_page_args,
+                         keyset_paginate_questions, paginate_questions)
+from .rate_limit import RATELIMIT_ENABLED, TimedLimiter, get_limiter_options
+from .response_cache import response_cache
+from .quiz import (QuizRequestError, end_quiz_session_plan, quiz_plan, quiz_session_plan,
+                   run_quiz_plan)
+from .search import QuestionSearch
+from .serialization import json_response, question_json_cache
+
+# Configure logging (format, level and background writing come from LOG_* variables)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-QUESTIONS_PER_PAGE = 10
+def batch_fetch_response(ids):
+    """
+    Responds with the questions of a batch fetch, in the order they were requested
+
+    Args:
+        ids (list or str): Question ids, or a comma separated string of them
+    """
+    ids, error = parse_question_ids(ids)
+    if error is not None:
+        logger.warning("Invalid batch fetch: %s", error)
+        abort(400)
+
+    try:
+        rows, missing = fetch_questions_in_order(ids)
+        logger.info("Fetched %s of %s requested questions", len(rows), len(ids))
+        return json_response({
+            'questions': question_json_cache.encode_rows(rows),
+            'total_questions': len(rows),
+            'missing': missing,
+            'success': True
+        })
+
+    except Exception as e:
+        logger.error("Error fetching questions by id: %s", e)
+        abort(500)
 
-def paginate_questions(request, data):
-    page = request.args.get('page', 1, type=int)
-    start = (page -1 ) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-    data = [item.format() for item in data]
-    return data[start:end]
 
 def create_app(test_config=None):
     # create and configure the app
+    started = time.perf_counter()
     app = Flask(__name__)
 
-    if test_config is None:
-        setup_db(app)
-    else:
-        # database_path = test_config.get('SQLALCHEMY_DATABASE_URI')
-        setup_db(app, database_path=test_config)
+    with boot_step('setup_db'):
+        if test_config is None:
+            setup_db(app)
+        else:
+            # database_path = test_config.get('SQLALCHEMY_DATABASE_URI')
+            setup_db(app, database_path=test_config)
+
+    # Request ids for log correlation, echoed in X-Request-ID
+    init_request_ids(app)
+
+    # Per-route phase timings and SQL counts, served by GET /metrics
+    if METRICS_ENABLED:
+        with app.app_context():
+            init_instrumentation(app, db)
+
+    # flask questions import <file>
+    app.cli.add_command(questions_cli)
+
+    # Pick the search engine for the database dialect
+    question_search = QuestionSearch()
+    with boot_step('search'):
+        question_search.init_app(app)
 
-    # Initialize rate limiter
-    limiter = Limiter(
+    # Initialize rate limiter (storage is chosen by RATELIMIT_STORAGE_URI)
+    limiter = TimedLimiter(
         app=app,
         key_func=get_remote_address,
         default_limits=["200 per day", "50 per hour"],
-        storage_uri="memory://"
+        **get_limiter_options()
     )
+    # Switched off after init_app, which skips registering a disabled limiter
+    limiter.enabled = RATELIMIT_ENABLED
 
     """
     @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -55,7 +109,7 @@ def create_app(test_config=None):
     @app.after_request
     def after_request(response):
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,true')
-        response.headers.add('Access-Control-Allow-Methods', 'GET,POST,DELETE')
+        response.headers.add('Access-Control-Allow-Methods', 'GET,POST,PATCH,DELETE')
         return response
 
     """
@@ -66,21 +120,23 @@ def create_app(test_config=None):
     @app.route('/categories', methods=['GET'])
     @limiter.limit("100 per hour")
     @requires_auth('get:categories')
+    @read_replica
+    @response_cache.cached(public=False)
     def get_categories(payload):
         try:
             logger.info("Fetching all categories")
-            allCategories = Category.query.all()
+            allCategories = category_cache.get_types()
             if len(allCategories) == 0:
                 logger.warning("No categories found in database")
                 abort(404)
 
-            logger.info(f"Successfully retrieved {len(allCategories)} categories")
+            logger.info("Successfully retrieved %s categories", len(allCategories))
             return jsonify({
                 'success': True,
-                'categories': {category.id: category.type for category in allCategories}
+                'categories': allCategories
             })
         except Exception as e:
-            logger.error(f"Error fetching categories: {str(e)}")
+            logger.error("Error fetching categories: %s", e)
             abort(500)
 
 
@@ -99,40 +155,117 @@ def create_app(test_config=None):
     @app.route('/questions')
     @limiter.limit("100 per hour")
     @requires_auth('get:questions')
+    @read_replica
+    @response_cache.cached(public=False)
     def get_questions(payload):
-        page = request.args.get('page', 1, type=int)
-        try:
-            logger.info(f"Fetching questions for page {page}")
+        # Questions by id (?ids=1,2,3) instead of a page
+        if 'ids' in request.args:
+            return batch_fetch_response(request.args.get('ids'))
 
-            # Validate page number
-            if page < 1:
-                logger.warning(f"Invalid page number: {page}")
-                abort(400)
+        page, per_page = get_page_args(request)
+        cursor = request.args.get('cursor')
+        after_id = decode_cursor(cursor) if cursor is not None else None
+
+        # Validate page number, size and cursor
+        if page is None or per_page is None:
+            logger.warning("Invalid page arguments: %s", request.args)
+            abort(400)
+        if cursor is not None and after_id is None:
+            logger.warning("Invalid cursor: %s", cursor)
+            abort(400)
 
-            questions = Question.query.all()
-            allCategories = Category.query.all()
+        try:
+            next_cursor = None
+            if cursor is not None:
+                logger.info("Fetching questions after cursor %s", cursor)
+                paginated_questions, total_questions, next_cursor = keyset_paginate_questions(
+                    request, Question.query, after_id)
+                bank_is_empty = after_id == 0 and len(paginated_questions) == 0
+            else:
+                logger.info("Fetching questions for page %s", page)
+                paginated_questions, total_questions = paginate_questions(request, Question.query)
+                bank_is_empty = total_questions == 0
+            allCategories = category_cache.get_types()
 
-            if len(questions) == 0:
+            if bank_is_empty:
                 logger.warning("No questions found in database")
                 abort(404)
             if len(allCategories) == 0:
                 logger.warning("No categories found in database")
                 abort(404)
 
-            paginated_questions = paginate_questions(request, questions)
-            logger.info(f"Successfully retrieved {len(paginated_questions)} questions for page {page}")
+            logger.info("Successfully retrieved %s questions", len(paginated_questions))
 
-            return jsonify({
-                'questions': paginated_questions,
-                'total_questions': len(questions),
-                'categories': {category.id: category.type for category in allCategories},
+            response = {
+                'questions': question_json_cache.encode_rows(paginated_questions),
+                'total_questions': total_questions,
+                'categories': allCategories,
                 'current_category': None,
                 'success': True,
-            })
+            }
+            if cursor is not None:
+                response['next_cursor'] = next_cursor
+            return json_response(response)
+
+        except Exception as e:
+            logger.error("Error fetching questions: %s", e)
+            abort(500)
+
+    @app.route('/questions/batch', methods=['POST'])
+    @limiter.limit("100 per hour")
+    @requires_auth('get:questions')
+    @read_replica
+    def batch_fetch_questions(payload):
+        body = request.get_json(silent=True)
+
+        # Validate request body
+        if not body or not isinstance(body, dict):
+            logger.warning("Empty request body for batch fetch")
+            abort(400)
+
+        return batch_fetch_response(body.get('ids'))
+
+    @app.route('/questions/export', methods=['GET'])
+    @limiter.limit("20 per hour")
+    @requires_auth('get:questions')
+    @read_replica
+    def export_question_bank(payload):
+        export_format = request.args.get('format', 'ndjson')
+        category_id = request.args.get('category', type=int)
+        difficulty = request.args.get('difficulty', type=int)
+
+        # Validate format and filters
+        if export_format not in ENCODERS:
+            logger.warning("Unsupported export format: %s", export_format)
+            abort(400)
+        if 'category' in request.args and category_id is None:
+            logger.warning("Invalid export category: %s", request.args.get('category'))
+            abort(400)
+        if 'difficulty' in request.args and (difficulty is None or not 1 <= difficulty <= 5):
+            logger.warning("Invalid export difficulty: %s", request.args.get('difficulty'))
+            abort(400)
+        if category_id is not None and category_cache.get_type(category_id) is None:
+            logger.warning("Category %s not found", category_id)
+            abort(404)
+
+        try:
+            compress = request.accept_encodings['gzip'] > 0
+            logger.info("Exporting questions as %s (gzip: %s)", export_format, compress)
+
+            response = Response(
+                stream_with_context(export_questions(export_format, category_id, difficulty, compress)),
+                mimetype=EXPORT_MIMETYPES[export_format]
+            )
+            response.headers['Content-Disposition'] = f'attachment; filename=questions.{export_format}'
+            response.vary.add('Accept-Encoding')
+            if compress:
+                response.headers['Content-Encoding'] = 'gzip'
+            return response
 
         except Exception as e:
-            logger.error(f"Error fetching questions: {str(e)}")
+            logger.error("Error exporting questions: %s", e)
             abort(500)
+
     """
     @TODO:
     Create an endpoint to DELETE question using a question ID.
@@ -145,30 +278,30 @@ def create_app(test_config=None):
     @requires_auth('delete:questions')
     def delete_question(payload, question_id):
         try:
-            logger.info(f"Attempting to delete question with ID: {question_id}")
+            logger.info("Attempting to delete question with ID: %s", question_id)
 
             # Validate question_id is numeric
             try:
                 question_id_int = int(question_id)
             except ValueError:
-                logger.warning(f"Invalid question ID format: {question_id}")
+                logger.warning("Invalid question ID format: %s", question_id)
                 abort(400)
 
             question = Question.query.get(question_id_int)
             if question:
                 question.delete()
-                logger.info(f"Successfully deleted question with ID: {question_id}")
+                logger.info("Successfully deleted question with ID: %s", question_id)
 
                 # Get remaining questions for response
-                questions = Question.query.all()
-                return jsonify({
+                questions, total_questions = paginate_questions(request, Question.query)
+                return json_response({
                     'success': True,
                     'deleted': question_id,
-                    'questions': paginate_questions(request, questions),
-                    'total_questions': len(questions)
+                    'questions': question_json_cache.encode_rows(questions),
+                    'total_questions': total_questions
                 })
             else:
-                logger.warning(f"Question with ID {question_id} not found")
+                logger.warning("Question with ID %s not found", question_id)
                 return jsonify({
                     "success": False,
                     "error": 404,
@@ -176,7 +309,63 @@ def create_app(test_config=None):
                 }), 404
 
         except Exception as e:
-            logger.error(f"Error deleting question: {str(e)}")
+            logger.error("Error deleting question: %s", e)
+            abort(500)
+
+    @app.route("/questions", methods=['DELETE'])
+    @limiter.limit("50 per hour")
+    @requires_auth('delete:questions')
+    def batch_delete_questions(payload):
+        body = request.get_json(silent=True)
+
+        # Validate the selection
+        if not body or not isinstance(body, dict):
+            logger.warning("Empty request body for batch delete")
+            abort(400)
+        conditions, error = get_batch_conditions(body)
+        if error is not None:
+            logger.warning("Invalid batch delete: %s", error)
+            abort(400)
+
+        try:
+            deleted = delete_questions(conditions)
+            logger.info("Batch deleted %s questions", deleted)
+            return jsonify({
+                'success': True,
+                'deleted': deleted
+            })
+
+        except Exception as e:
+            logger.error("Error batch deleting questions: %s", e)
+            abort(500)
+
+    @app.route("/questions", methods=['PATCH'])
+    @limiter.limit("50 per hour")
+    @requires_auth('post:questions')
+    def batch_update_questions(payload):
+        body = request.get_json(silent=True)
+
+        # Validate the selection and the new values
+        if not body or not isinstance(body, dict):
+            logger.warning("Empty request body for batch update")
+            abort(400)
+        conditions, error = get_batch_conditions(body)
+        if error is None:
+            values, error = validate_batch_update(body.get('set'))
+        if error is not None:
+            logger.warning("Invalid batch update: %s", error)
+            abort(400)
+
+        try:
+            updated = update_questions(conditions, values)
+            logger.info("Batch updated %s questions with %s", updated, values)
+            return jsonify({
+                'success': True,
+                'updated': updated
+            })
+
+        except Exception as e:
+            logger.error("Error batch updating questions: %s", e)
             abort(500)
 
     """
@@ -191,6 +380,7 @@ def create_app(test_config=None):
     """
     @app.route('/questions/search', methods=['POST'])
     @limiter.limit("100 per hour")
+    @read_replica
     def search_questions():
         try:
             body = request.get_json()
@@ -201,36 +391,48 @@ def create_app(test_config=None):
                 abort(400)
 
             search_term = body.get('searchTerm', None)
+            include_answers = bool(body.get('include_answers', False))
+            mode = body.get('mode')
+            page = body.get('page', 1)
+            per_page = body.get('per_page', QUESTIONS_PER_PAGE)
+
+            # Validate pagination
+            if not isinstance(page, int) or not isinstance(per_page, int) or page < 1 or per_page < 1:
+                logger.warning("Invalid search page arguments: %s, %s", page, per_page)
+                abort(400)
+            per_page = min(per_page, MAX_QUESTIONS_PER_PAGE)
 
-            if search_term:
+            if search_term and isinstance(search_term, str) and search_term.strip():
                 # Sanitize search term
                 search_term = search_term.strip()
-                logger.info(f"Searching questions with term: {search_term}")
+                logger.info("Searching questions with term: %s", search_term)
 
-                search_results = Question.query.filter(
-                    Question.question.ilike(f'%{search_term}%')).all()
+                search_results, total_questions = question_search.search(
+                    search_term, include_answers=include_answers, page=page,
+                    per_page=per_page, mode=mode)
 
-                if len(search_results) == 0:
-                    logger.info(f"No results found for search term: {search_term}")
+                if total_questions == 0:
+                    logger.info("No results found for search term: %s", search_term)
                     return jsonify({
                         "success": False,
                         "error": 404,
                         "message": "Resource Not Found"
                     }), 404
 
-                logger.info(f"Found {len(search_results)} results for search term: {search_term}")
+                logger.info("Found %s results for search term: %s", total_questions, search_term)
                 return jsonify({
                     'success': True,
-                    'questions': [question.format() for question in search_results],
-                    'total_questions': len(search_results),
-                    'current_category': None
+                    'questions': search_results,
+                    'total_questions': total_questions,
+                    'current_category': None,
+                    'page': page
                 })
 
             logger.warning("Search term not provided")
             abort(400)
 
         except Exception as e:
-            logger.error(f"Error searching questions: {str(e)}")
+            logger.error("Error searching questions: %s", e)
             abort(500)
 
     """
@@ -255,68 +457,59 @@ def create_app(test_config=None):
                 logger.warning("Empty request body for creating question")
                 abort(400)
 
-            question_text = body.get('question')
-            answer = body.get('answer')
-            difficulty = body.get('difficulty')
-            category = body.get('category')
-
-            # Validate required fields
-            if not all([question_text, answer, difficulty, category]):
-                logger.warning("Missing required fields for creating question")
-                abort(400)
-
-            # Validate field types and values
-            if not isinstance(question_text, str) or not question_text.strip():
-                logger.warning("Invalid question text")
-                abort(400)
-
-            if not isinstance(answer, str) or not answer.strip():
-                logger.warning("Invalid answer text")
-                abort(400)
-
-            try:
-                difficulty = int(difficulty)
-                if difficulty < 1 or difficulty > 5:
-                    logger.warning(f"Difficulty out of range: {difficulty}")
-                    abort(400)
-            except (ValueError, TypeError):
-                logger.warning(f"Invalid difficulty value: {difficulty}")
-                abort(400)
-
-            try:
-                category = int(category)
-            except (ValueError, TypeError):
-                logger.warning(f"Invalid category value: {category}")
-                abort(400)
-
-            # Verify category exists
-            category_obj = Category.query.get(category)
-            if not category_obj:
-                logger.warning(f"Category {category} does not exist")
+            values, error = validate_question(body)
+            if error is not None:
+                logger.warning("Invalid question: %s", error)
                 abort(400)
 
             try:
                 logger.info("Creating new question")
-                new_question = Question(
-                    question=question_text.strip(),
-                    answer=answer.strip(),
-                    difficulty=difficulty,
-                    category=category
-                )
+                new_question = Question(**values)
                 new_question.insert()
 
-                logger.info(f"Successfully created question with ID: {new_question.id}")
+                logger.info("Successfully created question with ID: %s", new_question.id)
                 return jsonify({
                     'success': True,
                     'created': new_question.id,
                 })
 
             except Exception as e:
-                logger.error(f"Database error creating question: {str(e)}")
+                logger.error("Database error creating question: %s", e)
                 abort(422)
 
         except Exception as e:
-            logger.error(f"Error creating question: {str(e)}")
+            logger.error("Error creating question: %s", e)
+            abort(500)
+
+    @app.route("/questions/bulk", methods=['POST'])
+    @limiter.limit("20 per hour")
+    @requires_auth('post:questions')
+    def bulk_import_questions(payload):
+        import_format = request.args.get('format') or get_import_format(request.content_type)
+        batch_size = request.args.get('batch_size', BULK_IMPORT_BATCH_SIZE, type=int)
+
+        # Validate format and batch size
+        if import_format not in READERS:
+            logger.warning("Unsupported bulk import format: %s", import_format or request.content_type)
+            abort(400)
+        if batch_size is None or batch_size < 1:
+            logger.warning("Invalid bulk import batch size: %s", request.args.get('batch_size'))
+            abort(400)
+
+        try:
+            logger.info("Importing questions from %s in batches of %s", import_format, batch_size)
+            lines = io.TextIOWrapper(io.BufferedReader(request.stream), encoding='utf-8', newline='')
+            report = BulkImporter(batch_size).load(READERS[import_format](lines))
+
+            return jsonify({
+                'success': True,
+                'inserted': report['inserted'],
+                'failed': report['failed'],
+                'errors': report['errors']
+            })
+
+        except Exception as e:
+            logger.error("Error importing questions: %s", e)
             abort(500)
 
     """
@@ -329,31 +522,46 @@ def create_app(test_config=None):
     """
     @app.route('/categories/<int:category_id>/questions', methods=['GET'])
     @limiter.limit("100 per hour")
+    @read_replica
+    @response_cache.cached()
     def get_questions_by_category(category_id):
+        cursor = request.args.get('cursor')
+        after_id = decode_cursor(cursor) if cursor is not None else None
+        if cursor is not None and after_id is None:
+            logger.warning("Invalid cursor: %s", cursor)
+            abort(400)
+
         try:
-            logger.info(f"Fetching questions for category ID: {category_id}")
+            logger.info("Fetching questions for category ID: %s", category_id)
 
-            category = Category.query.get(category_id)
-            if category is None:
-                logger.warning(f"Category {category_id} not found")
+            if category_cache.get_type(category_id) is None:
+                logger.warning("Category %s not found", category_id)
                 return jsonify({
                     "success": False,
                     "error": 404,
                     "message": "Resource Not Found"
                 }), 404
 
-            questions = Question.query.filter(Question.category == str(category_id)).all()
+            category_questions = Question.query.filter(Question.category == category_id)
+            if cursor is not None:
+                questions, total_questions, next_cursor = keyset_paginate_questions(
+                    request, category_questions, after_id)
+            else:
+                questions, total_questions = paginate_questions(request, category_questions)
 
-            logger.info(f"Found {len(questions)} questions for category {category_id}")
-            return jsonify({
+            logger.info("Found %s questions for category %s", total_questions, category_id)
+            response = {
                 'success': True,
-                'questions': paginate_questions(request, questions),
-                'total_questions': len(questions),
+                'questions': question_json_cache.encode_rows(questions),
+                'total_questions': total_questions,
                 'current_category': category_id
-            })
+            }
+            if cursor is not None:
+                response['next_cursor'] = next_cursor
+            return json_response(response)
 
         except Exception as e:
-            logger.error(f"Error fetching questions by category: {str(e)}")
+            logger.error("Error fetching questions by category: %s", e)
             abort(500)
 
     """
@@ -370,67 +578,71 @@ def create_app(test_config=None):
 
     @app.route('/quizzes', methods=['POST'])
     @limiter.limit("100 per hour")
+    @read_replica
     def get_quizzes():
         try:
-            body = request.get_json()
-
-            # Validate request body
-            if not body:
-                logger.warning("Empty request body for quiz")
-                abort(400)
+            app = current_app._get_current_object()
+            return json_response(run_quiz_plan(app, quiz_plan(app, request.get_json())))
 
-            prev_questions = body.get('previous_questions', [])
-            quiz_category = body.get('quiz_category', None)
-
-            # Validate quiz_category
-            if not quiz_category or 'id' not in quiz_category:
-                logger.warning("Invalid quiz category")
-                abort(400)
-
-            # Ensure prev_questions is a list
-            if not isinstance(prev_questions, list):
-                logger.warning("Invalid previous_questions format")
-                abort(400)
+        except QuizRequestError as e:
+            abort(e.status)
+        except Exception as e:
+            logger.error("Error generating quiz question: %s", e)
+            abort(500)
 
-            logger.info(f"Fetching quiz question for category: {quiz_category}")
+    @app.route('/quizzes/sessions', methods=['POST'])
+    @limiter.limit("100 per hour")
+    @read_replica
+    def create_quiz_session():
+        try:
+            app = current_app._get_current_object()
+            return json_response(run_quiz_plan(app, quiz_session_plan(request.get_json())))
 
-            questions = []
-            quiz_question = None
+        except QuizRequestError as e:
+            abort(e.status)
+        except Exception as e:
+            logger.error("Error creating quiz session: %s", e)
+            abort(500)
 
-            if quiz_category['id'] == 0:
-                # All categories
-                questions = Question.query.filter(
-                    Question.id.notin_(prev_questions)).all()
-            else:
-                # Specific category
-                selected_category = Category.query.filter(
-                    Category.type == str(quiz_category['type'])).one_or_none()
-
-                if not selected_category:
-                    logger.warning(f"Category not found: {quiz_category['type']}")
-                    abort(404)
-
-                category_id = selected_category.id
-                questions = Question.query.filter(
-                    Question.id.notin_(prev_questions),
-                    Question.category == str(category_id)).all()
-
-            if len(questions) > 0:
-                question = random.choice(questions)
-                quiz_question = question.format()
-                logger.info(f"Selected quiz question ID: {question.id}")
-            else:
-                logger.info("No more questions available for quiz")
+    @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+    @limiter.limit("100 per hour")
+    def delete_quiz_session(session_id):
+        try:
+            return json_response(run_quiz_plan(current_app._get_current_object(),
+                                               end_quiz_session_plan(session_id)))
+        except QuizRequestError as e:
+            abort(e.status)
 
+    @app.route('/stats/pool', methods=['GET'])
+    @limiter.limit("100 per hour")
+    @requires_auth('delete:questions')
+    def get_pool_stats(payload):
+        try:
+            replicas = app.extensions.get('replicas')
             return jsonify({
-                'question': quiz_question,
-                'success': True
+                'success': True,
+                'pools': get_pools_status(),
+                'replicas': replicas.status() if replicas is not None else {}
             })
-
         except Exception as e:
-            logger.error(f"Error generating quiz question: {str(e)}")
+            logger.error("Error reading pool statistics: %s", e)
             abort(500)
 
+    def render_metrics(payload=None):
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    # Without the metrics token, the same permission as GET /stats/pool
+    render_metrics_for_managers = requires_auth('delete:questions')(render_metrics)
+
+    @app.route('/metrics', methods=['GET'])
+    @limiter.exempt
+    def get_metrics():
+        if not METRICS_ENABLED:
+            abort(404)
+        if METRICS_PUBLIC or authorize_metrics(request.headers.get('Authorization')):
+            return render_metrics()
+        return render_metrics_for_managers()
+
     """
     @TODO:
     Create error handlers for all expected errors
@@ -439,7 +651,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(400)
     def bad_request(error):
-        logger.error(f"Bad request error: {error}")
+        logger.error("Bad request error: %s", error)
         return jsonify({
             "success": False,
             "error": 400,
@@ -448,7 +660,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(404)
     def not_found(error):
-        logger.error(f"Not found error: {error}")
+        logger.error("Not found error: %s", error)
         return jsonify({
             "success": False,
             "error": 404,
@@ -457,7 +669,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(405)
     def method_not_allowed(error):
-        logger.error(f"Method not allowed error: {error}")
+        logger.error("Method not allowed error: %s", error)
         return jsonify({
             "success": False,
             "error": 405,
@@ -466,7 +678,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(422)
     def not_processable(error):
-        logger.error(f"Unprocessable entity error: {error}")
+        logger.error("Unprocessable entity error: %s", error)
         return jsonify({
             "success": False,
             "error": 422,
@@ -475,7 +687,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(429)
     def rate_limit_exceeded(error):
-        logger.warning(f"Rate limit exceeded: {error}")
+        logger.warning("Rate limit exceeded: %s", error)
         return jsonify({
             "success": False,
             "error": 429,
@@ -484,7 +696,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(500)
     def server_error(error):
-        logger.error(f"Internal server error: {error}")
+        logger.error("Internal server error: %s", error)
         return jsonify({
             "success": False,
             "error": 500,
@@ -496,11 +708,15 @@ def create_app(test_config=None):
         """
         Handle authentication errors from Auth0
         """
-        logger.error(f"Authentication error: {ex.error}")
+        logger.error("Authentication error: %s", ex.error)
         response = jsonify(ex.error)
         response.status_code = ex.status_code
         return response
 
+    # Reported as trivia_boot_seconds by GET /metrics
+    boot_seconds = time.perf_counter() - started
+    record_boot_time('create_app', boot_seconds)
+    logger.info("App created in %.0f ms", boot_seconds * 1000)
 
     return app
 
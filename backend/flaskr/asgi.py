@@ -0,0 +1,545 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qsl
+
+from limits import parse as parse_limit
+from limits.storage import MemoryStorage
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.http import parse_etags
+
+from auth import AuthError, verify_auth_header_async
+from db_pool import PoolStats, get_engine_options, instrument_engine, register_pool
+from instrumentation import (instrument_queries, phase, record_request_metrics, start_request_metrics,
+                             stop_request_metrics)
+from replicas import client_key
+from structured_logging import REQUEST_ID_HEADER, end_request, start_request
+from . import create_app
+from .categories import category_cache
+from .quiz import (QuizRequestError, category_ids_query, end_quiz_session_plan, quiz_decks, quiz_plan,
+                   quiz_session_plan, quiz_sessions, SharedQuizSessionStore)
+from .rate_limit import SharedMemoryStorage
+from .response_cache import response_cache
+from .serialization import encode_json
+
+logger = logging.getLogger(__name__)
+
+# Threads running the Flask app for routes without an async handler
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', '32'))
+# Request bodies larger than this are spooled to a temporary file
+ASGI_MAX_BODY_IN_MEMORY = 1024 * 1024
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgres': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+# Same bodies as the Flask error handlers
+ERROR_MESSAGES = {
+    400: 'Bad Request',
+    404: 'Resource Not Found',
+    405: 'method not allowed',
+    422: 'Not Processable',
+    429: 'Rate limit exceeded',
+    500: 'Internal Server Error',
+}
+
+
+def async_database_url(url):
+    """
+    Maps a database URL to its asyncio driver
+
+    Raises:
+        ValueError: If the database has no supported asyncio driver
+    """
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f'No asyncio driver for {url.get_backend_name()} databases')
+    return url.set(drivername=driver)
+
+
+class HTTPError(Exception):
+    """Stops a handler with an error status (the counterpart of abort)"""
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class AsyncRequest:
+    """The parts of an ASGI HTTP request the handlers use"""
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True)
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope['headers']}
+        self.remote_addr = (scope.get('client') or ('127.0.0.1', 0))[0]
+        self.body = body
+
+    def get_json(self):
+        """Parses the body like Flask's get_json (raises ValueError where Flask raises)"""
+        content_type = self.headers.get('content-type', '').split(';')[0].strip()
+        if content_type != 'application/json' and not content_type.endswith('+json'):
+            raise ValueError(f'Unsupported content type: {content_type}')
+        return json.loads(self.body)
+
+
+class AsyncTriviaApp:
+    """
+    ASGI application serving the routes of `create_app`
+
+    The quiz endpoints and GET /categories, the routes that see the most
+    concurrent clients, are handled natively on the event loop: questions
+    are read through SQLAlchemy async engines (asyncpg or aiosqlite), one
+    for the primary and one per read replica, and tokens are verified with
+    `verify_auth_header_async`. The quiz endpoints run the plans of the
+    Flask views (see flaskr.quiz), and all native routes use the same
+    in-memory caches, rate limit storage, replica selection and request
+    metrics as the Flask app. Every other route is passed to the Flask
+    app, which runs in a pool of `ASGI_WSGI_THREADS` threads, so the full
+    API is available from one server.
+    """
+    def __init__(self, flask_app, engine, threads=ASGI_WSGI_THREADS, replica_engines=None):
+        self.flask_app = flask_app
+        self.engine = engine
+        self.replica_engines = replica_engines or {}
+        self.replicas = flask_app.extensions.get('replicas')
+        self.registry = flask_app.extensions.get('instrumentation')
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+        self.limiter = next(iter(flask_app.extensions['limiter']))
+        self._limits = {}
+        self.routes = {
+            ('GET', '/categories'): self.get_categories,
+            ('POST', '/quizzes'): self.get_quizzes,
+            ('POST', '/quizzes/sessions'): self.create_quiz_session,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        handler, route, args = self.match(scope['method'], scope['path'])
+        if handler is None:
+            await self.call_flask(scope, receive, send)
+            return
+
+        request = AsyncRequest(scope, await self.read_body(receive))
+        request_id = start_request(request.headers.get(REQUEST_ID_HEADER.lower()))
+        if self.registry is not None:
+            start_request_metrics()
+        try:
+            status, headers, body = await handler(request, *args)
+        except Exception as e:
+            # Unhandled errors get the JSON 500 of the Flask app
+            logger.exception("Unhandled error on %s %s: %s", request.method, request.path, e)
+            status, headers, body = self.error_response(500)
+        finally:
+            end_request()
+        if self.registry is not None:
+            # Labelled with the rule of the Flask view, so both entry points share series
+            record_request_metrics(self.registry, route, request.method, status)
+            stop_request_metrics()
+        headers = headers + self.cors_headers(request) + [(REQUEST_ID_HEADER, request_id)]
+        await send({'type': 'http.response.start', 'status': status, 'headers': [
+            (name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    def match(self, method, path):
+        """Returns the native (handler, route rule, arguments) of a request, or a None handler"""
+        handler = self.routes.get((method, path))
+        if handler is not None:
+            return handler, path, ()
+        prefix = '/quizzes/sessions/'
+        if method == 'DELETE' and path.startswith(prefix) and '/' not in path[len(prefix):]:
+            return self.delete_quiz_session, f'{prefix}<session_id>', (path[len(prefix):],)
+        return None, None, ()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                for engine in self.replica_engines.values():
+                    await engine.dispose()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def run_sync(self, function, *args):
+        """Runs a blocking function in a worker thread inside a Flask app context"""
+        def call():
+            with self.flask_app.app_context():
+                return function(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    @staticmethod
+    async def call_sessions(method, *args):
+        """Calls a quiz_sessions method, off the event loop when sessions live in a shared backend"""
+        function = getattr(quiz_sessions, method)
+        if isinstance(quiz_sessions, SharedQuizSessionStore):
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    # Responses
+
+    def json_response(self, data, status=200, headers=()):
+        body = encode_json(data, self.flask_app.json.dumps)
+        return status, [('Content-Type', 'application/json'),
+                        ('Content-Length', str(len(body)))] + list(headers), body
+
+    def error_response(self, status):
+        logger.error("%s error: %s", ERROR_MESSAGES[status], status)
+        return self.json_response({
+            'success': False,
+            'error': status,
+            'message': ERROR_MESSAGES[status]
+        }, status)
+
+    @staticmethod
+    def cors_headers(request):
+        origin = request.headers.get('origin')
+        headers = [
+            ('Access-Control-Allow-Headers', 'Content-Type,Authorization,true'),
+            ('Access-Control-Allow-Methods', 'GET,POST,PATCH,DELETE'),
+            ('Access-Control-Allow-Origin', origin or '*'),
+        ]
+        if origin:
+            headers.append(('Vary', 'Origin'))
+        return headers
+
+    # Rate limiting, shared with the Flask app's limiter
+
+    async def check_limit(self, request, limit, endpoint):
+        """Counts a hit against a limit, returns False when the limit is exceeded"""
+        if not self.limiter.enabled:
+            return True
+        item = self._limits.get(limit)
+        if item is None:
+            item = self._limits[limit] = parse_limit(limit)
+
+        # The identifiers Flask-Limiter uses for a route limit: its key prefix, the key
+        # function (get_remote_address) and the view's endpoint as scope, so both
+        # entry points count hits in the same storage keys
+        identifiers = (request.remote_addr, endpoint)
+        if self.limiter._key_prefix:
+            identifiers = (self.limiter._key_prefix,) + identifiers
+
+        strategy = self.limiter.limiter
+        try:
+            with phase('rate_limit'):
+                if isinstance(self.limiter.storage, (MemoryStorage, SharedMemoryStorage)):
+                    return strategy.hit(item, *identifiers)
+                return await asyncio.to_thread(strategy.hit, item, *identifiers)
+        except Exception as e:
+            logger.warning("Rate limit storage unreachable, allowing request: %s", e)
+            return True
+
+    # Data access
+
+    async def category_maps(self):
+        maps = category_cache.cached_maps()
+        if maps is None:
+            maps = await self.run_sync(category_cache.load)
+        return maps
+
+    async def read_engine(self, request):
+        """
+        Returns the engine of a read-only handler, picked like the read_replica decorator does
+
+        A healthy replica, or the primary without one or when the client
+        wrote within REPLICA_STICKY_SECONDS.
+        """
+        if self.replicas is None or not self.replica_engines:
+            return self.engine
+        client = client_key(request.headers.get('authorization'), request.remote_addr)
+        if self.replicas.backend is None:
+            wrote_recently = self.replicas.wrote_recently(client)
+        else:
+            wrote_recently = await asyncio.to_thread(self.replicas.wrote_recently, client)
+        if wrote_recently:
+            return self.engine
+
+        with self.flask_app.app_context():
+            key = self.replicas.choose(self.replica_engines)
+        return self.replica_engines[key] if key is not None else self.engine
+
+    async def run_quiz_plan(self, plan, engine):
+        """Async counterpart of quiz.run_quiz_plan, reading through `engine`"""
+        connection = None
+
+        async def perform(operation):
+            nonlocal connection
+            kind = operation[0]
+            if kind in ('execute', 'ids') and connection is None:
+                connection = await engine.connect()
+            if kind == 'execute':
+                return (await connection.execute(operation[1])).all()
+            if kind == 'ids':
+                result = await connection.stream_scalars(
+                    category_ids_query(operation[1]).execution_options(yield_per=10000))
+                return array('l', [question_id async for question_id in result])
+            if kind == 'category':
+                category_id = (await self.category_maps())[1].get(operation[1])
+                if category_id is None:
+                    # Reloads the categories at most every few seconds
+                    category_id = await self.run_sync(category_cache.get_id, operation[1])
+                return category_id
+            if kind == 'decks':
+                if quiz_decks.is_loaded:
+                    return quiz_decks.ensure_loaded(self.flask_app)
+                return await self.run_sync(quiz_decks.ensure_loaded, self.flask_app)
+            if kind == 'replica':
+                return engine is not self.engine
+            if kind in ('draw', 'create', 'discard'):
+                return await self.call_sessions(kind, *operation[1:])
+            raise ValueError(f'Unknown quiz operation: {kind}')
+
+        send, value = plan.send, None
+        try:
+            while True:
+                try:
+                    operation = send(value)
+                except StopIteration as stop:
+                    return stop.value
+                try:
+                    send, value = plan.send, await perform(operation)
+                except Exception as e:
+                    send, value = plan.throw, e
+        finally:
+            if connection is not None:
+                await connection.close()
+
+    # Handlers (same behaviour as the Flask views of the same name)
+
+    async def get_categories(self, request):
+        if not await self.check_limit(request, '100 per hour', 'get_categories'):
+            return self.error_response(429)
+        try:
+            with phase('auth'):
+                await verify_auth_header_async(request.headers.get('authorization'), 'get:categories')
+        except AuthError as ex:
+            logger.error("Authentication error: %s", ex.error)
+            return self.json_response(ex.error, ex.status_code)
+
+        cached = response_cache.max_size > 0
+        if cached:
+            version = response_cache.cached_version()
+            if version is None:
+                version = await self.run_sync(response_cache.data_version)
+            key = response_cache.make_key(version, request.path, request.args)
+            entry = response_cache.get(key)
+            if entry is not None:
+                etag, _, body = entry
+                return self.cached_response(request, etag, body)
+
+        try:
+            logger.info("Fetching all categories")
+            allCategories = (await self.category_maps())[0]
+            if len(allCategories) == 0:
+                logger.warning("No categories found in database")
+                raise HTTPError(404)
+
+            logger.info("Successfully retrieved %s categories", len(allCategories))
+            status, headers, body = self.json_response({
+                'success': True,
+                'categories': allCategories
+            })
+        except Exception as e:
+            logger.error("Error fetching categories: %s", e)
+            return self.error_response(500)
+
+        if not cached:
+            return status, headers, body
+        etag = response_cache.set(key, 'application/json', body)
+        return self.cached_response(request, etag, body)
+
+    def cached_response(self, request, etag, body):
+        headers = [
+            ('ETag', f'"{etag}"'),
+            ('Cache-Control', response_cache.cache_control(False)),
+            ('Vary', 'Authorization'),
+        ]
+        if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+            return 304, headers, b''
+        return 200, [('Content-Type', 'application/json'),
+                     ('Content-Length', str(len(body)))] + headers, body
+
+    async def get_quizzes(self, request):
+        if not await self.check_limit(request, '100 per hour', 'get_quizzes'):
+            return self.error_response(429)
+        try:
+            plan = quiz_plan(self.flask_app, request.get_json())
+            return self.json_response(await self.run_quiz_plan(plan, await self.read_engine(request)))
+
+        except QuizRequestError as e:
+            return self.error_response(e.status)
+        except Exception as e:
+            logger.error("Error generating quiz question: %s", e)
+            return self.error_response(500)
+
+    async def create_quiz_session(self, request):
+        if not await self.check_limit(request, '100 per hour', 'create_quiz_session'):
+            return self.error_response(429)
+        try:
+            plan = quiz_session_plan(request.get_json())
+            return self.json_response(await self.run_quiz_plan(plan, await self.read_engine(request)))
+
+        except QuizRequestError as e:
+            return self.error_response(e.status)
+        except Exception as e:
+            logger.error("Error creating quiz session: %s", e)
+            return self.error_response(500)
+
+    async def delete_quiz_session(self, request, session_id):
+        if not await self.check_limit(request, '100 per hour', 'delete_quiz_session'):
+            return self.error_response(429)
+        try:
+            plan = end_quiz_session_plan(session_id)
+            return self.json_response(await self.run_quiz_plan(plan, self.engine))
+        except QuizRequestError as e:
+            return self.error_response(e.status)
+
+    # Everything else runs in the Flask app
+
+    async def call_flask(self, scope, receive, send):
+        """
+        Runs the Flask app for one request in the thread pool
+
+        The request body is read (and spooled to disk when large) before
+        the app runs; the response is sent chunk by chunk as the app
+        produces it, so streaming responses such as the export stay
+        streamed.
+        """
+        body = SpooledTemporaryFile(max_size=ASGI_MAX_BODY_IN_MEMORY)
+        while True:
+            message = await receive()
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+
+        loop = asyncio.get_running_loop()
+        environ = self.build_environ(scope, body)
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            started = []
+
+            def start_response(status, headers, exc_info=None):
+                started[:] = [int(status.split(' ', 1)[0]), [
+                    (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]]
+
+            result = self.flask_app.wsgi_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if started:
+                        status, headers = started
+                        started.clear()
+                        send_from_thread({'type': 'http.response.start', 'status': status,
+                                          'headers': headers})
+                    if chunk:
+                        send_from_thread({'type': 'http.response.body', 'body': chunk,
+                                          'more_body': True})
+                if started:
+                    status, headers = started
+                    send_from_thread({'type': 'http.response.start', 'status': status,
+                                      'headers': headers})
+                send_from_thread({'type': 'http.response.body', 'body': b''})
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+                body.close()
+
+        await loop.run_in_executor(self.executor, run)
+
+    @staticmethod
+    def build_environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('127.0.0.1', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = f'HTTP_{name}'
+            if name in environ:
+                value = f'{environ[name]},{value}'
+            environ[name] = value
+        return environ
+
+
+def create_async_engine_for(url, pool_name):
+    """Creates the async engine of a database URL, with the pool instrumentation of the Flask engines"""
+    url = async_database_url(url)
+    pool_stats = PoolStats()
+    engine = create_async_engine(url, **get_engine_options(url, is_async=True, stats=pool_stats))
+    instrument_engine(engine, pool_stats)
+    register_pool(pool_name, engine, pool_stats)
+    return engine
+
+
+def create_asgi_app(test_config=None):
+    """
+    Creates the ASGI application
+
+    Serve it with an ASGI server, for example
+    `uvicorn --factory flaskr.asgi:create_asgi_app`.
+    """
+    flask_app = create_app(test_config)
+    engine = create_async_engine_for(flask_app.config['SQLALCHEMY_DATABASE_URI'], 'async')
+
+    # Async engines of the read replicas, under the bind keys ReplicaSet picks from
+    replicas = flask_app.extensions.get('replicas')
+    replica_engines = {}
+    if replicas is not None:
+        for key in replicas.keys:
+            url = flask_app.config['SQLALCHEMY_BINDS'][key]['url']
+            replica_engines[key] = create_async_engine_for(url, f'async-{key}')
+            replicas.watch(key, replica_engines[key].sync_engine)
+
+    if 'instrumentation' in flask_app.extensions:
+        for async_engine in [engine, *replica_engines.values()]:
+            instrument_queries(async_engine.sync_engine)
+    return AsyncTriviaApp(flask_app, engine, replica_engines=replica_engines)
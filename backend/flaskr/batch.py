@@ -0,0 +1,71 @@
+import os
+
+from sqlalchemy import select
+
+from models import db, Question
+from .serialization import QUESTION_COLUMNS
+
+# Ids accepted by one batch fetch (GET /questions?ids= or POST /questions/batch)
+MAX_BATCH_FETCH_IDS = int(os.environ.get('MAX_BATCH_FETCH_IDS', '100'))
+
+
+def is_integer(value):
+    """Returns True for a JSON integer (booleans and floats are not)"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_question_ids(ids, max_ids=MAX_BATCH_FETCH_IDS):
+    """
+    Reads the ids of a batch fetch
+
+    Args:
+        ids (list or str): A list of integer ids, or a comma separated string of them
+        max_ids (int): Most ids accepted
+
+    Returns:
+        (ids, error): The ids in request order without duplicates and None,
+        or None and a message describing the invalid selection
+    """
+    if isinstance(ids, str):
+        ids = [question_id.strip() for question_id in ids.split(',') if question_id.strip()]
+        if not all(question_id.isascii() and question_id.isdigit() for question_id in ids):
+            return None, 'ids must be integers'
+        ids = [int(question_id) for question_id in ids]
+    if not isinstance(ids, list) or not ids:
+        return None, 'ids must be a non-empty list'
+    if not all(is_integer(question_id) for question_id in ids):
+        return None, 'ids must be integers'
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > max_ids:
+        return None, f'At most {max_ids} ids can be fetched at once'
+    return ids, None
+
+
+def fetch_question_rows(ids):
+    """
+    Selects the questions with the given ids in one query
+
+    Args:
+        ids (list): Question ids
+
+    Returns:
+        rows (dict): QUESTION_COLUMNS rows keyed by id; deleted ids are missing
+    """
+    if not ids:
+        return {}
+    rows = db.session.execute(select(*QUESTION_COLUMNS).where(Question.id.in_(ids))).all()
+    return {row[0]: row for row in rows}
+
+
+def fetch_questions_in_order(ids):
+    """
+    Selects the questions with the given ids, ordered as requested
+
+    Returns:
+        (rows, missing): QUESTION_COLUMNS rows in the order of `ids`, and the
+        ids that do not exist
+    """
+    found = fetch_question_rows(ids)
+    rows = [found[question_id] for question_id in ids if question_id in found]
+    missing = [question_id for question_id in ids if question_id not in found]
+    return rows, missing
@@ -0,0 +1,337 @@
+import csv
+import io
+import json
+import logging
+import os
+import time
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import insert
+
+from models import db, Question, bump_version, question_changed
+from .batch import is_integer
+from .categories import category_cache
+
+logger = logging.getLogger(__name__)
+
+BULK_IMPORT_BATCH_SIZE = int(os.environ.get('BULK_IMPORT_BATCH_SIZE', '5000'))
+MAX_BULK_IMPORT_BATCH_SIZE = 50000
+# Row errors listed in an import report (all of them are counted)
+BULK_IMPORT_MAX_ERRORS = 100
+# Ids accepted by one batch delete or update
+MAX_BATCH_IDS = 10000
+
+QUESTION_FIELDS = ('question', 'answer', 'category', 'difficulty')
+# Fields a batch can filter on or update
+BATCH_FIELDS = ('category', 'difficulty')
+
+
+def validate_question(data):
+    """
+    Validates the fields of a new question (the rules of POST /questions)
+
+    Args:
+        data (dict): question, answer, difficulty and category values
+
+    Returns:
+        (values, error): The cleaned column values and None, or None and a
+        message describing the first invalid field
+    """
+    question_text = data.get('question')
+    answer = data.get('answer')
+    difficulty = data.get('difficulty')
+    category = data.get('category')
+
+    if not all([question_text, answer, difficulty, category]):
+        return None, 'Missing required fields'
+
+    if not isinstance(question_text, str) or not question_text.strip():
+        return None, 'Invalid question text'
+
+    if not isinstance(answer, str) or not answer.strip():
+        return None, 'Invalid answer text'
+
+    try:
+        difficulty = int(difficulty)
+    except (ValueError, TypeError):
+        return None, f'Invalid difficulty value: {difficulty}'
+    if difficulty < 1 or difficulty > 5:
+        return None, f'Difficulty out of range: {difficulty}'
+
+    try:
+        category = int(category)
+    except (ValueError, TypeError):
+        return None, f'Invalid category value: {category}'
+    if category_cache.get_type(category) is None:
+        return None, f'Category {category} does not exist'
+
+    return {
+        'question': question_text.strip(),
+        'answer': answer.strip(),
+        'category': category,
+        'difficulty': difficulty
+    }, None
+
+
+def read_ndjson(lines):
+    """Yields (line number, row dict or None, parse error or None) for NDJSON lines"""
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f'Invalid JSON: {str(e)}'
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, 'Expected a JSON object'
+            continue
+        yield line_number, row, None
+
+
+def read_csv(lines):
+    """Yields (line number, row dict or None, parse error or None) for CSV lines with a header"""
+    reader = csv.DictReader(lines)
+    missing = [field for field in QUESTION_FIELDS if field not in (reader.fieldnames or ())]
+    if missing:
+        yield 1, None, f"Missing CSV columns: {', '.join(missing)}"
+        return
+    for row in reader:
+        yield reader.line_num, row, None
+
+
+READERS = {
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+}
+
+
+def get_import_format(content_type):
+    """Maps a request Content-Type to an import format (NDJSON if unset), or None if unsupported"""
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+    if mimetype in ('text/csv', 'application/csv'):
+        return 'csv'
+    if mimetype in ('', 'application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+        return 'ndjson'
+    return None
+
+
+class BulkImporter:
+    """
+    Loads questions in batches, collecting per-row errors
+
+    Rows are validated with the rules of POST /questions and inserted
+    `batch_size` at a time in one statement per batch: COPY on PostgreSQL
+    (psycopg2) and an executemany INSERT elsewhere. Each batch is its own
+    transaction, so a failure never discards rows that were already
+    loaded. If a batch is rejected by the database, its rows are retried
+    one by one to pinpoint the failing rows.
+    """
+    def __init__(self, batch_size=BULK_IMPORT_BATCH_SIZE, max_errors=BULK_IMPORT_MAX_ERRORS):
+        self.batch_size = max(1, min(batch_size, MAX_BULK_IMPORT_BATCH_SIZE))
+        self.max_errors = max_errors
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def load(self, rows):
+        """
+        Validates and inserts rows (requires an app context)
+
+        Args:
+            rows: Iterable of (line number, row dict or None, parse error or None)
+
+        Returns:
+            report (dict): inserted and failed counts and the first row errors
+        """
+        started = time.perf_counter()
+        batch = []
+        lines = []
+        for line_number, row, error in rows:
+            values = None
+            if error is None:
+                values, error = validate_question(row)
+            if error is not None:
+                self._add_error(line_number, error)
+                continue
+
+            batch.append(values)
+            lines.append(line_number)
+            if len(batch) >= self.batch_size:
+                self._flush(batch, lines)
+                batch, lines = [], []
+
+        if batch:
+            self._flush(batch, lines)
+
+        if self.inserted:
+            question_changed.send(Question, action='bulk')
+
+        elapsed = time.perf_counter() - started
+        logger.info("Bulk import inserted %s questions (%s failed) in %.2fs",
+                    self.inserted, self.failed, elapsed)
+        return {
+            'inserted': self.inserted,
+            'failed': self.failed,
+            'errors': self.errors
+        }
+
+    def _add_error(self, line_number, error):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line_number, 'error': error})
+
+    def _flush(self, batch, lines):
+        try:
+            self._insert(batch)
+            bump_version('questions')
+            db.session.commit()
+            self.inserted += len(batch)
+        except Exception as e:
+            db.session.rollback()
+            logger.warning("Bulk import batch rejected, retrying row by row: %s", e)
+            self._insert_one_by_one(batch, lines)
+
+    def _insert(self, batch):
+        connection = db.session.connection()
+        if connection.dialect.name == 'postgresql' and connection.dialect.driver == 'psycopg2':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for values in batch:
+                writer.writerow([values[field] for field in QUESTION_FIELDS])
+            buffer.seek(0)
+            with connection.connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY questions ({', '.join(QUESTION_FIELDS)}) FROM STDIN WITH (FORMAT csv)",
+                    buffer)
+        else:
+            db.session.execute(insert(Question), batch)
+
+    def _insert_one_by_one(self, batch, lines):
+        for values, line_number in zip(batch, lines):
+            try:
+                db.session.execute(insert(Question), [values])
+                bump_version('questions')
+                db.session.commit()
+                self.inserted += 1
+            except Exception as e:
+                db.session.rollback()
+                self._add_error(line_number, f'Database error: {str(getattr(e, "orig", None) or e)}')
+
+
+def get_batch_conditions(body):
+    """
+    Builds the WHERE conditions of a batch delete or update
+
+    Args:
+        body (dict): 'ids' (a list of integer question ids) and/or 'filter' (a
+            dict of integer category and difficulty values); both are combined with AND
+
+    Returns:
+        (conditions, error): A list of SQLAlchemy conditions and None, or
+        None and a message describing the invalid selection
+    """
+    conditions = []
+
+    ids = body.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or not ids:
+            return None, 'ids must be a non-empty list'
+        if len(ids) > MAX_BATCH_IDS:
+            return None, f'At most {MAX_BATCH_IDS} ids can be sent at once'
+        # int() would turn true into question 1, 1.9 into 1 and "1" into 1
+        if not all(is_integer(question_id) for question_id in ids):
+            return None, 'ids must be integers'
+        conditions.append(Question.id.in_(sorted(set(ids))))
+
+    filters = body.get('filter')
+    if filters is not None:
+        if not isinstance(filters, dict) or not filters:
+            return None, 'filter must be a non-empty object'
+        unknown = set(filters) - set(BATCH_FIELDS)
+        if unknown:
+            return None, f"Unsupported filter fields: {', '.join(sorted(unknown))}"
+        for field, value in filters.items():
+            if not is_integer(value):
+                return None, f'Invalid {field} value: {value}'
+            conditions.append(getattr(Question, field) == value)
+
+    if not conditions:
+        return None, 'ids or filter is required'
+    return conditions, None
+
+
+def validate_batch_update(values):
+    """
+    Validates the new values of a batch update
+
+    Returns:
+        (values, error): The cleaned category and/or difficulty and None,
+        or None and a message describing the first invalid field
+    """
+    if not isinstance(values, dict) or not values:
+        return None, 'set must be a non-empty object'
+    unknown = set(values) - set(BATCH_FIELDS)
+    if unknown:
+        return None, f"Unsupported fields: {', '.join(sorted(unknown))}"
+
+    cleaned = {}
+    if 'difficulty' in values:
+        try:
+            cleaned['difficulty'] = int(values['difficulty'])
+        except (ValueError, TypeError):
+            return None, f"Invalid difficulty value: {values['difficulty']}"
+        if cleaned['difficulty'] < 1 or cleaned['difficulty'] > 5:
+            return None, f"Difficulty out of range: {cleaned['difficulty']}"
+    if 'category' in values:
+        try:
+            cleaned['category'] = int(values['category'])
+        except (ValueError, TypeError):
+            return None, f"Invalid category value: {values['category']}"
+        if category_cache.get_type(cleaned['category']) is None:
+            return None, f"Category {cleaned['category']} does not exist"
+    return cleaned, None
+
+
+def delete_questions(conditions):
+    """Deletes the matching questions in one statement and transaction, returns the count"""
+    count = Question.query.filter(*conditions).delete(synchronize_session=False)
+    if count:
+        bump_version('questions')
+    db.session.commit()
+    if count:
+        question_changed.send(Question, action='bulk')
+    return count
+
+
+def update_questions(conditions, values):
+    """Updates the matching questions in one statement and transaction, returns the count"""
+    count = Question.query.filter(*conditions).update(values, synchronize_session=False)
+    if count:
+        bump_version('questions')
+    db.session.commit()
+    if count:
+        question_changed.send(Question, action='bulk')
+    return count
+
+
+questions_cli = AppGroup('questions', help='Manage the question bank.')
+
+
+@questions_cli.command('import')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'import_format', type=click.Choice(sorted(READERS)),
+              help='Input format (defaults to the file extension, then ndjson).')
+@click.option('--batch-size', default=BULK_IMPORT_BATCH_SIZE, show_default=True,
+              help='Rows inserted per statement.')
+def import_questions(source, import_format, batch_size):
+    """Imports questions from an NDJSON or CSV file (- for stdin)."""
+    if import_format is None:
+        import_format = 'csv' if source.name.lower().endswith('.csv') else 'ndjson'
+
+    report = BulkImporter(batch_size).load(READERS[import_format](source))
+
+    for error in report['errors']:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f"Inserted {report['inserted']} questions, {report['failed']} failed")
@@ -0,0 +1,98 @@
+import logging
+import os
+import time
+
+from models import Category, category_changed, get_version
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the shared category version (0 disables cross-worker sync)
+CATEGORY_CACHE_SYNC_INTERVAL = int(os.environ.get('CATEGORY_CACHE_SYNC_INTERVAL', '0'))
+# Minimum seconds between reloads triggered by an unknown id or type
+CATEGORY_CACHE_MISS_RELOAD_INTERVAL = 5
+
+
+class CategoryCache:
+    """
+    Process-wide cache of the categories table (id -> type and type -> id)
+
+    Categories are loaded once and reloaded when `Category.insert` runs in
+    this process. With a sync interval, the `categories` version counter in
+    the database is checked at most every `sync_interval` seconds so inserts
+    made by other workers are picked up too. A lookup miss also triggers a
+    reload, at most once every few seconds.
+    """
+    def __init__(self, sync_interval=CATEGORY_CACHE_SYNC_INTERVAL):
+        self.sync_interval = sync_interval
+        self.version = None
+        # (id -> type, type -> id), swapped atomically on reload
+        self._maps = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+
+    def get_types(self):
+        """Returns a dict of category id -> type (do not modify it)"""
+        return self._fresh_maps()[0]
+
+    def get_type(self, category_id):
+        """Returns the type of a category id, or None if it does not exist"""
+        category_type = self._fresh_maps()[0].get(category_id)
+        if category_type is None and self._reload_on_miss():
+            category_type = self._maps[0].get(category_id)
+        return category_type
+
+    def get_id(self, category_type):
+        """Returns the id of a category type, or None if it does not exist"""
+        category_id = self._fresh_maps()[1].get(category_type)
+        if category_id is None and self._reload_on_miss():
+            category_id = self._maps[1].get(category_type)
+        return category_id
+
+    def cached_maps(self):
+        """Returns the (id -> type, type -> id) maps if no database query is due, else None"""
+        maps = self._maps
+        if maps is None:
+            return None
+        if self.sync_interval and time.monotonic() - self._checked_at >= self.sync_interval:
+            return None
+        return maps
+
+    def invalidate(self):
+        """Drops the cached categories; they are reloaded on next use"""
+        self._maps = None
+
+    def load(self):
+        """Loads the categories from the database (requires an app context)"""
+        version = get_version('categories') if self.sync_interval else None
+        types = {category.id: category.type for category in Category.query.order_by(Category.id)}
+        ids = {category_type: category_id for category_id, category_type in types.items()}
+        self._maps = (types, ids)
+        self.version = version
+        self._loaded_at = self._checked_at = time.monotonic()
+        logger.info("Category cache loaded with %s categories", len(types))
+        return self._maps
+
+    def _fresh_maps(self):
+        maps = self._maps
+        if maps is None:
+            return self.load()
+
+        if self.sync_interval and time.monotonic() - self._checked_at >= self.sync_interval:
+            self._checked_at = time.monotonic()
+            if get_version('categories') != self.version:
+                return self.load()
+        return maps
+
+    def _reload_on_miss(self):
+        if time.monotonic() - self._loaded_at < CATEGORY_CACHE_MISS_RELOAD_INTERVAL:
+            return False
+        self.load()
+        return True
+
+
+category_cache = CategoryCache()
+
+
+@category_changed.connect
+def _invalidate_category_cache(sender, action):
+    category_cache.invalidate()
@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+import logging
+import os
+import zlib
+
+from models import db, Question
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_YIELD_PER = int(os.environ.get('EXPORT_YIELD_PER', '5000'))
+# Bytes of encoded rows collected before a chunk is sent
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+EXPORT_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def export_rows(category_id=None, difficulty=None, yield_per=EXPORT_YIELD_PER):
+    """
+    Streams (id, question, answer, category, difficulty) tuples in id order
+
+    Rows are read as plain column tuples through a server-side cursor
+    (`yield_per`), so memory stays constant however large the bank is.
+    """
+    query = db.session.query(
+        Question.id, Question.question, Question.answer, Question.category, Question.difficulty)
+    if category_id is not None:
+        query = query.filter(Question.category == category_id)
+    if difficulty is not None:
+        query = query.filter(Question.difficulty == difficulty)
+    return query.order_by(Question.id).execution_options(yield_per=yield_per)
+
+
+def encode_ndjson(rows):
+    """Yields NDJSON chunks of about EXPORT_CHUNK_SIZE bytes"""
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    buffer = []
+    size = 0
+    for row in rows:
+        line = encoder.encode(dict(zip(EXPORT_FIELDS, row))) + '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def encode_csv(rows):
+    """Yields CSV chunks (with a header row) of about EXPORT_CHUNK_SIZE bytes"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+ENCODERS = {
+    'ndjson': encode_ndjson,
+    'csv': encode_csv,
+}
+
+
+def gzip_chunks(chunks, level=6):
+    """Compresses a stream of byte chunks into a gzip stream on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_questions(export_format, category_id=None, difficulty=None, compress=False):
+    """
+    Yields the encoded export of the question bank (requires an app context while iterating)
+
+    Args:
+        export_format (str): 'ndjson' or 'csv'
+        category_id (int): Only export this category
+        difficulty (int): Only export this difficulty
+        compress (bool): Gzip the stream
+
+    Yields:
+        chunk (bytes): The next part of the export
+    """
+    exported = 0
+
+    def counted(rows):
+        nonlocal exported
+        for row in rows:
+            exported += 1
+            yield row
+
+    chunks = ENCODERS[export_format](counted(export_rows(category_id, difficulty)))
+    if compress:
+        chunks = gzip_chunks(chunks)
+    try:
+        yield from chunks
+    except Exception as e:
+        # Headers are already sent, so the client sees a truncated stream
+        logger.error("Error exporting questions after %s rows: %s", exported, e)
+        raise
+    logger.info("Exported %s questions as %s", exported, export_format)
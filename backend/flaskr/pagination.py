@@ -0,0 +1,116 @@
+import base64
+import binascii
+import json
+import os
+
+from models import Question
+from .serialization import QUESTION_COLUMNS
+
+QUESTIONS_PER_PAGE = int(os.environ.get('QUESTIONS_PER_PAGE', '10'))
+MAX_QUESTIONS_PER_PAGE = int(os.environ.get('MAX_QUESTIONS_PER_PAGE', '100'))
+
+
+def get_page_args(request):
+    """
+    Reads the page and per_page query arguments
+
+    Returns:
+        (page, per_page): per_page is capped at MAX_QUESTIONS_PER_PAGE,
+        either value is None when it is not a positive integer
+    """
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', QUESTIONS_PER_PAGE, type=int)
+
+    if page is None or page < 1:
+        page = None
+    if per_page is None or per_page < 1:
+        per_page = None
+    else:
+        per_page = min(per_page, MAX_QUESTIONS_PER_PAGE)
+    return page, per_page
+
+
+def paginate_questions(request, query):
+    """
+    Paginates a question query in the database
+
+    The page is fetched with LIMIT/OFFSET and the total with a separate
+    COUNT, so only the requested rows are loaded. Rows are plain
+    QUESTION_COLUMNS tuples, encode them with question_json_cache.
+
+    Args:
+        request: The current request (reads page and per_page)
+        query: A Question query, optionally filtered
+
+    Returns:
+        (rows, total): The page's rows and the total number of matches
+    """
+    page, per_page = get_page_args(request)
+    pagination = query.with_entities(*QUESTION_COLUMNS).order_by(Question.id).paginate(
+        page=page or 1,
+        per_page=per_page or QUESTIONS_PER_PAGE,
+        max_per_page=MAX_QUESTIONS_PER_PAGE,
+        error_out=False
+    )
+    return pagination.items, pagination.total
+
+
+def encode_cursor(last_id):
+    """Encodes the id of the last question on a page as an opaque cursor"""
+    data = json.dumps({'after': last_id}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor produced by encode_cursor
+
+    An empty cursor starts at the beginning of the listing.
+
+    Returns:
+        after_id (int): Id to continue after, or None if the cursor is invalid
+    """
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        after_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))['after']
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        return None
+    if not isinstance(after_id, int) or isinstance(after_id, bool) or after_id < 0:
+        return None
+    return after_id
+
+
+def include_total(request):
+    """Returns False when the client asked to skip the total count"""
+    return request.args.get('include_total', 'true').lower() not in ('false', '0', 'no')
+
+
+def keyset_paginate_questions(request, query, after_id):
+    """
+    Paginates a question query by id (keyset pagination)
+
+    Each page is fetched with `WHERE id > :after_id ORDER BY id LIMIT n`,
+    which is an index range scan on the primary key, so every page costs
+    the same as the first one. Rows are plain QUESTION_COLUMNS tuples.
+
+    Args:
+        request: The current request (reads per_page and include_total)
+        query: A Question query, optionally filtered
+        after_id (int): Id decoded from the cursor
+
+    Returns:
+        (rows, total, next_cursor): total is None when the client skipped
+        the count, next_cursor is None on the last page
+    """
+    _, per_page = get_page_args(request)
+    per_page = per_page or QUESTIONS_PER_PAGE
+
+    rows = (query.with_entities(*QUESTION_COLUMNS).filter(Question.id > after_id)
+            .order_by(Question.id).limit(per_page + 1).all())
+    next_cursor = encode_cursor(rows[per_page - 1].id) if len(rows) > per_page else None
+    rows = rows[:per_page]
+
+    total = query.order_by(None).count() if include_total(request) else None
+    return rows, total, next_cursor
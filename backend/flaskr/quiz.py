@@ -0,0 +1,1116 @@
+import hashlib
+import logging
+import math
+import os
+import random
+import secrets
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from sqlalchemy import func, select
+
+from cache_backends import get_backend
+from models import db, Question, question_changed
+from replicas import reading_from_replica
+from .categories import category_cache
+from .serialization import QUESTION_COLUMNS, QUESTION_FIELDS, question_json_cache
+
+logger = logging.getLogger(__name__)
+
+QUIZ_POOL_TTL = int(os.environ.get('QUIZ_POOL_TTL', '300'))
+QUIZ_SAMPLE_ATTEMPTS = 16
+QUIZ_SESSION_TTL = int(os.environ.get('QUIZ_SESSION_TTL', '1800'))
+QUIZ_SESSION_LIMIT = int(os.environ.get('QUIZ_SESSION_LIMIT', '10000'))
+# Seconds new sessions of a category share one shuffled copy of its ids
+QUIZ_SESSION_DECK_TTL = int(os.environ.get('QUIZ_SESSION_DECK_TTL', '300'))
+# QUIZ_SESSION_URL optionally keeps sessions in a shared backend (e.g. redis://localhost:6379/0)
+QUIZ_SESSION_URL = os.environ.get('QUIZ_SESSION_URL')
+# Difficulty bands of the ramped quiz decks, easiest first (e.g. 1-2,3,4-5)
+QUIZ_DECK_BANDS = os.environ.get('QUIZ_DECK_BANDS', '1-2,3,4-5')
+# Seconds before the decks are rebuilt in the background
+QUIZ_DECK_TTL = int(os.environ.get('QUIZ_DECK_TTL', '600'))
+# Deck builds kept so quizzes started on an older build keep their sequence
+QUIZ_DECK_HISTORY = int(os.environ.get('QUIZ_DECK_HISTORY', '3'))
+# Questions asked from each band before a ramped quiz moves to the next one
+QUIZ_RAMP_STEPS = int(os.environ.get('QUIZ_RAMP_STEPS', '5'))
+MAX_QUIZ_SEED_LENGTH = 128
+MAX_DECK_VERSION_LENGTH = 64
+# Questions a quiz request can prefetch with `count`
+MAX_QUIZ_PREFETCH = 50
+
+# Pool key used for "All" categories
+ALL_CATEGORIES = 0
+
+
+class QuestionIdPool:
+    """
+    In-memory, per-category arrays of question ids used to pick quiz questions
+
+    Ids are kept sorted in compact `array('l')` buffers, one per category plus
+    one for all categories. Picking a question is a handful of random index
+    lookups (a binary search per excluded id once most of the category is
+    excluded), so each quiz step costs one primary key lookup instead of a
+    category scan. The pool is updated incrementally from `question_changed`
+    and rebuilt in the background every `ttl` seconds to pick up writes made
+    by other workers. Changes made while a rebuild scans the table are
+    replayed onto its snapshot before it is installed.
+    """
+    def __init__(self, ttl=QUIZ_POOL_TTL):
+        self.ttl = ttl
+        self._ids = None
+        self._loaded_at = 0.0
+        self._loading = False
+        self._generation = 0
+        self._changes = []
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self):
+        return self._ids is not None
+
+    def ensure_loaded(self, app):
+        """Starts a background (re)build if the pool is cold or stale"""
+        with self._lock:
+            stale = self._ids is None or time.monotonic() - self._loaded_at >= self.ttl
+            if not stale or self._loading:
+                return
+            self._loading = True
+
+        thread = threading.Thread(target=self._load_in_background, args=(app,), daemon=True)
+        thread.start()
+
+    def load(self):
+        """Builds the pool from the database (requires an app context)"""
+        changes = []
+        with self._lock:
+            generation = self._generation
+            self._changes.append(changes)
+        try:
+            ids = {ALL_CATEGORIES: array('l')}
+            rows = db.session.query(Question.id, Question.category).order_by(Question.id)
+            for question_id, category in rows.yield_per(10000):
+                ids[ALL_CATEGORIES].append(question_id)
+                ids.setdefault(category, array('l')).append(question_id)
+        except Exception:
+            with self._lock:
+                self._changes.remove(changes)
+            raise
+
+        # Stop recording and install under one lock, so no change falls in between
+        with self._lock:
+            self._changes.remove(changes)
+            # Discard the snapshot if a bulk write invalidated the pool meanwhile
+            if generation != self._generation:
+                return
+            # Single writes made during the scan may be missing from the snapshot
+            for question_id, category_id in changes:
+                if category_id is None:
+                    self._discard(ids, question_id)
+                else:
+                    self._add(ids, question_id, category_id)
+            self._ids = ids
+            self._loaded_at = time.monotonic()
+        logger.info("Quiz pool loaded with %s questions", len(ids[ALL_CATEGORIES]))
+
+    def invalidate(self):
+        """Drops the pool; it is rebuilt on the next quiz request"""
+        with self._lock:
+            self._ids = None
+            self._generation += 1
+
+    def pick(self, category_id, exclude):
+        """
+        Picks a random question id from a category
+
+        Args:
+            category_id (int): Category id, or ALL_CATEGORIES
+            exclude (set): Question ids that must not be returned
+
+        Returns:
+            question_id (int): A random id, or None when every id is excluded
+        """
+        with self._lock:
+            ids = self._ids.get(category_id) if self._ids is not None else None
+            if not ids:
+                return None
+
+            # Rejection sampling is O(1) while most of the category is unused
+            if len(exclude) < len(ids):
+                for _ in range(QUIZ_SAMPLE_ATTEMPTS):
+                    question_id = ids[random.randrange(len(ids))]
+                    if question_id not in exclude:
+                        return question_id
+
+            # Otherwise draw a rank among the ids left and skip the excluded
+            # positions before it, in O(len(exclude) log n) whatever the category size
+            excluded = []
+            for question_id in exclude:
+                position = bisect_left(ids, question_id)
+                if position < len(ids) and ids[position] == question_id:
+                    excluded.append(position)
+            excluded.sort()
+            if len(excluded) >= len(ids):
+                return None
+            index = random.randrange(len(ids) - len(excluded))
+            for position in excluded:
+                if position > index:
+                    break
+                index += 1
+            return ids[index]
+
+    def snapshot(self, category_id):
+        """Returns a copy of a category's ids, or None if the pool is not loaded"""
+        with self._lock:
+            if self._ids is None:
+                return None
+            return array('l', self._ids.get(category_id, ()))
+
+    def add(self, question_id, category_id):
+        with self._lock:
+            for changes in self._changes:
+                changes.append((question_id, category_id))
+            if self._ids is not None:
+                self._add(self._ids, question_id, category_id)
+
+    def discard(self, question_id):
+        with self._lock:
+            for changes in self._changes:
+                changes.append((question_id, None))
+            if self._ids is not None:
+                self._discard(self._ids, question_id)
+
+    @classmethod
+    def _add(cls, pool, question_id, category_id):
+        for key in (ALL_CATEGORIES, category_id):
+            ids = pool.setdefault(key, array('l'))
+            if ids and ids[-1] < question_id:
+                ids.append(question_id)
+            elif not cls._contains(ids, question_id):
+                insort(ids, question_id)
+
+    @staticmethod
+    def _discard(pool, question_id):
+        for ids in pool.values():
+            index = bisect_left(ids, question_id)
+            if index < len(ids) and ids[index] == question_id:
+                del ids[index]
+
+    @staticmethod
+    def _contains(ids, question_id):
+        index = bisect_left(ids, question_id)
+        return index < len(ids) and ids[index] == question_id
+
+    def _load_in_background(self, app):
+        try:
+            with app.app_context():
+                self.load()
+        except Exception as e:
+            logger.error("Error loading quiz pool: %s", e)
+        finally:
+            with self._lock:
+                self._loading = False
+
+
+question_pool = QuestionIdPool()
+
+
+@question_changed.connect
+def _update_question_pool(sender, action):
+    if not isinstance(sender, Question):
+        question_pool.invalidate()
+        return
+
+    question_id = sender.id
+    if action == 'delete':
+        question_pool.discard(question_id)
+    elif action == 'insert':
+        question_pool.add(question_id, sender.category)
+    else:
+        # The category may have changed, so move the id
+        question_pool.discard(question_id)
+        question_pool.add(question_id, sender.category)
+
+
+def seeded_permutation(seed, size):
+    """Derives `k -> (multiplier * k + offset) % size`, a permutation of `size` positions, from a seed"""
+    digest = hashlib.blake2b(seed.encode('utf-8'), digest_size=16).digest()
+    multiplier = int.from_bytes(digest[:8], 'big') % size
+    offset = int.from_bytes(digest[8:], 'big') % size
+    # A multiplier coprime with the size makes the map a bijection
+    while math.gcd(multiplier, size) != 1:
+        multiplier = (multiplier + 1) % size
+    return multiplier, offset
+
+
+def parse_bands(spec):
+    """
+    Parses difficulty bands such as '1-2,3,4-5'
+
+    Returns:
+        bands (list): (lowest, highest) difficulty of each band, easiest first
+
+    Raises:
+        ValueError: If the bands are malformed or overlap
+    """
+    bands = []
+    for part in spec.split(','):
+        low, _, high = part.strip().partition('-')
+        band = (int(low), int(high or low))
+        if band[0] > band[1] or (bands and band[0] <= bands[-1][1]):
+            raise ValueError(f"QUIZ_DECK_BANDS must be ascending, non-overlapping ranges, not {spec}")
+        bands.append(band)
+    return bands
+
+
+class QuizDeckStore:
+    """
+    Precomputed question decks for ramped quizzes
+
+    For every category (and ALL_CATEGORIES) and difficulty band, the ids
+    are kept in an `array('l')` shuffled with a fixed per-deck seed, so
+    the same questions always give the same deck. A ramped quiz asks up
+    to `steps_per_band` questions of each band, easiest first, and the
+    rest of the hardest band. Step `n` of a quiz is found by locating its
+    band and applying a permutation of the deck derived from the quiz's
+    seed: O(1) work, no per-player state, and every player with the same
+    seed gets the same sequence without repeats.
+
+    Decks are built on first use and rebuilt in the background every
+    `ttl` seconds; questions added meanwhile join at the next rebuild,
+    and deleted ones are skipped. Every build has a version derived from
+    its contents, so workers that read the same questions agree on it.
+    The last `history` builds are kept: a quiz that carries the version
+    it started on keeps walking the same permutation after a rebuild.
+    """
+    def __init__(self, bands=QUIZ_DECK_BANDS, ttl=QUIZ_DECK_TTL, steps_per_band=QUIZ_RAMP_STEPS,
+                 history=QUIZ_DECK_HISTORY):
+        self.bands = parse_bands(bands)
+        self.ttl = ttl
+        self.steps_per_band = steps_per_band
+        self.history = max(history, 1)
+        self._band_of = {difficulty: index for index, (low, high) in enumerate(self.bands)
+                         for difficulty in range(low, high + 1)}
+        self._decks = None
+        self._version = None
+        self._builds = OrderedDict()
+        self._loaded_at = 0.0
+        self._loading = False
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    @property
+    def is_loaded(self):
+        return self._decks is not None
+
+    def ensure_loaded(self, app):
+        """Builds the decks if they are cold, or starts a background rebuild if they are stale"""
+        if self._decks is None:
+            # The first requests wait for a single build instead of each scanning the table
+            with self._build_lock:
+                if self._decks is None:
+                    self.load()
+            return
+
+        with self._lock:
+            if time.monotonic() - self._loaded_at < self.ttl or self._loading:
+                return
+            self._loading = True
+        thread = threading.Thread(target=self._load_in_background, args=(app,), daemon=True)
+        thread.start()
+
+    def load(self):
+        """Builds the decks from the database (requires an app context)"""
+        decks = {}
+        rows = db.session.query(Question.id, Question.category, Question.difficulty).order_by(Question.id)
+        for question_id, category, difficulty in rows.yield_per(10000):
+            band = self._band_of.get(difficulty)
+            if band is None:
+                continue
+            for key in ((ALL_CATEGORIES, band), (category, band)):
+                decks.setdefault(key, array('l')).append(question_id)
+
+        digest = hashlib.blake2b(digest_size=8)
+        for (category, band), ids in sorted(decks.items()):
+            random.Random(f'{category}:{band}').shuffle(ids)
+            digest.update(f'{category}:{band}:{len(ids)};'.encode('utf-8'))
+            digest.update(ids.tobytes())
+        version = digest.hexdigest()
+
+        with self._lock:
+            # An unchanged build keeps its version and the decks already in use
+            if version != self._version:
+                self._builds[version] = decks
+                self._builds.move_to_end(version)
+                while len(self._builds) > self.history:
+                    self._builds.popitem(last=False)
+                self._decks = self._builds[version]
+                self._version = version
+            self._loaded_at = time.monotonic()
+        logger.info("Quiz decks %s built for %s bands", version, len(decks))
+
+    def resolve_version(self, version=None):
+        """
+        Returns the deck version a quiz should use
+
+        Args:
+            version (str): Version a quiz started on, or None for a new quiz
+
+        Returns:
+            version (str): `version` while that build is kept, otherwise the current one
+        """
+        with self._lock:
+            return version if version in self._builds else self._version
+
+    def total_steps(self, category_id, version=None):
+        """Returns the number of steps of a ramped quiz over a category"""
+        return sum(self._segments(self._get_decks(version), category_id))
+
+    def step(self, category_id, seed, step, version=None):
+        """
+        Returns the question id asked at a step of a ramped quiz
+
+        Args:
+            category_id (int): Category id, or ALL_CATEGORIES
+            seed (str): Quizzes with the same seed ask the same questions
+            step (int): Zero-based position in the quiz
+            version (str): Deck version from resolve_version, None for the current decks
+
+        Returns:
+            (question_id, band): question_id is None once the quiz is over
+        """
+        decks = self._get_decks(version)
+        for band, length in enumerate(self._segments(decks, category_id)):
+            if step < length:
+                deck = decks[(category_id, band)]
+                multiplier, offset = self._permutation(seed, category_id, band, len(deck))
+                return deck[(multiplier * step + offset) % len(deck)], band
+            step -= length
+        return None, None
+
+    def _get_decks(self, version):
+        decks = self._builds.get(version) if version is not None else None
+        return decks if decks is not None else self._decks
+
+    def _segments(self, decks, category_id):
+        """Steps asked from each band, easiest first"""
+        last = len(self.bands) - 1
+        lengths = []
+        for band in range(len(self.bands)):
+            size = len(decks.get((category_id, band), ()))
+            lengths.append(size if band == last else min(size, self.steps_per_band))
+        return lengths
+
+    @staticmethod
+    def _permutation(seed, category_id, band, size):
+        return seeded_permutation(f'{seed}:{category_id}:{band}', size)
+
+    def _load_in_background(self, app):
+        try:
+            with app.app_context():
+                self.load()
+        except Exception as e:
+            logger.error("Error building quiz decks: %s", e)
+        finally:
+            with self._lock:
+                self._loading = False
+
+
+quiz_decks = QuizDeckStore()
+
+
+def parse_ramp_request(body):
+    """
+    Reads the seed, step and deck version of a ramped quiz request
+
+    Returns:
+        (seed, step, version): seed and step are None when either is missing
+        or invalid; version is None for a new quiz
+    """
+    seed = body.get('seed')
+    step = body.get('step', 0)
+    version = body.get('deck_version')
+    if isinstance(seed, bool) or not isinstance(seed, (str, int)) or isinstance(step, bool) \
+            or not isinstance(step, int) or step < 0:
+        return None, None, None
+    if version is not None and (not isinstance(version, str) or len(version) > MAX_DECK_VERSION_LENGTH):
+        return None, None, None
+    seed = str(seed)
+    if not 0 < len(seed) <= MAX_QUIZ_SEED_LENGTH:
+        return None, None, None
+    return seed, step, version
+
+
+def parse_prefetch_count(body):
+    """
+    Reads the number of questions a quiz request prefetches
+
+    Returns:
+        count (int): None when `count` is absent, 0 when it is invalid
+    """
+    count = body.get('count')
+    if count is None:
+        return None
+    if isinstance(count, bool) or not isinstance(count, int) or not 0 < count <= MAX_QUIZ_PREFETCH:
+        return 0
+    return count
+
+
+def shuffled_ids(ids):
+    """Returns a shuffled array('l') copy of question ids"""
+    deck = array('l', ids)
+    random.shuffle(deck)
+    return deck
+
+
+class QuizSession:
+    """Position of one quiz in the seeded permutation of a shared deck"""
+    __slots__ = ('deck', 'multiplier', 'offset', 'position', 'expires_at')
+
+    def __init__(self, deck, seed, expires_at):
+        self.deck = deck
+        self.multiplier, self.offset = seeded_permutation(seed, len(deck)) if deck else (0, 0)
+        self.position = 0
+        self.expires_at = expires_at
+
+    @property
+    def remaining(self):
+        return len(self.deck) - self.position
+
+    def draw(self):
+        """Draws the id at the next position of the permutation, or None when exhausted"""
+        if self.position >= len(self.deck):
+            return None
+        question_id = self.deck[(self.multiplier * self.position + self.offset) % len(self.deck)]
+        self.position += 1
+        return question_id
+
+
+class QuizSessionStore:
+    """
+    Server-side quiz sessions, so clients do not resend previous_questions
+
+    The sessions of a category share one shuffled copy of its ids (a deck),
+    replaced for new sessions every `deck_ttl` seconds. A session only
+    holds its position in a permutation of the deck derived from its id,
+    so it takes a few dozen bytes however large the category is, and every
+    round is O(1) regardless of how long the session has run. Sessions
+    expire `ttl` seconds after their last use; the least recently used
+    sessions are evicted beyond `max_sessions`. Sessions live in the worker
+    process that created them; see SharedQuizSessionStore for several workers.
+    """
+    def __init__(self, ttl=QUIZ_SESSION_TTL, max_sessions=QUIZ_SESSION_LIMIT, deck_ttl=QUIZ_SESSION_DECK_TTL):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.deck_ttl = deck_ttl
+        self._sessions = OrderedDict()
+        self._decks = {}
+        self._lock = threading.Lock()
+
+    def create(self, category_id, ids=None):
+        """
+        Starts a session over the questions of a category
+
+        Args:
+            category_id (int): Category id, or ALL_CATEGORIES
+            ids (list): The category's question ids; only needed when the
+                category has no current deck
+
+        Returns:
+            (session_id, total): Opaque id the client sends on each round, and
+            the number of questions of the session
+
+        Raises:
+            KeyError: If `ids` is None and the category has no current deck
+        """
+        now = time.monotonic()
+        with self._lock:
+            deck, built_at = self._decks.get(category_id, (None, 0.0))
+        if deck is None or now - built_at >= self.deck_ttl:
+            if ids is None:
+                raise KeyError(category_id)
+            deck = shuffled_ids(ids)
+            with self._lock:
+                self._decks[category_id] = (deck, now)
+
+        session_id = secrets.token_urlsafe(16)
+        with self._lock:
+            self._evict(now)
+            self._sessions[session_id] = QuizSession(deck, session_id, now + self.ttl)
+        return session_id, len(deck)
+
+    def draw(self, session_id):
+        """
+        Draws the next question id of a session
+
+        Returns:
+            (question_id, remaining): question_id is None when the session is exhausted
+
+        Raises:
+            KeyError: If the session does not exist or has expired
+        """
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions[session_id]
+            if session.expires_at <= now:
+                del self._sessions[session_id]
+                raise KeyError(session_id)
+            session.expires_at = now + self.ttl
+            self._sessions.move_to_end(session_id)
+            return session.draw(), session.remaining
+
+    def discard(self, session_id):
+        """Ends a session, returns False if it did not exist"""
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def _evict(self, now):
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.expires_at > now and len(self._sessions) < self.max_sessions:
+                break
+            del self._sessions[session_id]
+
+
+class SharedQuizSessionStore:
+    """
+    Quiz sessions kept in a shared cache backend, so any worker can serve them
+
+    As in QuizSessionStore, the sessions of a category share a shuffled
+    deck of its ids, stored once as a list and replaced for new sessions
+    every `deck_ttl` seconds. A session is its deck key and size plus a
+    counter of the rounds drawn. Each round atomically increments the
+    counter and reads the deck at that position of the session's
+    permutation, so concurrent rounds of one session never draw the same
+    question. Sessions expire `ttl` seconds after their last use, and a
+    deck `ttl` seconds after the last use of any of its sessions.
+    """
+    def __init__(self, backend, ttl=QUIZ_SESSION_TTL, deck_ttl=QUIZ_SESSION_DECK_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.deck_ttl = deck_ttl
+        self._decks = {}
+
+    def create(self, category_id, ids=None):
+        """
+        Starts a session over the questions of a category
+
+        Args:
+            category_id (int): Category id, or ALL_CATEGORIES
+            ids (list): The category's question ids; only needed when the
+                category has no current deck
+
+        Returns:
+            (session_id, total): Opaque id the client sends on each round, and
+            the number of questions of the session
+
+        Raises:
+            KeyError: If `ids` is None and the category has no current deck
+            RuntimeError: If the backend could not store the session
+        """
+        now = time.monotonic()
+        deck_key, size, built_at = self._decks.get(category_id, (None, 0, 0.0))
+        # Renewing the deck also checks it is still stored
+        if deck_key is None or now - built_at >= self.deck_ttl or \
+                (size and self.backend.list_item(deck_key, 0, self.ttl) is None):
+            if ids is None:
+                raise KeyError(category_id)
+            deck = shuffled_ids(ids)
+            deck_key, size = f'deck:{category_id}:{secrets.token_urlsafe(8)}', len(deck)
+            if size and not self.backend.set_list(deck_key, deck.tolist(), self.ttl):
+                raise RuntimeError('Could not store the quiz session')
+            self._decks[category_id] = (deck_key, size, now)
+
+        session_id = secrets.token_urlsafe(16)
+        if not self.backend.set_list(session_id, [f'{size}:{deck_key}'], self.ttl):
+            raise RuntimeError('Could not store the quiz session')
+        return session_id, size
+
+    def draw(self, session_id):
+        """
+        Draws the next question id of a session
+
+        Returns:
+            (question_id, remaining): question_id is None when the session is exhausted
+
+        Raises:
+            KeyError: If the session does not exist, has expired or the backend is unavailable
+        """
+        position = self.backend.incr(f'{session_id}:position', self.ttl)
+        found = self.backend.list_item(session_id, 0, self.ttl) if position else None
+        if found is None or found[0] is None:
+            raise KeyError(session_id)
+        size, deck_key = found[0].decode('utf-8').split(':', 1)
+        size = int(size)
+        if position > size:
+            return None, 0
+
+        multiplier, offset = seeded_permutation(session_id, size)
+        found = self.backend.list_item(deck_key, (multiplier * (position - 1) + offset) % size, self.ttl)
+        if found is None or found[0] is None:
+            raise KeyError(session_id)
+        return int(found[0]), size - position
+
+    def discard(self, session_id):
+        """Ends a session, returns False if it did not exist"""
+        self.backend.delete(f'{session_id}:position')
+        return self.backend.delete(session_id)
+
+
+def make_quiz_session_store(url=QUIZ_SESSION_URL):
+    """Returns a shared session store when `url` is configured, otherwise a per-worker one"""
+    backend = get_backend(url, prefix='trivia:quiz-session:')
+    if backend is None:
+        return QuizSessionStore()
+    return SharedQuizSessionStore(backend)
+
+
+quiz_sessions = make_quiz_session_store()
+
+
+class QuizRequestError(Exception):
+    """Stops a quiz plan with the error status the client gets (400 or 404)"""
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+# Quiz plans
+#
+# The quiz endpoints are written once, as plans shared by the Flask views and
+# the native ASGI handlers. A plan is a generator holding the validation, the
+# draw logic and the response body of a request; it yields each I/O operation
+# it needs as a tuple and is sent back the result:
+#
+#   ('execute', statement)      the rows of a SELECT
+#   ('ids', category_id)        every question id of a category, as an array('l')
+#   ('category', type)          the id of a category type, or None
+#   ('decks',)                  loads quiz_decks if they are cold
+#   ('replica',)                True if the request reads from a replica
+#   ('draw', session_id), ('create', category_id, ids), ('discard', session_id)
+#                               the quiz_sessions method of the same name
+#
+# An exception raised by an operation is thrown into the plan. `run_quiz_plan`
+# runs plans for the Flask views; AsyncTriviaApp.run_quiz_plan runs them on
+# the event loop.
+
+
+def run_quiz_plan(app, plan):
+    """
+    Runs a quiz plan with the Flask-SQLAlchemy session (requires an app context)
+
+    Returns:
+        The value the plan returns
+    """
+    send, value = plan.send, None
+    while True:
+        try:
+            operation = send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            send, value = plan.send, _perform_quiz_operation(app, operation)
+        except Exception as e:
+            send, value = plan.throw, e
+
+
+def _perform_quiz_operation(app, operation):
+    kind = operation[0]
+    if kind == 'execute':
+        return db.session.execute(operation[1]).all()
+    if kind == 'ids':
+        rows = db.session.execute(category_ids_query(operation[1]).execution_options(yield_per=10000))
+        return array('l', (question_id for question_id, in rows))
+    if kind == 'category':
+        return category_cache.get_id(operation[1])
+    if kind == 'decks':
+        return quiz_decks.ensure_loaded(app)
+    if kind == 'replica':
+        return reading_from_replica(db.session)
+    if kind in ('draw', 'create', 'discard'):
+        return getattr(quiz_sessions, kind)(*operation[1:])
+    raise ValueError(f'Unknown quiz operation: {kind}')
+
+
+def category_ids_query(category_id):
+    """Selects the ids of a category (or ALL_CATEGORIES)"""
+    query = select(Question.id)
+    if category_id != ALL_CATEGORIES:
+        query = query.where(Question.category == category_id)
+    return query
+
+
+def fetch_rows_plan(question_ids):
+    """Plan selecting QUESTION_COLUMNS rows, returns them keyed by id (deleted ids are missing)"""
+    if not question_ids:
+        return {}
+    rows = yield ('execute', select(*QUESTION_COLUMNS).where(Question.id.in_(question_ids)))
+    return {row[0]: row for row in rows}
+
+
+def quiz_category_plan(quiz_category):
+    """
+    Plan resolving the quiz_category of a quiz request
+
+    Returns:
+        category_id (int): ALL_CATEGORIES for "All", the matching category id,
+        or None if the category does not exist
+    """
+    if quiz_category['id'] == 0:
+        return ALL_CATEGORIES
+    return (yield ('category', str(quiz_category.get('type'))))
+
+
+def sample_question_plan(category_id, exclude):
+    """
+    Plan picking a random question with indexed SQL while the pool is cold
+
+    A random id between the category's min and max id is chosen and the
+    next unused question at or after it is read with an index range scan.
+
+    Returns:
+        row: A random QUESTION_COLUMNS row, or None if none are left
+    """
+    bounds = select(func.min(Question.id), func.max(Question.id))
+    query = select(*QUESTION_COLUMNS)
+    if category_id != ALL_CATEGORIES:
+        bounds = bounds.where(Question.category == category_id)
+        query = query.where(Question.category == category_id)
+
+    (low, high), = yield ('execute', bounds)
+    if low is None:
+        return None
+
+    if exclude:
+        query = query.where(Question.id.notin_(exclude))
+
+    pivot = random.randint(low, high)
+    rows = yield ('execute', query.where(Question.id >= pivot).order_by(Question.id).limit(1))
+    if not rows:
+        rows = yield ('execute', query.where(Question.id < pivot).order_by(Question.id.desc()).limit(1))
+    return rows[0] if rows else None
+
+
+def select_question_plan(app, category_id, exclude):
+    """
+    Plan picking a random question of a category that is not in `exclude`
+
+    Uses the in-memory id pool when it is loaded and falls back to an
+    indexed SQL sample (while the pool loads in the background) otherwise.
+
+    Returns:
+        row: A random QUESTION_COLUMNS row, or None if none are left
+    """
+    question_pool.ensure_loaded(app)
+    if not question_pool.is_loaded:
+        return (yield from sample_question_plan(category_id, exclude))
+
+    while True:
+        question_id = question_pool.pick(category_id, exclude)
+        if question_id is None:
+            return None
+
+        rows = yield from fetch_rows_plan([question_id])
+        if question_id in rows:
+            return rows[question_id]
+
+        if (yield ('replica',)):
+            # The replica may not have caught up with a new question yet
+            exclude = exclude | {question_id}
+        else:
+            # Deleted by another worker since the pool was built
+            question_pool.discard(question_id)
+
+
+def plan_ramp_steps(category_id, seed, step, count, version=None):
+    """Returns up to `count` (step, question_id, band) of a ramped quiz from `step` on"""
+    planned = []
+    while len(planned) < count:
+        question_id, band = quiz_decks.step(category_id, seed, step, version)
+        if question_id is None:
+            break
+        planned.append((step, question_id, band))
+        step += 1
+    return planned
+
+
+def ramp_questions_plan(category_id, seed, step, count, version=None):
+    """
+    Plan drawing the next `count` questions of a ramped quiz from `step`, fetched in one query
+
+    Questions deleted since the decks were built are skipped, and further
+    steps are fetched in their place.
+
+    Returns:
+        (drawn, next_step, version): (step, band, row) of each question, with
+        QUESTION_COLUMNS rows, the step to ask next (None once the quiz is
+        over) and the deck version used
+    """
+    yield ('decks',)
+    version = quiz_decks.resolve_version(version)
+    drawn = []
+    while len(drawn) < count:
+        planned = plan_ramp_steps(category_id, seed, step, count - len(drawn), version)
+        if not planned:
+            return drawn, None, version
+        rows = yield from fetch_rows_plan([question_id for _, question_id, _ in planned])
+        drawn.extend((planned_step, band, rows[question_id])
+                     for planned_step, question_id, band in planned if question_id in rows)
+        step = planned[-1][0] + 1
+    return drawn, step, version
+
+
+def draw_ramp_questions(app, category_id, seed, step, count, version=None):
+    """Runs ramp_questions_plan with the Flask-SQLAlchemy session"""
+    return run_quiz_plan(app, ramp_questions_plan(category_id, seed, step, count, version))
+
+
+def session_questions_plan(session_id, count):
+    """
+    Plan drawing the next `count` questions of a quiz session, fetched in one query
+
+    Returns:
+        (rows, remaining): QUESTION_COLUMNS rows, fewer than `count` when the
+        session runs out
+
+    Raises:
+        KeyError: If the session does not exist or has expired
+    """
+    drawn = []
+    remaining = 0
+    while len(drawn) < count:
+        question_ids = []
+        while len(drawn) + len(question_ids) < count:
+            question_id, remaining = yield ('draw', session_id)
+            if question_id is None:
+                break
+            question_ids.append(question_id)
+        if not question_ids:
+            break
+        rows = yield from fetch_rows_plan(question_ids)
+        drawn.extend(rows[question_id] for question_id in question_ids if question_id in rows)
+    return drawn, remaining
+
+
+def format_question(row):
+    """The JSON object of Question.format() for a QUESTION_COLUMNS row"""
+    return dict(zip(QUESTION_FIELDS, row)) if row is not None else None
+
+
+def quiz_plan(app, body):
+    """
+    Plan of POST /quizzes: the next question(s) of a quiz
+
+    A request continues a server-side session (`session_id`), asks for a
+    step of a ramped quiz (`mode`) or picks a random question outside
+    `previous_questions`. Sessions and ramped quizzes can prefetch `count`
+    questions at once.
+
+    Args:
+        app: The Flask application (used to load the pool in the background)
+        body: The parsed JSON body
+
+    Returns:
+        data (dict): The response body
+
+    Raises:
+        QuizRequestError: For requests answered with a 400 or 404; other
+        invalid requests fail like any error of the handlers, with a 500
+    """
+    # Validate request body
+    if not body:
+        logger.warning("Empty request body for quiz")
+        raise ValueError('Empty request body')
+
+    # Prefetch: the next `count` questions at once (sessions and ramped quizzes)
+    count = parse_prefetch_count(body)
+    if count == 0:
+        logger.warning("Invalid quiz prefetch count: %s", body.get('count'))
+        raise QuizRequestError(400)
+
+    # Server-side session: just draw the next question(s)
+    session_id = body.get('session_id')
+    if session_id is not None:
+        try:
+            rows, remaining = yield from session_questions_plan(str(session_id), count or 1)
+        except KeyError:
+            logger.warning("Quiz session not found: %s", session_id)
+            raise QuizRequestError(404)
+
+        if count is not None:
+            return {
+                'questions': question_json_cache.encode_rows(rows),
+                'session_id': session_id,
+                'remaining': remaining,
+                'success': True
+            }
+        return {
+            'question': format_question(rows[0] if rows else None),
+            'session_id': session_id,
+            'remaining': remaining if rows else 0,
+            'success': True
+        }
+
+    prev_questions = body.get('previous_questions', [])
+    quiz_category = body.get('quiz_category', None)
+    mode = body.get('mode')
+
+    # Validate quiz_category
+    if not quiz_category or 'id' not in quiz_category:
+        logger.warning("Invalid quiz category")
+        raise ValueError('Invalid quiz category')
+
+    # Ramped quiz: the question(s) from `step` of the sequence of `seed`
+    if mode is not None:
+        seed, step, version = parse_ramp_request(body)
+        if mode != 'ramp' or seed is None:
+            logger.warning("Invalid quiz mode, seed or step: %s", body)
+            raise QuizRequestError(400)
+
+        category_id = yield from quiz_category_plan(quiz_category)
+        if category_id is None:
+            logger.warning("Category not found: %s", quiz_category['type'])
+            raise ValueError('Category not found')
+
+        drawn, next_step, version = yield from ramp_questions_plan(
+            category_id, seed, step, count or 1, version)
+        total_steps = quiz_decks.total_steps(category_id, version)
+        if count is not None:
+            logger.info("Ramped quiz %s: prefetched %s questions from step %s", seed, len(drawn), step)
+            return {
+                'questions': [format_question(row) for _, _, row in drawn],
+                'steps': [drawn_step for drawn_step, _, _ in drawn],
+                'difficulties': [list(quiz_decks.bands[band]) for _, band, _ in drawn],
+                'mode': mode,
+                'seed': seed,
+                'next_step': next_step,
+                'deck_version': version,
+                'total_steps': total_steps,
+                'success': True
+            }
+
+        if not drawn:
+            # Steps of deleted questions were skipped up to the end of the quiz
+            step = max(step, total_steps)
+            logger.info("Ramped quiz %s step %s: question %s", seed, step, None)
+            return {
+                'question': None,
+                'mode': mode,
+                'seed': seed,
+                'step': step,
+                'next_step': None,
+                'difficulty': None,
+                'deck_version': version,
+                'total_steps': total_steps,
+                'success': True
+            }
+        step, band, row = drawn[0]
+        logger.info("Ramped quiz %s step %s: question %s", seed, step, row[0])
+        return {
+            'question': format_question(row),
+            'mode': mode,
+            'seed': seed,
+            'step': step,
+            'next_step': step + 1,
+            'difficulty': list(quiz_decks.bands[band]),
+            'deck_version': version,
+            'total_steps': total_steps,
+            'success': True
+        }
+
+    # Prefetching needs a session or a ramped quiz to know the next questions
+    if count is not None:
+        logger.warning("Quiz prefetch without a session or mode")
+        raise QuizRequestError(400)
+
+    # Ensure prev_questions is a list of ids
+    if not isinstance(prev_questions, list):
+        logger.warning("Invalid previous_questions format")
+        raise ValueError('Invalid previous_questions format')
+    try:
+        prev_questions = {int(question_id) for question_id in prev_questions}
+    except (ValueError, TypeError):
+        logger.warning("Invalid previous_questions format")
+        raise ValueError('Invalid previous_questions format')
+
+    logger.info("Fetching quiz question for category: %s", quiz_category)
+
+    category_id = yield from quiz_category_plan(quiz_category)
+    if category_id is None:
+        logger.warning("Category not found: %s", quiz_category['type'])
+        raise ValueError('Category not found')
+
+    row = yield from select_question_plan(app, category_id, prev_questions)
+    if row is not None:
+        logger.info("Selected quiz question ID: %s", row[0])
+    else:
+        logger.info("No more questions available for quiz")
+
+    return {
+        'question': format_question(row),
+        'success': True
+    }
+
+
+def quiz_session_plan(body):
+    """
+    Plan of POST /quizzes/sessions: starts a server-side quiz session
+
+    Returns:
+        data (dict): The response body
+
+    Raises:
+        QuizRequestError: If the category does not exist (404); other invalid
+        requests fail like any error of the handlers, with a 500
+    """
+    # Validate request body
+    if not body:
+        logger.warning("Empty request body for quiz session")
+        raise ValueError('Empty request body')
+
+    quiz_category = body.get('quiz_category', None)
+    if not quiz_category or 'id' not in quiz_category:
+        logger.warning("Invalid quiz category")
+        raise ValueError('Invalid quiz category')
+
+    category_id = yield from quiz_category_plan(quiz_category)
+    if category_id is None:
+        logger.warning("Category not found: %s", quiz_category['type'])
+        raise QuizRequestError(404)
+
+    try:
+        session_id, total = yield ('create', category_id, None)
+    except KeyError:
+        # No current deck for the category: build one from its ids
+        ids = question_pool.snapshot(category_id)
+        if ids is None:
+            ids = yield ('ids', category_id)
+        session_id, total = yield ('create', category_id, ids)
+    logger.info("Created quiz session with %s questions for category: %s", total, quiz_category)
+
+    return {
+        'success': True,
+        'session_id': session_id,
+        'total_questions': total,
+        'expires_in': quiz_sessions.ttl
+    }
+
+
+def end_quiz_session_plan(session_id):
+    """
+    Plan of DELETE /quizzes/sessions/<session_id>
+
+    Raises:
+        QuizRequestError: If the session does not exist (404)
+    """
+    if not (yield ('discard', session_id)):
+        logger.warning("Quiz session not found: %s", session_id)
+        raise QuizRequestError(404)
+
+    logger.info("Ended quiz session %s", session_id)
+    return {
+        'success': True,
+        'deleted': session_id
+    }
@@ -0,0 +1,304 @@
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
+
+from flask_limiter import Limiter
+from limits.errors import ConfigurationError
+from limits.storage import Storage
+
+from instrumentation import phase
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# memory:// (per worker), shm:///path (shared by the workers of one host),
+# counter+redis://host:6379/0 (shared by every host); add ?batch=N to lease hits in batches
+RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI', 'memory://')
+RATELIMIT_SHM_SLOTS = int(os.environ.get('RATELIMIT_SHM_SLOTS', '65536'))
+# Set to false to turn rate limiting off (e.g. for load tests)
+RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RATELIMIT_SHM_PATH = os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'trivia-ratelimit')
+
+# Leases kept per worker before expired ones are purged
+MAX_LEASES = 10000
+
+
+def get_limiter_options(storage_uri=RATELIMIT_STORAGE_URI):
+    """Returns the Limiter keyword arguments for a storage URI"""
+    return {
+        'storage_uri': storage_uri,
+        # Keep limiting per worker if a shared storage becomes unreachable
+        'in_memory_fallback_enabled': not storage_uri.startswith('memory://'),
+    }
+
+
+class TimedLimiter(Limiter):
+    """Limiter recording the time spent checking limits as the rate_limit phase"""
+    def _check_request_limit(self, *args, **kwargs):
+        # Every check (before_request and the limit decorators) goes through here
+        with phase('rate_limit'):
+            return super()._check_request_limit(*args, **kwargs)
+
+
+def _pop_option(uri, options, name, default):
+    """Reads an option from the storage options or the URI query, removing it from the URI"""
+    parsed = urlparse(uri)
+    query = parse_qs(parsed.query)
+    value = options.pop(name, None)
+    if name in query:
+        value = query.pop(name)[-1] if value is None else value
+        uri = urlunparse(parsed._replace(query=urlencode(query, doseq=True)))
+    return uri, default if value is None else value
+
+
+class LeasedCounterStorage(Storage):
+    """
+    Base of the shared fixed-window storages, optionally leasing hits in batches
+
+    With `batch=1` every hit increments the shared counter. With a larger
+    batch, a worker increments the shared counter by `batch` at once and
+    hands the reserved hits out locally, so only one hit in `batch` touches
+    the shared store. Each leased hit still gets a unique position in the
+    window, so a limit is never exceeded; hits a worker leased but did not
+    use before the window ends are lost, which can lower the effective
+    limit by up to workers x (batch - 1). Only use a batch on limits that
+    are large compared to that.
+
+    Subclasses implement `_incr(key, expiry, amount)` returning the new
+    count and the expiry time of the window.
+    """
+    def __init__(self, uri=None, wrap_exceptions=False, batch=1, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.batch = max(int(batch), 1)
+        self._leases = {}
+        self._leases_lock = threading.Lock()
+
+    def incr(self, key, expiry, amount=1):
+        if self.batch == 1 or amount != 1:
+            return self._incr(key, expiry, amount)[0]
+
+        now = time.time()
+        with self._leases_lock:
+            lease = self._leases.get(key)
+            if lease is not None and lease[0] < lease[1] and now < lease[2]:
+                lease[0] += 1
+                return lease[0]
+
+        count, expires_at = self._incr(key, expiry, self.batch)
+        with self._leases_lock:
+            if len(self._leases) >= MAX_LEASES:
+                self._leases = {k: v for k, v in self._leases.items() if v[2] > now}
+            # [last position handed out, last position reserved, window expiry]
+            self._leases[key] = [count - self.batch + 1, count, expires_at]
+        return count - self.batch + 1
+
+    def _drop_leases(self, key=None):
+        with self._leases_lock:
+            if key is None:
+                self._leases.clear()
+            else:
+                self._leases.pop(key, None)
+
+
+class SharedMemoryStorage(LeasedCounterStorage):
+    """
+    Fixed-window counters in a memory-mapped file shared by the workers of one host
+
+    The file is a hash table of (key hash, window expiry, count) slots
+    grouped in buckets of BUCKET_SLOTS. A hit locks its bucket with a
+    byte-range `lockf` and updates the slot in place, so counting costs
+    no reads or writes beyond the lock itself. Expired slots are reused;
+    if every slot of a bucket is live, the one closest to expiring is
+    recycled. Use a path on tmpfs (the default is under /dev/shm).
+    """
+    STORAGE_SCHEME = ['shm']
+    BUCKET_SLOTS = 16
+    SLOT = struct.Struct('<QdQ')
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        if fcntl is None:
+            raise ConfigurationError('shm:// rate limit storage requires a POSIX system')
+
+        uri, slots = _pop_option(uri or 'shm://', options, 'slots', RATELIMIT_SHM_SLOTS)
+        uri, batch = _pop_option(uri, options, 'batch', 1)
+        self.path = urlparse(uri).path or RATELIMIT_SHM_PATH
+        self.buckets = max(int(slots) // self.BUCKET_SLOTS, 1)
+        self.size = self.buckets * self.BUCKET_SLOTS * self.SLOT.size
+
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < self.size:
+            os.ftruncate(self._fd, self.size)
+        self._map = mmap.mmap(self._fd, self.size)
+        # lockf locks are per process, so threads also need a local lock
+        self._lock = threading.Lock()
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, batch=batch, **options)
+
+    @property
+    def base_exceptions(self):
+        return OSError
+
+    @staticmethod
+    def _hash(key):
+        key_hash = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+        # 0 marks a slot that was never used
+        return key_hash or 1
+
+    @contextmanager
+    def _locked(self, key_hash=None):
+        if key_hash is None:
+            start, length = 0, 0
+        else:
+            length = self.BUCKET_SLOTS * self.SLOT.size
+            start = (key_hash % self.buckets) * length
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+
+    def _find(self, key_hash, now):
+        """Returns (offset, expires_at, count, found) for a key's slot or a free one"""
+        first = (key_hash % self.buckets) * self.BUCKET_SLOTS
+        free = None
+        oldest = None
+        for slot in range(first, first + self.BUCKET_SLOTS):
+            offset = slot * self.SLOT.size
+            slot_hash, expires_at, count = self.SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                return offset, expires_at, count, True
+            if free is None and (slot_hash == 0 or expires_at <= now):
+                free = offset
+            if slot_hash == 0:
+                # Slots fill up in order, so no key is stored past an unused one
+                break
+            if oldest is None or expires_at < oldest[1]:
+                oldest = (offset, expires_at)
+
+        if free is None:
+            logger.warning("Rate limit storage bucket is full, recycling the oldest counter")
+            free = oldest[0]
+        return free, 0.0, 0, False
+
+    def _incr(self, key, expiry, amount):
+        key_hash = self._hash(key)
+        now = time.time()
+        with self._locked(key_hash):
+            offset, expires_at, count, found = self._find(key_hash, now)
+            if not found or expires_at <= now:
+                count, expires_at = 0, now + expiry
+            count += amount
+            self.SLOT.pack_into(self._map, offset, key_hash, expires_at, count)
+        return count, expires_at
+
+    def get(self, key):
+        key_hash = self._hash(key)
+        now = time.time()
+        with self._locked(key_hash):
+            _, expires_at, count, found = self._find(key_hash, now)
+        return count if found and expires_at > now else 0
+
+    def get_expiry(self, key):
+        key_hash = self._hash(key)
+        now = time.time()
+        with self._locked(key_hash):
+            _, expires_at, _, found = self._find(key_hash, now)
+        return expires_at if found and expires_at > now else now
+
+    def clear(self, key):
+        self._drop_leases(key)
+        key_hash = self._hash(key)
+        with self._locked(key_hash):
+            offset, _, _, found = self._find(key_hash, time.time())
+            if found:
+                self.SLOT.pack_into(self._map, offset, key_hash, 0.0, 0)
+
+    def reset(self):
+        self._drop_leases()
+        now = time.time()
+        with self._locked():
+            live = sum(1 for offset in range(0, self.size, self.SLOT.size)
+                       if self.SLOT.unpack_from(self._map, offset)[1] > now)
+            self._map[:] = bytes(self.size)
+        return live
+
+    def check(self):
+        return not self._map.closed
+
+
+class RedisCounterStorage(LeasedCounterStorage):
+    """
+    Fixed-window counters in Redis (or any server speaking its protocol)
+
+    Each hit is one pipelined round trip of SET NX EX, INCRBY and PTTL,
+    commands every Redis-compatible server supports (no Lua scripting).
+    The URI is the server URL prefixed with 'counter+', e.g.
+    counter+redis://localhost:6379/0. `client` may be any object with the
+    redis-py interface, which lets the storage run against a stand-in.
+    """
+    STORAGE_SCHEME = ['counter+redis', 'counter+rediss', 'counter+unix']
+
+    def __init__(self, uri, wrap_exceptions=False, client=None, **options):
+        uri, batch = _pop_option(uri, options, 'batch', 1)
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ConfigurationError(
+                    'The redis package is required for counter+redis:// rate limit storage: '
+                    'pip install redis')
+            client = redis.Redis.from_url(uri.split('+', 1)[1], socket_timeout=0.25,
+                                          socket_connect_timeout=0.25)
+        self.client = client
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, batch=batch, **options)
+
+    @property
+    def base_exceptions(self):
+        try:
+            from redis.exceptions import RedisError
+        except ImportError:
+            return OSError
+        return (RedisError, OSError)
+
+    def _incr(self, key, expiry, amount):
+        pipeline = self.client.pipeline()
+        pipeline.set(key, 0, ex=expiry, nx=True)
+        pipeline.incrby(key, amount)
+        pipeline.pttl(key)
+        _, count, ttl = pipeline.execute()
+        return int(count), time.time() + max(ttl, 0) / 1000
+
+    def get(self, key):
+        return int(self.client.get(key) or 0)
+
+    def get_expiry(self, key):
+        return time.time() + max(self.client.pttl(key), 0) / 1000
+
+    def clear(self, key):
+        self._drop_leases(key)
+        self.client.delete(key)
+
+    def reset(self):
+        self._drop_leases()
+        keys = list(self.client.scan_iter(match='LIMITER*'))
+        if keys:
+            self.client.delete(*keys)
+        return len(keys)
+
+    def check(self):
+        try:
+            return bool(self.client.ping())
+        except Exception:
+            return False
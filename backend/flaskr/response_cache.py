@@ -0,0 +1,220 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import quote, urlencode
+
+from flask import current_app, make_response, request
+
+from cache_backends import get_backend
+from models import category_changed, get_version, question_changed
+
+logger = logging.getLogger(__name__)
+
+# Number of responses kept per worker (0 disables the cache)
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '512'))
+# Seconds a cached response is reused (also bounds staleness from other workers' writes without sync)
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', '300'))
+# Cache-Control max-age of public endpoints (seconds a CDN or browser may reuse a response)
+RESPONSE_CACHE_MAX_AGE = int(os.environ.get('RESPONSE_CACHE_MAX_AGE', '30'))
+# Seconds between checks of the shared data version (0 = per-worker version, single worker only)
+RESPONSE_CACHE_SYNC_INTERVAL = int(os.environ.get('RESPONSE_CACHE_SYNC_INTERVAL', '1'))
+# RESPONSE_CACHE_URL optionally points at a shared backend (e.g. redis://localhost:6379/0)
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL')
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of rendered GET responses with ETag revalidation
+
+    Responses are keyed on the request path, the sorted query arguments
+    and a data version that changes on every Question or Category write,
+    so a write makes every cached response unreachable at once. Each entry
+    stores the encoded body and a strong ETag derived from it; clients
+    that send a matching If-None-Match get an empty 304.
+
+    By default the version comes from the `questions` and `categories`
+    counters in the database, checked at most every `sync_interval`
+    seconds, so every worker agrees on the keys and a write elsewhere is
+    seen within that interval. A sync interval of 0 (not allowed with a
+    shared backend) uses a counter bumped in this process instead; writes
+    made by other workers then stay invisible, and keep revalidating with
+    304s, for up to `ttl` seconds, so it is only meant for a single worker.
+    """
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL,
+                 max_age=RESPONSE_CACHE_MAX_AGE, sync_interval=RESPONSE_CACHE_SYNC_INTERVAL,
+                 backend=None):
+        if backend is not None and not sync_interval:
+            sync_interval = 1
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_age = max_age
+        self.sync_interval = sync_interval
+        self.backend = backend
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._version = None
+        self._checked_at = 0.0
+
+    def data_version(self):
+        """Returns the current data version (queries the database at most every sync_interval)"""
+        if not self.sync_interval:
+            return f'l{self._generation}'
+
+        version = self._version
+        if version is None or time.monotonic() - self._checked_at >= self.sync_interval:
+            version = f"{get_version('questions')}.{get_version('categories')}"
+            self._version = version
+            self._checked_at = time.monotonic()
+        return version
+
+    def cached_version(self):
+        """Returns the data version if no database query is due, else None"""
+        if not self.sync_interval:
+            return f'l{self._generation}'
+        if self._version is None or time.monotonic() - self._checked_at >= self.sync_interval:
+            return None
+        return self._version
+
+    @staticmethod
+    def make_key(version, path, args):
+        """Builds the cache key of a request from its path and (name, value) query arguments"""
+        # Names and values are escaped again, so a decoded '&' or '=' cannot forge another query
+        return f'{version}:{quote(path)}?{urlencode(sorted(args))}'
+
+    def invalidate(self):
+        """Bumps the local data version and drops every local entry"""
+        with self._lock:
+            self._generation += 1
+            self._version = None
+            self._entries.clear()
+
+    def get(self, key):
+        """
+        Returns a cached response
+
+        Returns:
+            (etag, mimetype, body): The cached entry, or None on a miss
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, etag, mimetype, body = entry
+                if now < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return etag, mimetype, body
+                del self._entries[key]
+
+        if self.backend is not None:
+            data = self.backend.get(key)
+            if data is not None:
+                etag, mimetype, body = data.split(b'\n', 2)
+                etag, mimetype = etag.decode('ascii'), mimetype.decode('ascii')
+                self._store(key, etag, mimetype, body)
+                with self._lock:
+                    self.shared_hits += 1
+                return etag, mimetype, body
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, mimetype, body):
+        """
+        Caches an encoded response body
+
+        Returns:
+            etag (str): The strong ETag of the body
+        """
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        self._store(key, etag, mimetype, body)
+        if self.backend is not None:
+            data = b'\n'.join((etag.encode('ascii'), mimetype.encode('ascii'), body))
+            self.backend.set(key, data, self.ttl)
+        return etag
+
+    def clear(self):
+        """Drops all local entries and resets the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.shared_hits = self.misses = 0
+
+    def stats(self):
+        """Returns hit/miss counters and the current size"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'size': len(self._entries)
+            }
+
+    def cache_control(self, public):
+        """Returns the Cache-Control header of a public or authenticated response"""
+        return f'public, max-age={self.max_age}' if public else 'private, no-cache'
+
+    def cached(self, public=True):
+        """
+        Decorator caching the 200 responses of a GET view
+
+        Place it below `requires_auth` so permissions are still checked on
+        every request. Public responses may be stored by a CDN for
+        `max_age` seconds; responses of authenticated endpoints are marked
+        private and must be revalidated, which is answered with a 304 as
+        long as the data has not changed.
+
+        Args:
+            public (bool): Whether shared caches may store the response
+        """
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if self.max_size <= 0:
+                    return f(*args, **kwargs)
+
+                key = self._request_key()
+                entry = self.get(key)
+                if entry is None:
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200 or response.direct_passthrough:
+                        return response
+                    etag = self.set(key, response.mimetype, response.get_data())
+                else:
+                    etag, mimetype, body = entry
+                    response = current_app.response_class(body, mimetype=mimetype)
+
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = self.cache_control(public)
+                if not public:
+                    response.vary.add('Authorization')
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+    def _request_key(self):
+        return self.make_key(self.data_version(), request.path, request.args.items(multi=True))
+
+    def _store(self, key, etag, mimetype, body):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, etag, mimetype, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+response_cache = ResponseCache(backend=get_backend(RESPONSE_CACHE_URL, prefix='trivia:response:'))
+
+
+@question_changed.connect
+@category_changed.connect
+def _invalidate_response_cache(sender, action):
+    response_cache.invalidate()
@@ -0,0 +1,218 @@
+import logging
+import os
+
+from sqlalchemy import func, literal_column, or_, text
+
+from models import DB_CREATE_ALL, db, Question
+from .search_index import MemorySearch, search_terms
+
+logger = logging.getLogger(__name__)
+
+# 'auto' picks full-text search for the database dialect, 'memory' uses an
+# in-process inverted index and 'substring' keeps ILIKE matching
+SEARCH_MODE = os.environ.get('SEARCH_MODE', 'auto')
+
+# Rendered inline so the planner matches the GIN expression indexes
+TS_CONFIG = literal_column("'simple'::regconfig")
+
+
+def fetch_in_order(question_ids):
+    """Loads questions by id, keeping the order of `question_ids`"""
+    if not question_ids:
+        return []
+    questions = {question.id: question
+                 for question in Question.query.filter(Question.id.in_(question_ids))}
+    return [questions[question_id] for question_id in question_ids if question_id in questions]
+
+
+class SubstringSearch:
+    """
+    Case-insensitive substring search (ILIKE '%term%')
+
+    Matches exactly what the endpoint always did, at the cost of a scan
+    (unless a pg_trgm index is available on PostgreSQL).
+    """
+    name = 'substring'
+
+    def setup(self, engine):
+        pass
+
+    def search(self, search_term, include_answers, page, per_page):
+        """
+        Returns one page of matching questions and the number of matches
+
+        Returns:
+            (questions, total): A list of formatted questions and the total count
+        """
+        condition = Question.question.icontains(search_term, autoescape=True)
+        if include_answers:
+            condition = or_(condition, Question.answer.icontains(search_term, autoescape=True))
+
+        pagination = Question.query.filter(condition).order_by(Question.id).paginate(
+            page=page, per_page=per_page, error_out=False)
+        return [question.format() for question in pagination.items], pagination.total
+
+
+class PostgresFullTextSearch:
+    """
+    PostgreSQL full-text search over tsvector GIN expression indexes
+
+    Words are matched by prefix with the 'simple' configuration (no
+    stop words, no stemming) and results are ranked with ts_rank. If the
+    pg_trgm extension is available, a trigram index is also created so the
+    substring fallback can use an index.
+    """
+    name = 'postgresql'
+
+    def setup(self, engine):
+        with engine.begin() as connection:
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_questions_question_tsv ON questions "
+                "USING GIN (to_tsvector('simple', question))"))
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_questions_answer_tsv ON questions "
+                "USING GIN (to_tsvector('simple', answer))"))
+
+        try:
+            with engine.begin() as connection:
+                connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                connection.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_questions_question_trgm ON questions "
+                    "USING GIN (question gin_trgm_ops)"))
+        except Exception as e:
+            logger.info("pg_trgm index not available, substring search will scan: %s", e)
+
+    def search(self, search_term, include_answers, page, per_page):
+        terms = search_terms(search_term)
+        query = func.to_tsquery(TS_CONFIG, ' & '.join(f'{term}:*' for term in terms))
+        question_vector = func.to_tsvector(TS_CONFIG, Question.question)
+        answer_vector = func.to_tsvector(TS_CONFIG, Question.answer)
+
+        condition = question_vector.op('@@')(query)
+        rank = func.ts_rank(question_vector, query)
+        if include_answers:
+            condition = or_(condition, answer_vector.op('@@')(query))
+            rank = rank + func.ts_rank(answer_vector, query)
+
+        matches = Question.query.filter(condition)
+        total = matches.order_by(None).count()
+        questions = (matches.order_by(rank.desc(), Question.id)
+                     .limit(per_page).offset((page - 1) * per_page).all())
+        return [question.format() for question in questions], total
+
+
+class SQLiteFullTextSearch:
+    """
+    SQLite full-text search over an external-content FTS5 table
+
+    `questions_fts` indexes question and answer text and is kept in sync
+    with the questions table by triggers. Words are matched by prefix and
+    results are ranked with bm25.
+    """
+    name = 'sqlite'
+
+    TRIGGERS = (
+        "CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN "
+        "INSERT INTO questions_fts(rowid, question, answer) "
+        "VALUES (new.id, new.question, new.answer); END",
+        "CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN "
+        "INSERT INTO questions_fts(questions_fts, rowid, question, answer) "
+        "VALUES ('delete', old.id, old.question, old.answer); END",
+        "CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE ON questions BEGIN "
+        "INSERT INTO questions_fts(questions_fts, rowid, question, answer) "
+        "VALUES ('delete', old.id, old.question, old.answer); "
+        "INSERT INTO questions_fts(rowid, question, answer) "
+        "VALUES (new.id, new.question, new.answer); END",
+    )
+
+    def setup(self, engine):
+        with engine.begin() as connection:
+            exists = connection.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'questions_fts'")).first()
+            if not exists:
+                connection.execute(text(
+                    "CREATE VIRTUAL TABLE questions_fts USING fts5("
+                    "question, answer, content='questions', content_rowid='id')"))
+                connection.execute(text("INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')"))
+            for trigger in self.TRIGGERS:
+                connection.execute(text(trigger))
+
+    def search(self, search_term, include_answers, page, per_page):
+        columns = '{question answer}' if include_answers else 'question'
+        terms = ' AND '.join(f'"{term}"*' for term in search_terms(search_term))
+        match = f'{columns} : ({terms})'
+
+        total = db.session.execute(
+            text("SELECT count(*) FROM questions_fts WHERE questions_fts MATCH :match"),
+            {'match': match}).scalar()
+        rows = db.session.execute(
+            text("SELECT rowid FROM questions_fts WHERE questions_fts MATCH :match "
+                 "ORDER BY bm25(questions_fts), rowid LIMIT :limit OFFSET :offset"),
+            {'match': match, 'limit': per_page, 'offset': (page - 1) * per_page})
+        questions = fetch_in_order([row[0] for row in rows])
+        return [question.format() for question in questions], total
+
+
+FULL_TEXT_ENGINES = {
+    'postgresql': PostgresFullTextSearch,
+    'sqlite': SQLiteFullTextSearch,
+}
+
+
+class QuestionSearch:
+    """
+    Picks and runs the search engine for the configured database
+
+    In 'auto' mode the full-text engine of the database dialect is used
+    and set up at startup; if it cannot be set up, or the dialect has
+    none, searches fall back to substring matching. When the schema is
+    managed by migrations (DB_CREATE_ALL=false) the full-text indexes come
+    from `flask db upgrade` and startup runs no DDL. In 'memory' mode an
+    in-process inverted index answers searches without the database.
+    """
+    def __init__(self, mode=SEARCH_MODE):
+        self.mode = mode
+        self.substring = SubstringSearch()
+        self.engine = self.substring
+
+    def init_app(self, app, create_schema=DB_CREATE_ALL):
+        app.extensions['question_search'] = self
+        if self.mode == 'substring':
+            return
+        if self.mode == 'memory':
+            self.engine = MemorySearch(app)
+            return
+
+        with app.app_context():
+            dialect = db.engine.dialect.name
+            engine_class = FULL_TEXT_ENGINES.get(dialect)
+            if engine_class is None:
+                logger.info("No full-text search for %s, using substring search", dialect)
+                return
+            try:
+                engine = engine_class()
+                if create_schema:
+                    engine.setup(db.engine)
+                self.engine = engine
+            except Exception as e:
+                logger.warning("Full-text search unavailable, using substring search: %s", e)
+
+    def search(self, search_term, include_answers=False, page=1, per_page=10, mode=None):
+        """
+        Searches questions
+
+        Args:
+            search_term (str): Text to look for
+            include_answers (bool): Also match answer text
+            page (int): 1-based page number
+            per_page (int): Page size
+            mode (str): 'substring' to force substring matching
+
+        Returns:
+            (questions, total): A list of formatted questions and the total count
+        """
+        engine = self.engine
+        # Terms without any word characters can only be matched as substrings
+        if mode == 'substring' or not search_terms(search_term):
+            engine = self.substring
+        return engine.search(search_term, include_answers, page, per_page)
@@ -0,0 +1,278 @@
+import logging
+import os
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+
+from models import db, Question, question_changed
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_TTL = int(os.environ.get('SEARCH_INDEX_TTL', '300'))
+
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def search_terms(search_term):
+    """Splits a search term into lowercase words"""
+    return WORD_PATTERN.findall(search_term.lower())
+
+
+def intersect(postings):
+    """Intersects sorted id arrays, probing the larger ones by binary search"""
+    postings = sorted(postings, key=len)
+    result = postings[0]
+    for other in postings[1:]:
+        matched = array('l')
+        for question_id in result:
+            index = bisect_left(other, question_id)
+            if index < len(other) and other[index] == question_id:
+                matched.append(question_id)
+        result = matched
+        if not result:
+            break
+    return result
+
+
+def union(postings):
+    """Merges sorted id arrays into one sorted array without duplicates"""
+    if len(postings) == 1:
+        return postings[0]
+    merged = set()
+    for ids in postings:
+        merged.update(ids)
+    return array('l', sorted(merged))
+
+
+class InvertedIndex:
+    """
+    In-memory inverted index over question and answer text
+
+    Each field maps a term to a sorted `array('l')` of question ids, and a
+    sorted vocabulary list answers prefix lookups with binary search. Every
+    query word is matched by prefix and all words must match (AND). The
+    question rows are kept alongside the postings so searches never touch
+    the database.
+    """
+    def __init__(self):
+        self.documents = {}
+        self._postings = {'question': {}, 'answer': {}}
+        self._vocabulary = {'question': [], 'answer': []}
+        self._lock = threading.RLock()
+
+    def add(self, question_id, question, answer, category, difficulty):
+        """Indexes one question (replacing any previous version)"""
+        with self._lock:
+            if question_id in self.documents:
+                self.remove(question_id)
+            self.documents[question_id] = (question, answer, category, difficulty)
+            for field, value in (('question', question), ('answer', answer)):
+                postings = self._postings[field]
+                for term in set(search_terms(value)):
+                    ids = postings.get(term)
+                    if ids is None:
+                        postings[term] = array('l', [question_id])
+                        insort(self._vocabulary[field], term)
+                    elif ids[-1] < question_id:
+                        ids.append(question_id)
+                    else:
+                        insort(ids, question_id)
+
+    def load(self, rows):
+        """
+        Bulk-indexes (id, question, answer, category, difficulty) rows
+
+        Rows must be in ascending id order, so postings are built by
+        appending and the vocabulary is sorted once at the end.
+        """
+        with self._lock:
+            for question_id, question, answer, category, difficulty in rows:
+                self.documents[question_id] = (question, answer, category, difficulty)
+                for field, value in (('question', question), ('answer', answer)):
+                    postings = self._postings[field]
+                    for term in set(search_terms(value)):
+                        ids = postings.get(term)
+                        if ids is None:
+                            postings[term] = array('l', [question_id])
+                        else:
+                            ids.append(question_id)
+            for field, postings in self._postings.items():
+                self._vocabulary[field] = sorted(postings)
+
+    def remove(self, question_id):
+        """Removes one question from the index"""
+        with self._lock:
+            document = self.documents.pop(question_id, None)
+            if document is None:
+                return
+            for field, value in (('question', document[0]), ('answer', document[1])):
+                postings = self._postings[field]
+                for term in set(search_terms(value)):
+                    ids = postings.get(term)
+                    if ids is None:
+                        continue
+                    index = bisect_left(ids, question_id)
+                    if index < len(ids) and ids[index] == question_id:
+                        del ids[index]
+                    if not ids:
+                        del postings[term]
+                        vocabulary = self._vocabulary[field]
+                        del vocabulary[bisect_left(vocabulary, term)]
+
+    def search(self, terms, include_answers=False):
+        """
+        Returns the sorted ids of questions matching every term by prefix
+
+        Args:
+            terms (list): Lowercase query words
+            include_answers (bool): Also match answer text
+
+        Returns:
+            ids (array): Matching question ids in ascending order
+        """
+        fields = ('question', 'answer') if include_answers else ('question',)
+        with self._lock:
+            matches = []
+            for term in terms:
+                postings = []
+                for field in fields:
+                    postings.extend(self._prefix_postings(field, term))
+                if not postings:
+                    return array('l')
+                matches.append(union(postings))
+            return intersect(matches) if matches else array('l')
+
+    def _prefix_postings(self, field, prefix):
+        vocabulary = self._vocabulary[field]
+        postings = self._postings[field]
+        index = bisect_left(vocabulary, prefix)
+        while index < len(vocabulary) and vocabulary[index].startswith(prefix):
+            yield postings[vocabulary[index]]
+            index += 1
+
+
+class MemorySearch:
+    """
+    Search engine answering /questions/search from an in-process index
+
+    The index is built on the first search, kept up to date from
+    `question_changed` and rebuilt in the background every `ttl` seconds
+    to pick up writes made by other workers. Changes made while a build
+    scans the table are replayed onto the new index before it is installed.
+    """
+    name = 'memory'
+
+    def __init__(self, app, ttl=SEARCH_INDEX_TTL):
+        self.app = app
+        self.ttl = ttl
+        self.index = None
+        self._built_at = 0.0
+        self._building = False
+        self._generation = 0
+        self._changes = []
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        question_changed.connect(self._on_question_changed)
+
+    def setup(self, engine):
+        pass
+
+    def build(self):
+        """Builds and returns a fresh index from the database (requires an app context)"""
+        changes = []
+        with self._lock:
+            generation = self._generation
+            self._changes.append(changes)
+        try:
+            index = InvertedIndex()
+            rows = db.session.query(
+                Question.id, Question.question, Question.answer, Question.category, Question.difficulty)
+            index.load(rows.order_by(Question.id).yield_per(10000))
+        except Exception:
+            with self._lock:
+                self._changes.remove(changes)
+            raise
+
+        with self._lock:
+            # Stop recording and install in one step, so no change falls in between
+            self._changes.remove(changes)
+            # Only install the index if no bulk write invalidated it meanwhile
+            if generation == self._generation:
+                # Single writes made during the scan may be missing from the snapshot
+                for question_id, document in changes:
+                    if document is None:
+                        index.remove(question_id)
+                    else:
+                        index.add(question_id, *document)
+                self.index = index
+                self._built_at = time.monotonic()
+        logger.info("Search index built with %s questions", len(index.documents))
+        return index
+
+    def search(self, search_term, include_answers, page, per_page):
+        index = self.index
+        if index is None:
+            # The first searches wait for a single build instead of each scanning the table
+            with self._build_lock:
+                index = self.index
+                if index is None:
+                    index = self.build()
+        elif time.monotonic() - self._built_at >= self.ttl:
+            self._rebuild_in_background()
+
+        ids = index.search(search_terms(search_term), include_answers)
+        start = (page - 1) * per_page
+        questions = []
+        for question_id in ids[start:start + per_page]:
+            document = index.documents.get(question_id)
+            if document is not None:
+                question, answer, category, difficulty = document
+                questions.append({
+                    'id': question_id,
+                    'question': question,
+                    'answer': answer,
+                    'category': category,
+                    'difficulty': difficulty
+                })
+        return questions, len(ids)
+
+    def _rebuild_in_background(self):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+
+        def rebuild():
+            try:
+                with self.app.app_context():
+                    self.build()
+            except Exception as e:
+                logger.error("Error rebuilding search index: %s", e)
+            finally:
+                with self._lock:
+                    self._building = False
+
+        threading.Thread(target=rebuild, daemon=True).start()
+
+    def _on_question_changed(self, sender, action):
+        if not isinstance(sender, Question):
+            with self._lock:
+                self.index = None
+                self._generation += 1
+            return
+
+        document = None
+        if action != 'delete':
+            document = (sender.question, sender.answer, sender.category, sender.difficulty)
+        with self._lock:
+            for changes in self._changes:
+                changes.append((sender.id, document))
+            index = self.index
+        if index is None:
+            return
+        if document is None:
+            index.remove(sender.id)
+        else:
+            index.add(sender.id, *document)
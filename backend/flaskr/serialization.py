@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+
+from flask import current_app
+
+from instrumentation import phase
+from models import Question
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Encoded questions kept per worker (0 disables the cache)
+QUESTION_JSON_CACHE_SIZE = int(os.environ.get('QUESTION_JSON_CACHE_SIZE', '10000'))
+
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+# Selected as plain tuples, in QUESTION_FIELDS order, instead of loading Question objects
+QUESTION_COLUMNS = (Question.id, Question.question, Question.answer, Question.category,
+                    Question.difficulty)
+
+
+class Encoded(bytes):
+    """JSON that is already encoded, embedded as is by json_response"""
+
+
+def encode_question(row):
+    """Encodes a QUESTION_COLUMNS row as the JSON object of Question.format()"""
+    question = dict(zip(QUESTION_FIELDS, row))
+    if orjson is not None:
+        return orjson.dumps(question, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(question, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+class QuestionJSONCache:
+    """
+    Per-worker cache of encoded questions
+
+    Entries are keyed by question id and store the row they were encoded
+    from. A cached encoding is only reused when the freshly selected row
+    is equal to it, so an edit made by any worker is picked up on the next
+    read without invalidation. The oldest entries are dropped beyond
+    `max_size`.
+    """
+    def __init__(self, max_size=QUESTION_JSON_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def encode_rows(self, rows):
+        """
+        Encodes QUESTION_COLUMNS rows as a JSON array
+
+        Returns:
+            questions (Encoded): The array, ready for json_response
+        """
+        with phase('serialization'):
+            if self.max_size <= 0:
+                return Encoded(b'[' + b','.join([encode_question(row) for row in rows]) + b']')
+
+            entries = self._entries
+            parts = []
+            for row in rows:
+                entry = entries.get(row[0])
+                if entry is not None and entry[0] == row:
+                    parts.append(entry[1])
+                    continue
+                encoded = encode_question(row)
+                parts.append(encoded)
+                self._store(tuple(row), encoded)
+            return Encoded(b'[' + b','.join(parts) + b']')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, row, encoded):
+        with self._lock:
+            self._entries.pop(row[0], None)
+            self._entries[row[0]] = (row, encoded)
+            while len(self._entries) > self.max_size:
+                del self._entries[next(iter(self._entries))]
+
+
+question_json_cache = QuestionJSONCache()
+
+
+def encode_json(data, dumps):
+    """
+    Encodes a response body like jsonify, embedding Encoded values without re-encoding them
+
+    Keys are sorted and other values are encoded by `dumps` (the app's JSON
+    provider), so the body matches jsonify apart from the encoded parts.
+    """
+    with phase('serialization'):
+        members = []
+        for key in sorted(data):
+            value = data[key]
+            if not isinstance(value, Encoded):
+                value = dumps(value, separators=(',', ':')).encode('utf-8')
+            members.append(json.dumps(key).encode('utf-8') + b':' + value)
+        return b'{' + b','.join(members) + b'}\n'
+
+
+def json_response(data, status=200):
+    """Builds a JSON response like jsonify, embedding Encoded values without re-encoding them"""
+    body = encode_json(data, current_app.json.dumps)
+    return current_app.response_class(body, status=status, mimetype='application/json')
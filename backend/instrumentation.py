@@ -0,0 +1,476 @@
+"""
+Request Instrumentation
+Per-route timings split into phases, SQL statement counts, Prometheus metrics and a sampling profiler
+"""
+
+import bisect
+import hmac
+import itertools
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+
+from db_pool import get_pools_status
+from structured_logging import get_logging_stats
+
+logger = logging.getLogger(__name__)
+
+# Set to false to skip all request instrumentation (GET /metrics then returns 404)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# GET /metrics needs "Authorization: Bearer <METRICS_TOKEN>" or a Trivia Manager token,
+# unless METRICS_PUBLIC is set
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', 'false').lower() in ('1', 'true', 'yes')
+# Requests running more SQL statements than this are logged (likely N+1 queries)
+METRICS_QUERY_WARNING = int(os.environ.get('METRICS_QUERY_WARNING', '20'))
+# Fraction of requests sampled by the profiler (0 disables it)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+# Sampled requests slower than this are written out as folded stacks
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', '500'))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'trivia-profiles'))
+# Profiles kept in PROFILE_DIR, oldest removed first
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '100'))
+
+PHASES = ('auth', 'rate_limit', 'db', 'serialization')
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Time spent per phase and SQL statements run by one request"""
+    __slots__ = ('started', 'phases', 'queries', 'samples')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.samples = None
+
+
+@contextmanager
+def phase(name):
+    """
+    Adds the time spent in the block to a phase of the current request
+
+    Phases are measured independently and should not be nested; time not
+    spent in any phase is reported as the 'app' phase. Outside an
+    instrumented request the block simply runs.
+    """
+    request_metrics = _current.get()
+    if request_metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        request_metrics.phases[name] += time.perf_counter() - started
+
+
+class Counter:
+    """Prometheus counter with labels"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+
+class Histogram:
+    """Prometheus histogram with labels and fixed buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels + ('le',)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', labels + (_format_value(bound),), cumulative))
+            samples.append((f'{self.name}_sum', labels, total))
+            samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Request metrics of this process, rendered in the Prometheus text format
+
+    Metrics are kept per worker process; every sample carries a `pid`
+    label so the series of different gunicorn workers do not collide.
+    Collectors add gauges computed at scrape time (e.g. pool statistics).
+    """
+    def __init__(self, collectors=()):
+        self.requests = Counter('trivia_requests_total', 'Requests handled',
+                                ('route', 'method', 'status'))
+        self.duration = Histogram('trivia_request_duration_seconds', 'Request handling time',
+                                  ('route', 'method'))
+        self.phases = Histogram('trivia_request_phase_seconds', 'Request handling time per phase',
+                                ('route', 'phase'))
+        self.queries = Histogram('trivia_request_queries', 'SQL statements per request',
+                                 ('route',), buckets=QUERY_COUNT_BUCKETS)
+        self.profiles = Counter('trivia_profiles_written_total', 'Slow request profiles written',
+                                ('route',))
+        self.metrics = [self.requests, self.duration, self.phases, self.queries, self.profiles]
+        self.collectors = list(collectors)
+
+    def record(self, route, method, status, request_metrics, duration):
+        """Records a finished request; phase time not accounted for is recorded as 'app'"""
+        self.requests.inc((route, method, str(status)))
+        self.duration.observe((route, method), duration)
+        accounted = 0.0
+        for name, seconds in request_metrics.phases.items():
+            self.phases.observe((route, name), seconds)
+            accounted += seconds
+        self.phases.observe((route, 'app'), max(duration - accounted, 0.0))
+        self.queries.observe((route,), request_metrics.queries)
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format"""
+        pid = str(os.getpid())
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(_format_sample(name, ('pid',) + metric.labels, (pid,) + labels, value))
+
+        for collect in self.collectors:
+            try:
+                gauges = collect()
+            except Exception as e:
+                logger.error("Metrics collector failed: %s", e)
+                continue
+            for name, documentation, label_names, values in gauges:
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} gauge')
+                for labels, value in values:
+                    lines.append(_format_sample(name, ('pid',) + label_names, (pid,) + labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_sample(name, label_names, labels, value):
+    pairs = ','.join(f'{label}="{_escape(str(label_value))}"'
+                     for label, label_value in zip(label_names, labels))
+    return f'{name}{{{pairs}}} {_format_value(value)}'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler of selected request threads
+
+    A single background thread wakes every `interval` seconds and records
+    the Python stack of each thread that is profiling a request; it sleeps
+    on an event while no request is being profiled. Stacks
+    are counted in the folded format (`outer;inner count` per line) read
+    by flamegraph.pl, speedscope and inferno, and written to `directory`
+    only for requests slower than `slow_seconds`. Requests that are not
+    sampled cost one random() call.
+    """
+    def __init__(self, sample_rate=PROFILE_SAMPLE_RATE, interval=PROFILE_INTERVAL_MS / 1000,
+                 slow_seconds=PROFILE_SLOW_MS / 1000, directory=PROFILE_DIR, max_files=PROFILE_MAX_FILES):
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.slow_seconds = slow_seconds
+        self.directory = directory
+        self.max_files = max_files
+        self._targets = {}
+        self._thread = None
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def should_sample(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self):
+        """Starts sampling the calling thread, returns the dict its stack counts go to"""
+        samples = {}
+        with self._lock:
+            self._targets[threading.get_ident()] = samples
+            self._wake.set()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='trivia-profiler', daemon=True)
+                self._thread.start()
+        return samples
+
+    def stop(self):
+        """Stops sampling the calling thread"""
+        with self._lock:
+            self._targets.pop(threading.get_ident(), None)
+
+    def dump(self, samples, label):
+        """
+        Writes folded stacks to the profile directory
+
+        Returns:
+            path (str): The written file, or None when nothing was sampled
+        """
+        if not samples:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        safe_label = ''.join(c if c.isalnum() or c in '-_' else '_' for c in label).strip('_')
+        path = os.path.join(self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-'
+                                            f'{next(self._sequence)}-{safe_label}.folded')
+        with open(path, 'w') as f:
+            for stack, count in sorted(samples.items()):
+                f.write(f'{stack} {count}\n')
+        self._prune()
+        return path
+
+    def _prune(self):
+        try:
+            paths = sorted((os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                            if name.endswith('.folded')), key=os.path.getmtime)
+            for path in paths[:max(len(paths) - self.max_files, 0)]:
+                os.remove(path)
+        except OSError as e:
+            logger.warning("Unable to prune profiles: %s", e)
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while True:
+            with self._lock:
+                if not self._targets:
+                    self._wake.clear()
+            # Cleared only under the lock, so a start() in between cannot be missed
+            self._wake.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                targets = list(self._targets.items())
+            if not targets:
+                continue
+            frames = sys._current_frames()
+            for ident, samples in targets:
+                frame = frames.get(ident)
+                if frame is None or ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:'
+                                 f'{code.co_firstlineno})'.replace(';', ':'))
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                samples[key] = samples.get(key, 0) + 1
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON provider counting jsonify as the serialization phase"""
+    def response(self, *args, **kwargs):
+        with phase('serialization'):
+            return super().response(*args, **kwargs)
+
+
+def pool_gauges():
+    """Numeric connection pool statistics of this process, by pool"""
+    gauges = {}
+    for name, status in get_pools_status().items():
+        for key, value in status.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                gauges.setdefault(key, []).append(((name,), value))
+    return [(f'trivia_db_pool_{key}', f'Connection pool {key.replace("_", " ")}', ('pool',), values)
+            for key, values in gauges.items()]
+
+
+def token_cache_gauges():
+    """Verified token cache counters of this process"""
+    # Imported here because auth times its checks with this module
+    from auth import token_cache
+    return [(f'trivia_token_cache_{key}', f'Verified token cache {key.replace("_", " ")}', (),
+             [((), value)]) for key, value in token_cache.stats().items()]
+
+
+def logging_gauges():
+    """Records waiting for and dropped by the background log writer"""
+    return [(f'trivia_log_records_{key}', f'Log records {key}', (), [((), value)])
+            for key, value in get_logging_stats().items()]
+
+
+# Seconds each startup step of this process took, by step
+boot_times = {}
+
+
+def record_boot_time(step, seconds):
+    """Records how long a startup step took (reported as trivia_boot_seconds)"""
+    boot_times[step] = seconds
+
+
+@contextmanager
+def boot_step(step):
+    """Times a startup step with record_boot_time"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_boot_time(step, time.perf_counter() - started)
+
+
+def boot_gauges():
+    """Time this process spent starting the app, by step"""
+    return [('trivia_boot_seconds', 'Seconds spent starting the app', ('step',),
+             [((step,), seconds) for step, seconds in boot_times.items()])]
+
+
+def authorize_metrics(auth, token=METRICS_TOKEN):
+    """Returns True if an Authorization header carries the metrics token"""
+    if not token:
+        return False
+    return auth is not None and hmac.compare_digest(auth.encode('utf-8'), f'Bearer {token}'.encode('utf-8'))
+
+
+def instrument_queries(engine):
+    """Counts the statements of an engine, and their time, against the current request"""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info['query_started'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        request_metrics = _current.get()
+        started = conn.info.pop('query_started', None)
+        if request_metrics is not None and started is not None:
+            request_metrics.queries += 1
+            request_metrics.phases['db'] += time.perf_counter() - started
+
+
+def start_request_metrics():
+    """Starts measuring the request handled in the current context"""
+    request_metrics = RequestMetrics()
+    _current.set(request_metrics)
+    return request_metrics
+
+
+def record_request_metrics(registry, route, method, status):
+    """
+    Records the request measured in the current context
+
+    Returns:
+        (request_metrics, duration): (None, None) if no request is measured
+    """
+    request_metrics = _current.get()
+    if request_metrics is None:
+        return None, None
+    duration = time.perf_counter() - request_metrics.started
+    registry.record(route, method, status, request_metrics, duration)
+    if request_metrics.queries > METRICS_QUERY_WARNING:
+        logger.warning("%s %s ran %s SQL statements", method, route, request_metrics.queries)
+    return request_metrics, duration
+
+
+def stop_request_metrics():
+    """Stops measuring the request handled in the current context"""
+    _current.set(None)
+
+
+def init_instrumentation(app, db, registry=None, request_profiler=None):
+    """
+    Instruments the requests of an app (requires an app context)
+
+    Call before other extensions register their before_request hooks, so
+    the measured time covers them.
+
+    Args:
+        app: The Flask application
+        db: Its SQLAlchemy extension
+        registry (MetricsRegistry): Where metrics are recorded (default: `metrics`)
+        request_profiler (SamplingProfiler): Profiler of sampled requests (default: `profiler`)
+    """
+    registry = registry or metrics
+    request_profiler = request_profiler or profiler
+    app.json = TimedJSONProvider(app)
+    app.extensions['instrumentation'] = registry
+    for engine in db.engines.values():
+        instrument_queries(engine)
+
+    @app.before_request
+    def _start_request_metrics():
+        request_metrics = start_request_metrics()
+        if request_profiler.should_sample():
+            request_metrics.samples = request_profiler.start()
+
+    @app.after_request
+    def _record_request_metrics(response):
+        route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        request_metrics, duration = record_request_metrics(registry, route, request.method,
+                                                           response.status_code)
+        if request_metrics is None:
+            return response
+        if request_metrics.samples is not None:
+            request_profiler.stop()
+            if duration >= request_profiler.slow_seconds:
+                path = request_profiler.dump(request_metrics.samples,
+                                             f'{request.method}-{route}-{int(duration * 1000)}ms')
+                if path is not None:
+                    registry.profiles.inc((route,))
+                    logger.info("Slow request %s %s (%.0fms) profiled to %s",
+                                request.method, request.path, duration * 1000, path)
+        return response
+
+    @app.teardown_request
+    def _reset_request_metrics(exc):
+        request_metrics = _current.get()
+        if request_metrics is not None and request_metrics.samples is not None:
+            request_profiler.stop()
+        stop_request_metrics()
+
+    logger.info("Request instrumentation enabled (profiling %.0f%% of requests)", PROFILE_SAMPLE_RATE * 100)
+
+
+metrics = MetricsRegistry(collectors=(pool_gauges, token_cache_gauges, logging_gauges, boot_gauges))
+profiler = SamplingProfiler()
@@ -0,0 +1,67 @@
+"""integer category foreign key and indexes
+
+Revision ID: 5805e3fce6b9
+Revises: f153a284ead8
+Create Date: 2026-10-17 06:37:49.637418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5805e3fce6b9'
+down_revision = 'f153a284ead8'
+branch_labels = None
+depends_on = None
+
+
+FOREIGN_KEY = 'fk_questions_category_categories'
+INDEXES = {
+    'ix_questions_category_id': ['category', 'id'],
+    'ix_questions_category_difficulty': ['category', 'difficulty'],
+}
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    columns = {column['name']: column for column in inspector.get_columns('questions')}
+    foreign_keys = inspector.get_foreign_keys('questions')
+    indexes = {index['name'] for index in inspector.get_indexes('questions')}
+
+    # trivia.psql already declares an integer column with a foreign key
+    is_integer = isinstance(columns['category']['type'], sa.Integer)
+    has_foreign_key = any(
+        foreign_key['referred_table'] == 'categories' and
+        foreign_key['constrained_columns'] == ['category']
+        for foreign_key in foreign_keys)
+
+    with op.batch_alter_table('questions') as batch_op:
+        if not is_integer:
+            batch_op.alter_column(
+                'category',
+                existing_type=sa.String(),
+                type_=sa.Integer(),
+                existing_nullable=False,
+                postgresql_using='category::integer')
+        if not has_foreign_key:
+            batch_op.create_foreign_key(FOREIGN_KEY, 'categories', ['category'], ['id'])
+
+    for name, index_columns in INDEXES.items():
+        if name not in indexes:
+            op.create_index(name, 'questions', index_columns)
+
+
+def downgrade():
+    for name in INDEXES:
+        op.drop_index(name, table_name='questions')
+
+    foreign_keys = sa.inspect(op.get_bind()).get_foreign_keys('questions')
+    with op.batch_alter_table('questions') as batch_op:
+        if any(foreign_key['name'] == FOREIGN_KEY for foreign_key in foreign_keys):
+            batch_op.drop_constraint(FOREIGN_KEY, type_='foreignkey')
+        batch_op.alter_column(
+            'category',
+            existing_type=sa.Integer(),
+            type_=sa.String(),
+            existing_nullable=False)
@@ -0,0 +1,79 @@
+"""full text search indexes
+
+Revision ID: 9b4e2d7c1a36
+Revises: 5805e3fce6b9
+Create Date: 2026-10-17 09:12:31.204118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b4e2d7c1a36'
+down_revision = '5805e3fce6b9'
+branch_labels = None
+depends_on = None
+
+
+# Same objects as flaskr/search.py creates at startup when DB_CREATE_ALL is true
+# (all statements are IF NOT EXISTS, so databases it already set up are unchanged)
+POSTGRES_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS ix_questions_question_tsv ON questions "
+    "USING GIN (to_tsvector('simple', question))",
+    "CREATE INDEX IF NOT EXISTS ix_questions_answer_tsv ON questions "
+    "USING GIN (to_tsvector('simple', answer))",
+)
+POSTGRES_TRIGRAM_INDEX = (
+    "CREATE INDEX IF NOT EXISTS ix_questions_question_trgm ON questions "
+    "USING GIN (question gin_trgm_ops)"
+)
+SQLITE_TRIGGERS = (
+    "CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN "
+    "INSERT INTO questions_fts(rowid, question, answer) "
+    "VALUES (new.id, new.question, new.answer); END",
+    "CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN "
+    "INSERT INTO questions_fts(questions_fts, rowid, question, answer) "
+    "VALUES ('delete', old.id, old.question, old.answer); END",
+    "CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE ON questions BEGIN "
+    "INSERT INTO questions_fts(questions_fts, rowid, question, answer) "
+    "VALUES ('delete', old.id, old.question, old.answer); "
+    "INSERT INTO questions_fts(rowid, question, answer) "
+    "VALUES (new.id, new.question, new.answer); END",
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        for statement in POSTGRES_INDEXES:
+            op.execute(statement)
+        # pg_trgm may not be installable (e.g. missing privileges); substring
+        # search then scans, as it does when the app sets up the indexes
+        try:
+            with bind.begin_nested():
+                bind.execute(sa.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                bind.execute(sa.text(POSTGRES_TRIGRAM_INDEX))
+        except sa.exc.DBAPIError:
+            pass
+
+    elif bind.dialect.name == 'sqlite':
+        if 'questions_fts' not in sa.inspect(bind).get_table_names():
+            op.execute("CREATE VIRTUAL TABLE questions_fts USING fts5("
+                       "question, answer, content='questions', content_rowid='id')")
+            op.execute("INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')")
+        for statement in SQLITE_TRIGGERS:
+            op.execute(statement)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        for name in ('ix_questions_question_trgm', 'ix_questions_answer_tsv',
+                     'ix_questions_question_tsv'):
+            op.execute(f"DROP INDEX IF EXISTS {name}")
+
+    elif bind.dialect.name == 'sqlite':
+        for name in ('questions_fts_update', 'questions_fts_delete', 'questions_fts_insert'):
+            op.execute(f"DROP TRIGGER IF EXISTS {name}")
+        op.execute("DROP TABLE IF EXISTS questions_fts")
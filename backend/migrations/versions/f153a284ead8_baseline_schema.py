@@ -0,0 +1,57 @@
+"""baseline schema
+
+Revision ID: f153a284ead8
+Revises: 
+Create Date: 2026-10-17 06:37:48.816856
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f153a284ead8'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created by db.create_all() or trivia.psql already have these
+    # tables, so only create what is missing
+    existing_tables = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'categories' not in existing_tables:
+        op.create_table(
+            'categories',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('type', sa.String(length=100), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('type')
+        )
+
+    if 'questions' not in existing_tables:
+        op.create_table(
+            'questions',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('question', sa.String(length=500), nullable=False),
+            sa.Column('answer', sa.String(length=500), nullable=False),
+            sa.Column('category', sa.String(), nullable=False),
+            sa.Column('difficulty', sa.Integer(), nullable=False),
+            sa.CheckConstraint('difficulty >= 1 AND difficulty <= 5', name='check_difficulty_range'),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if 'cache_versions' not in existing_tables:
+        op.create_table(
+            'cache_versions',
+            sa.Column('name', sa.String(length=50), nullable=False),
+            sa.Column('version', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('name')
+        )
+
+
+def downgrade():
+    op.drop_table('cache_versions')
+    op.drop_table('questions')
+    op.drop_table('categories')
@@ -1,11 +1,15 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine, CheckConstraint
+import click
+from blinker import Namespace
+from sqlalchemy import Column, String, Integer, create_engine, CheckConstraint, ForeignKey, Index
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 import json
 from dotenv import load_dotenv
 from datetime import datetime
 
+from db_pool import PoolStats, get_engine_options, instrument_engine, register_pool
+from replicas import DATABASE_REPLICA_URLS, RoutingSession, init_replicas
+
 # Check for Render's DATABASE_URL first (from environment variables)
 # This takes priority over .env file
 database_path = os.environ.get('DATABASE_URL')
@@ -29,25 +33,70 @@ if not database_path:
             # Use SQLite as fallback for testing
             database_path = 'sqlite:///trivia.db'
 
-db = SQLAlchemy()
-migrate = Migrate()
+# Create missing tables when an app starts; set to false when the schema is
+# managed with `flask db upgrade`, so workers boot without inspecting it
+DB_CREATE_ALL = os.environ.get('DB_CREATE_ALL', 'true').lower() in ('1', 'true', 'yes')
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+"""
+Model signals
+    question_changed is sent after a question write has been committed, with
+    the Question as sender and action='insert', 'update' or 'delete'. Bulk
+    writes send it with the Question class as sender and action='bulk'.
+    category_changed works the same way for categories. In-process caches
+    subscribe to them to stay up to date. Every write also bumps the
+    'questions' or 'categories' counter in cache_versions so other workers
+    can detect it.
+"""
+model_signals = Namespace()
+question_changed = model_signals.signal('question-changed')
+category_changed = model_signals.signal('category-changed')
+
+"""
+init_migrations(app)
+    registers Flask-Migrate when the app is loaded by the flask command,
+    where `flask db` needs it. Web workers skip importing alembic, which
+    is a large part of their import time.
+"""
+def init_migrations(app):
+    if click.get_current_context(silent=True) is None:
+        return
+    from flask_migrate import Migrate
+    Migrate(app, db)
 
 """
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    replica_paths optionally lists read replicas of the database; views
+    marked with replicas.read_replica read from them
+    create_all creates missing tables (default: DB_CREATE_ALL)
 """
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, replica_paths=DATABASE_REPLICA_URLS,
+             create_all=DB_CREATE_ALL):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_pre_ping": True,
-        "pool_recycle": 300,
-    }
+    # Pool sizing, timeouts and pre-ping come from the DB_POOL_* environment variables
+    pool_stats = {'default': PoolStats()}
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = get_engine_options(database_path, stats=pool_stats['default'])
+    binds = {}
+    for index, replica_path in enumerate(replica_paths):
+        key = f'replica{index}'
+        pool_stats[key] = PoolStats()
+        binds[key] = {'url': replica_path, **get_engine_options(replica_path, stats=pool_stats[key])}
+    app.config["SQLALCHEMY_BINDS"] = binds
     db.app = app
     db.init_app(app)
-    migrate.init_app(app, db)
+    init_migrations(app)
     with app.app_context():
-        db.create_all()
+        for key, stats in pool_stats.items():
+            engine = db.engines[None if key == 'default' else key]
+            instrument_engine(engine, stats)
+            register_pool(key, engine, stats)
+        if binds:
+            init_replicas(app, db, list(binds))
+        if create_all:
+            db.create_all()
 
 """
 Question
@@ -59,12 +108,16 @@ class Question(db.Model):
     id = Column(Integer, primary_key=True)
     question = Column(String(500), nullable=False)
     answer = Column(String(500), nullable=False)
-    category = Column(String, nullable=False)
+    category = Column(Integer, ForeignKey('categories.id', name='fk_questions_category_categories'),
+                      nullable=False)
     difficulty = Column(Integer, nullable=False)
 
-    # Add constraint to ensure difficulty is between 1 and 5
+    # Add constraint to ensure difficulty is between 1 and 5, and indexes so
+    # category listings and quiz selection are index range scans
     __table_args__ = (
         CheckConstraint('difficulty >= 1 AND difficulty <= 5', name='check_difficulty_range'),
+        Index('ix_questions_category_id', 'category', 'id'),
+        Index('ix_questions_category_difficulty', 'category', 'difficulty'),
     )
 
     def __init__(self, question, answer, category, difficulty):
@@ -76,16 +129,22 @@ class Question(db.Model):
     def insert(self):
         """Insert a new question into the database"""
         db.session.add(self)
+        bump_version('questions')
         db.session.commit()
+        question_changed.send(self, action='insert')
 
     def update(self):
         """Update an existing question in the database"""
+        bump_version('questions')
         db.session.commit()
+        question_changed.send(self, action='update')
 
     def delete(self):
         """Delete a question from the database"""
         db.session.delete(self)
+        bump_version('questions')
         db.session.commit()
+        question_changed.send(self, action='delete')
 
     def format(self):
         """Format question data for JSON response"""
@@ -116,7 +175,9 @@ class Category(db.Model):
     def insert(self):
         """Insert a new category into the database"""
         db.session.add(self)
+        bump_version('categories')
         db.session.commit()
+        category_changed.send(self, action='insert')
 
     def format(self):
         """Format category data for JSON response"""
@@ -127,3 +188,45 @@ class Category(db.Model):
 
     def __repr__(self):
         return f'<Category {self.id}: {self.type}>'
+
+"""
+CacheVersion
+Named version counters that let workers detect changes made by other workers
+"""
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_versions'
+
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CacheVersion {self.name}: {self.version}>'
+
+
+def bump_version(name):
+    """Increment a named version counter as part of the current transaction"""
+    # An upsert is one atomic statement, so concurrent first writers cannot both insert the row
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        insert = None
+    if insert is not None:
+        statement = insert(CacheVersion).values(name=name, version=1)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[CacheVersion.name],
+            set_={'version': CacheVersion.version + 1}))
+        return
+
+    updated = CacheVersion.query.filter_by(name=name).update(
+        {CacheVersion.version: CacheVersion.version + 1}, synchronize_session=False)
+    if not updated:
+        db.session.add(CacheVersion(name=name, version=1))
+
+
+def get_version(name):
+    """Return the current value of a named version counter"""
+    version = db.session.query(CacheVersion.version).filter_by(name=name).scalar()
+    return version or 0
@@ -0,0 +1,252 @@
+"""
+Read Replica Routing
+Sends the queries of read-only handlers to replica databases and everything else to the primary
+"""
+
+import hashlib
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.sql.dml import UpdateBase
+
+from cache_backends import get_backend
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated replica URLs (empty: every query goes to DATABASE_URL)
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                         if url.strip()]
+# round_robin, or least_loaded (fewest checked-out connections, then lowest ping latency)
+REPLICA_STRATEGY = os.environ.get('REPLICA_STRATEGY', 'round_robin')
+# Seconds between health checks of the replicas
+REPLICA_HEALTH_INTERVAL = int(os.environ.get('REPLICA_HEALTH_INTERVAL', '5'))
+# Seconds a client reads from the primary after a write (read-your-writes)
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', '5'))
+# REPLICA_STICKY_URL optionally shares recent writers between workers (e.g. redis://localhost:6379/0)
+REPLICA_STICKY_URL = os.environ.get('REPLICA_STICKY_URL')
+
+REPLICA_STRATEGIES = ('round_robin', 'least_loaded')
+# Recent writers remembered per worker
+MAX_STICKY_CLIENTS = 10000
+
+
+class ReplicaSet:
+    """
+    Health and selection of the read replicas of one app
+
+    Replicas are Flask-SQLAlchemy binds. A replica is taken out of
+    rotation when a health check (a timed `SELECT 1`, run in the
+    background every `health_interval` seconds) or a query on it hits a
+    disconnect, and put back when a later check succeeds. With no healthy
+    replica, reads go to the primary.
+
+    Clients that wrote within `sticky_seconds` read from the primary, so
+    they see their own writes despite replication lag. Clients are told
+    apart by their Authorization header, or their address when anonymous.
+    Recent writers are remembered per worker, or in a shared backend so a
+    write handled by one worker is honoured by all of them.
+    """
+    def __init__(self, keys, strategy=REPLICA_STRATEGY, health_interval=REPLICA_HEALTH_INTERVAL,
+                 sticky_seconds=REPLICA_STICKY_SECONDS, backend=None):
+        if strategy not in REPLICA_STRATEGIES:
+            raise ValueError(f"REPLICA_STRATEGY must be one of {', '.join(REPLICA_STRATEGIES)}, "
+                             f"not {strategy}")
+        self.keys = list(keys)
+        self.strategy = strategy
+        self.health_interval = health_interval
+        self.sticky_seconds = sticky_seconds
+        self.backend = backend
+        self._healthy = {key: True for key in self.keys}
+        self._latency = {key: 0.0 for key in self.keys}
+        self._turn = itertools.count()
+        self._writers = OrderedDict()
+        self._checked_at = time.monotonic()
+        self._checking = False
+        self._lock = threading.Lock()
+
+    def choose(self, engines):
+        """
+        Picks the replica bind of the next read-only request
+
+        Returns:
+            key (str): A bind key, or None to read from the primary
+        """
+        self.ensure_checked(current_app._get_current_object())
+        healthy = [key for key in self.keys if self._healthy[key]]
+        if not healthy:
+            return None
+        if self.strategy == 'least_loaded':
+            return min(healthy, key=lambda key: (engines[key].pool.checkedout(), self._latency[key]))
+        return healthy[next(self._turn) % len(healthy)]
+
+    def mark_unhealthy(self, key, reason):
+        if self._healthy.get(key):
+            logger.warning("Read replica %s taken out of rotation: %s", key, reason)
+        self._healthy[key] = False
+
+    def watch(self, key, engine):
+        """Takes a replica out of rotation when a query on one of its engines hits a disconnect"""
+        def on_error(context):
+            if context.is_disconnect:
+                self.mark_unhealthy(key, str(context.original_exception))
+        event.listen(engine, 'handle_error', on_error)
+
+    def check(self, engines):
+        """Pings every replica and updates its health and latency"""
+        for key in self.keys:
+            started = time.perf_counter()
+            try:
+                with engines[key].connect() as connection:
+                    connection.execute(text('SELECT 1'))
+            except Exception as e:
+                self.mark_unhealthy(key, str(e))
+                continue
+            self._latency[key] = time.perf_counter() - started
+            if not self._healthy[key]:
+                logger.info("Read replica %s back in rotation", key)
+            self._healthy[key] = True
+
+    def ensure_checked(self, app):
+        """Starts a background health check if one is due"""
+        with self._lock:
+            due = time.monotonic() - self._checked_at >= self.health_interval
+            if not due or self._checking:
+                return
+            self._checking = True
+
+        thread = threading.Thread(target=self._check_in_background, args=(app,), daemon=True)
+        thread.start()
+
+    def status(self):
+        """Returns the health and last ping latency of each replica"""
+        return {key: {'healthy': self._healthy[key], 'latency_ms': round(self._latency[key] * 1000, 3)}
+                for key in self.keys}
+
+    def record_write(self, client):
+        """Sends a client's reads to the primary for sticky_seconds"""
+        if self.sticky_seconds <= 0:
+            return
+        until = time.time() + self.sticky_seconds
+        with self._lock:
+            self._writers[client] = until
+            self._writers.move_to_end(client)
+            while len(self._writers) > MAX_STICKY_CLIENTS:
+                self._writers.popitem(last=False)
+        if self.backend is not None:
+            self.backend.set(client, str(until).encode('ascii'), self.sticky_seconds)
+
+    def wrote_recently(self, client):
+        """Returns True if a client wrote within sticky_seconds"""
+        until = self._writers.get(client)
+        if until is not None and until > time.time():
+            return True
+        if self.backend is not None:
+            data = self.backend.get(client)
+            if data is not None and float(data) > time.time():
+                return True
+        return False
+
+    def _check_in_background(self, app):
+        try:
+            with app.app_context():
+                self.check(app.extensions['sqlalchemy'].engines)
+        except Exception as e:
+            logger.error("Read replica health check failed: %s", e)
+        finally:
+            with self._lock:
+                self._checked_at = time.monotonic()
+                self._checking = False
+
+
+class RoutingSession(Session):
+    """
+    Flask-SQLAlchemy session that reads from a replica in read-only handlers
+
+    Queries go to the primary unless the handler is marked with
+    `read_replica`. Even then, flushes and INSERT/UPDATE/DELETE statements
+    go to the primary, and every later query of the request follows them
+    there. A request uses a single replica, chosen on its first query.
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and (self._flushing or isinstance(clause, UpdateBase)):
+            self.info['read_replica'] = False
+            replicas = current_app.extensions.get('replicas')
+            if replicas is not None and has_request_context():
+                replicas.record_write(get_client_key())
+        elif bind is None and self.info.get('read_replica'):
+            key = self.info.get('replica_key')
+            if key is None:
+                key = current_app.extensions['replicas'].choose(self._db.engines)
+                if key is None:
+                    self.info['read_replica'] = False
+                else:
+                    self.info['replica_key'] = key
+            if key is not None:
+                return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def get_client_key():
+    """Identifies the client of the current request for read-your-writes"""
+    return client_key(request.headers.get('Authorization'), request.remote_addr)
+
+
+def client_key(auth, remote_addr):
+    """Identifies a client by its Authorization header, or its address when anonymous"""
+    if auth:
+        return 'auth:' + hashlib.sha256(auth.encode('utf-8')).hexdigest()[:32]
+    return f'addr:{remote_addr}'
+
+
+def reading_from_replica(session):
+    """Returns True if a session's queries currently go to a replica"""
+    return bool(session.info.get('read_replica') and session.info.get('replica_key'))
+
+
+def read_replica(f):
+    """
+    Decorator sending the queries of a read-only view to a replica
+
+    Does nothing without replicas, or when the client wrote within the
+    last REPLICA_STICKY_SECONDS.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        replicas = current_app.extensions.get('replicas')
+        if replicas is not None and not replicas.wrote_recently(get_client_key()):
+            current_app.extensions['sqlalchemy'].session.info['read_replica'] = True
+        return f(*args, **kwargs)
+    return wrapper
+
+
+def init_replicas(app, db, keys):
+    """
+    Enables replica routing for the replica binds of an app (requires an app context)
+
+    Args:
+        app: The Flask application
+        db: Its SQLAlchemy extension, created with `RoutingSession`
+        keys (list): Bind keys of the replicas
+    """
+    replicas = ReplicaSet(keys, backend=get_backend(REPLICA_STICKY_URL, prefix='trivia:writer:'))
+    app.extensions['replicas'] = replicas
+
+    for key in keys:
+        replicas.watch(key, db.engines[key])
+
+    @app.teardown_request
+    def _reset_read_replica(exc):
+        # The session outlives the request when the app context is shared
+        db.session.info.pop('read_replica', None)
+        db.session.info.pop('replica_key', None)
+
+    logger.info("Routing read-only requests to %s replicas (%s)", len(keys), replicas.strategy)
+    return replicas
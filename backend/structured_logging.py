@@ -0,0 +1,238 @@
+"""
+Structured Logging
+Log output from the environment: text or JSON lines, a background writer thread, sampling and request ids
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import uuid
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import request
+
+# DEBUG, INFO, WARNING or ERROR
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# text (one human readable line per record) or json (one JSON object per line)
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+# Write records from a background thread instead of the thread that logs them
+LOG_ASYNC = os.environ.get('LOG_ASYNC', 'false').lower() in ('1', 'true', 'yes')
+# Records waiting for the writer thread; records logged while it is full are dropped
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+# Fraction of requests whose DEBUG and INFO records are written (warnings and errors always are)
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '1'))
+# Header carrying the request id; a valid incoming id is kept, otherwise one is generated
+REQUEST_ID_HEADER = os.environ.get('REQUEST_ID_HEADER', 'X-Request-ID')
+
+LOG_FORMATS = ('text', 'json')
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+# Attributes of every LogRecord; anything else was passed with `extra=` and is written as a field
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {
+    'message', 'asctime', 'request_id'}
+
+_request_id = ContextVar('request_id', default=None)
+_sampled = ContextVar('log_sampled', default=True)
+
+
+def start_request(request_id=None, sample_rate=None):
+    """
+    Sets the request id used by the logs of the current thread or task
+
+    Args:
+        request_id (str): Id received from the client; replaced when missing or invalid
+        sample_rate (float): Fraction of requests whose DEBUG and INFO records are kept
+
+    Returns:
+        request_id (str): The id in use
+    """
+    if request_id is None or not REQUEST_ID_PATTERN.match(request_id):
+        request_id = uuid.uuid4().hex
+    rate = LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+    _request_id.set(request_id)
+    # Keyed by the id, so every record of a request is kept or dropped together
+    _sampled.set(rate >= 1 or zlib.crc32(request_id.encode('utf-8')) < rate * 0x100000000)
+    return request_id
+
+
+def end_request():
+    """Clears the request id of the current thread or task"""
+    _request_id.set(None)
+    _sampled.set(True)
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Tags records with the request id and drops DEBUG and INFO records of unsampled requests
+
+    Runs on the thread that logs, before the record is queued, so the
+    request id is the one of the request that logged it.
+    """
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        if record.levelno >= logging.WARNING:
+            return True
+        if record.request_id is None:
+            return LOG_SAMPLE_RATE >= 1 or random.random() < LOG_SAMPLE_RATE
+        return _sampled.get()
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, with `extra=` values as fields"""
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """
+    Queue handler leaving the formatting to the writer thread
+
+    The standard QueueHandler renders the message on the logging thread;
+    here only tracebacks are rendered there, and `%` arguments are merged
+    when the writer thread formats the record. Arguments must therefore
+    not change after they are logged (pass values, not objects that are
+    modified later). When the queue is full the record is dropped and
+    counted instead of blocking the request.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """The handlers installed on the root logger by configure_logging"""
+    def __init__(self, handler, queue_handler=None, queue_size=LOG_QUEUE_SIZE):
+        self.handler = handler
+        self.queue_handler = queue_handler
+        self.queue_size = queue_size
+        self.listener = None
+
+    def start(self):
+        if self.queue_handler is not None:
+            self.listener = QueueListener(self.queue_handler.queue, self.handler, respect_handler_level=True)
+            self.listener.start()
+
+    def stop(self):
+        """Writes the queued records and stops the writer thread"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def restart_after_fork(self):
+        # The writer thread does not survive fork, and the queue's lock may be held
+        if self.queue_handler is not None:
+            self.listener = None
+            self.queue_handler.queue = queue.Queue(self.queue_size)
+            self.start()
+
+    def stats(self):
+        if self.queue_handler is None:
+            return {'queued': 0, 'dropped': 0}
+        return {'queued': self.queue_handler.queue.qsize(), 'dropped': self.queue_handler.dropped}
+
+
+_pipeline = None
+
+
+def configure_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, background=LOG_ASYNC,
+                      queue_size=LOG_QUEUE_SIZE):
+    """
+    Configures the root logger once per process
+
+    Like logging.basicConfig, does nothing when the root logger already
+    has handlers (e.g. configured by the embedding application).
+
+    Args:
+        level (str): Lowest level written
+        log_format (str): 'text' or 'json'
+        background (bool): Write from a background thread
+        queue_size (int): Records buffered for the background thread
+    """
+    global _pipeline
+    root = logging.getLogger()
+    if _pipeline is not None or root.handlers:
+        return _pipeline
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"LOG_FORMAT must be one of {', '.join(LOG_FORMATS)}, not {log_format}")
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JSONFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+    if background:
+        queue_handler = BackgroundQueueHandler(queue.Queue(queue_size))
+        queue_handler.addFilter(RequestContextFilter())
+        pipeline = LogPipeline(handler, queue_handler, queue_size)
+        installed = queue_handler
+    else:
+        handler.addFilter(RequestContextFilter())
+        pipeline = LogPipeline(handler)
+        installed = handler
+
+    root.setLevel(level)
+    root.addHandler(installed)
+    pipeline.start()
+    if background:
+        atexit.register(pipeline.stop)
+        os.register_at_fork(after_in_child=pipeline.restart_after_fork)
+    _pipeline = pipeline
+    return pipeline
+
+
+def get_logging_stats():
+    """Returns the records waiting for and dropped by the writer thread"""
+    if _pipeline is None:
+        return {'queued': 0, 'dropped': 0}
+    return _pipeline.stats()
+
+
+def init_request_ids(app):
+    """Gives each request of an app an id, logged with its records and returned in REQUEST_ID_HEADER"""
+    @app.before_request
+    def _start_request_id():
+        start_request(request.headers.get(REQUEST_ID_HEADER))
+
+    @app.after_request
+    def _add_request_id_header(response):
+        request_id = _request_id.get()
+        if request_id is not None:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
+
+    @app.teardown_request
+    def _end_request_id(exc):
+        end_request()
@@ -0,0 +1,223 @@
+"""
+Auth Test Suite
+Tests JWT verification against a locally generated key set (no Auth0 or database required)
+"""
+
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from cryptography.hazmat.primitives import serialization
+from flask import Flask
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+
+import auth
+from auth import (AuthError, JWKSKeyStore, VerifiedTokenCache, requires_auth, verify_auth_header_async,
+                  verify_decode_jwt)
+
+
+def _b64(number):
+    data = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def make_key(kid):
+    """Generates an RSA key and returns its PEM private key and JWK public key"""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    numbers = private_key.public_key().public_numbers()
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    ).decode('ascii')
+    jwk = {'kty': 'RSA', 'kid': kid, 'use': 'sig', 'n': _b64(numbers.n), 'e': _b64(numbers.e)}
+    return pem, jwk
+
+
+def make_token(pem, kid, permissions=None, expires_in=3600):
+    now = int(time.time())
+    claims = {
+        'iss': f'https://{auth.AUTH0_DOMAIN}/',
+        'aud': auth.API_AUDIENCE,
+        'sub': 'auth0|test',
+        'iat': now,
+        'exp': now + expires_in,
+        'permissions': permissions or ['get:questions']
+    }
+    return jwt.encode(claims, pem, algorithm='RS256', headers={'kid': kid})
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    """Test case for the cached JWKS key store"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pem, cls.jwk = make_key('key-1')
+        cls.other_pem, cls.other_jwk = make_key('key-2')
+
+    def setUp(self):
+        fd, self.jwks_path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.write_jwks([self.jwk])
+        self.store = JWKSKeyStore(self.jwks_path, default_ttl=600, min_refetch_interval=30)
+        self.original_store = auth.jwks_store
+        auth.jwks_store = self.store
+
+    def tearDown(self):
+        auth.jwks_store = self.original_store
+        self.store.clear()
+        os.remove(self.jwks_path)
+
+    def write_jwks(self, keys):
+        with open(self.jwks_path, 'w') as f:
+            json.dump({'keys': keys}, f)
+
+    def test_verify_token_with_file_key_set(self):
+        token = make_token(self.pem, 'key-1')
+        payload = verify_decode_jwt(token)
+        self.assertEqual(payload['sub'], 'auth0|test')
+
+    def test_keys_are_cached(self):
+        verify_decode_jwt(make_token(self.pem, 'key-1'))
+        os.remove(self.jwks_path)
+        payload = verify_decode_jwt(make_token(self.pem, 'key-1'))
+        self.assertEqual(payload['sub'], 'auth0|test')
+        self.write_jwks([self.jwk])
+
+    def test_unknown_kid_refetches_key_set(self):
+        verify_decode_jwt(make_token(self.pem, 'key-1'))
+        self.write_jwks([self.jwk, self.other_jwk])
+        self.store._last_fetch -= self.store.min_refetch_interval
+        payload = verify_decode_jwt(make_token(self.other_pem, 'key-2'))
+        self.assertEqual(payload['sub'], 'auth0|test')
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        verify_decode_jwt(make_token(self.pem, 'key-1'))
+        self.write_jwks([self.jwk, self.other_jwk])
+        self.store._last_fetch = time.monotonic()
+        with self.assertRaises(AuthError) as context:
+            verify_decode_jwt(make_token(self.other_pem, 'key-2'))
+        self.assertEqual(context.exception.status_code, 400)
+
+    def test_unavailable_key_set_fails(self):
+        os.remove(self.jwks_path)
+        with self.assertRaises(AuthError) as context:
+            verify_decode_jwt(make_token(self.pem, 'key-1'))
+        self.assertEqual(context.exception.status_code, 503)
+        self.write_jwks([self.jwk])
+
+    def test_expired_token_fails(self):
+        token = make_token(self.pem, 'key-1', expires_in=-10)
+        with self.assertRaises(AuthError) as context:
+            verify_decode_jwt(token)
+        self.assertEqual(context.exception.error['code'], 'token_expired')
+
+
+class DictBackend:
+    """In-memory stand-in for a shared cache backend"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ttl):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class VerifiedTokenCacheTestCase(unittest.TestCase):
+    """Test case for the verified token cache used by requires_auth"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pem, cls.jwk = make_key('key-1')
+
+    def setUp(self):
+        self.original_store = auth.jwks_store
+        self.original_cache = auth.token_cache
+        auth.jwks_store = JWKSKeyStore('unused')
+        auth.jwks_store.load({'keys': [self.jwk]})
+        auth.token_cache = VerifiedTokenCache(max_size=2)
+        self.app = Flask(__name__)
+
+    def tearDown(self):
+        auth.jwks_store.clear()
+        auth.jwks_store = self.original_store
+        auth.token_cache = self.original_cache
+
+    def call_protected(self, token):
+        @requires_auth('get:questions')
+        def view(payload):
+            return payload
+
+        with self.app.test_request_context(headers={'Authorization': f'Bearer {token}'}):
+            return view()
+
+    def test_repeated_token_is_served_from_cache(self):
+        token = make_token(self.pem, 'key-1')
+        self.call_protected(token)
+        payload = self.call_protected(token)
+        self.assertEqual(payload['sub'], 'auth0|test')
+        self.assertEqual(auth.token_cache.stats()['hits'], 1)
+        self.assertEqual(auth.token_cache.stats()['misses'], 1)
+
+    def test_cached_token_still_checks_permissions(self):
+        token = make_token(self.pem, 'key-1', permissions=['get:categories'])
+        with self.assertRaises(AuthError):
+            self.call_protected(token)
+        with self.assertRaises(AuthError) as context:
+            self.call_protected(token)
+        self.assertEqual(context.exception.status_code, 403)
+
+    def test_async_verification_shares_the_cache(self):
+        token = make_token(self.pem, 'key-1')
+        self.call_protected(token)
+        payload = asyncio.run(verify_auth_header_async(f'Bearer {token}', 'get:questions'))
+        self.assertEqual(payload['sub'], 'auth0|test')
+        self.assertEqual(auth.token_cache.stats()['hits'], 1)
+
+    def test_async_verification_checks_permissions(self):
+        token = make_token(self.pem, 'key-1', permissions=['get:categories'])
+        with self.assertRaises(AuthError) as context:
+            asyncio.run(verify_auth_header_async(f'Bearer {token}', 'get:questions'))
+        self.assertEqual(context.exception.status_code, 403)
+        with self.assertRaises(AuthError) as context:
+            asyncio.run(verify_auth_header_async(None, 'get:questions'))
+        self.assertEqual(context.exception.status_code, 401)
+
+    def test_entry_never_outlives_token(self):
+        cache = VerifiedTokenCache()
+        cache.set('token', {'exp': time.time() - 1})
+        self.assertIsNone(cache.get('token'))
+        cache.set('no-exp', {'sub': 'auth0|test'})
+        self.assertIsNone(cache.get('no-exp'))
+
+    def test_cache_is_bounded(self):
+        cache = VerifiedTokenCache(max_size=2)
+        exp = time.time() + 60
+        for token in ('a', 'b', 'c'):
+            cache.set(token, {'exp': exp})
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(cache.stats()['size'], 2)
+
+    def test_shared_backend_hit(self):
+        backend = DictBackend()
+        VerifiedTokenCache(backend=backend).set('token', {'exp': time.time() + 60})
+        cache = VerifiedTokenCache(backend=backend)
+        self.assertIsNotNone(cache.get('token'))
+        self.assertEqual(cache.stats()['shared_hits'], 1)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+Batch Fetch Test Suite
+Tests fetching questions by id against a SQLite database (no database server required)
+"""
+
+import os
+import tempfile
+import unittest
+
+from flask import Flask
+
+from flaskr.batch import fetch_questions_in_order, parse_question_ids
+from flaskr.bulk import get_batch_conditions
+from models import db, setup_db, Category, Question
+
+
+class BatchFetchTestCase(unittest.TestCase):
+    """Test case for selecting questions by id"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.app = Flask(__name__)
+        setup_db(self.app, database_path=f'sqlite:///{self.path}', replica_paths=[])
+        with self.app.app_context():
+            Category('Science').insert()
+            db.session.add_all([Question(f'Question {i}', 'Answer', 1, 1) for i in range(10)])
+            db.session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.engine.dispose()
+        os.remove(self.path)
+
+    def test_rows_are_in_request_order(self):
+        with self.app.app_context():
+            rows, missing = fetch_questions_in_order([7, 2, 99, 5])
+        self.assertEqual([row[0] for row in rows], [7, 2, 5])
+        self.assertEqual(rows[0][1], 'Question 6')
+        self.assertEqual(missing, [99])
+
+    def test_no_ids(self):
+        with self.app.app_context():
+            self.assertEqual(fetch_questions_in_order([]), ([], []))
+
+
+class ParseQuestionIdsTestCase(unittest.TestCase):
+    """Test case for reading the ids of a batch fetch"""
+
+    def test_lists_and_strings(self):
+        self.assertEqual(parse_question_ids('3,1,3, 2'), ([3, 1, 2], None))
+        self.assertEqual(parse_question_ids([5, 4, 5]), ([5, 4], None))
+
+    def test_invalid_ids(self):
+        for ids in (None, '', [], 'a,1', '1_0', '-1', '1.0', [True], [False], [1.5], [1.0], ['4'],
+                    [None], {'id': 1}):
+            self.assertEqual(parse_question_ids(ids)[0], None, ids)
+        self.assertIsNone(parse_question_ids(list(range(4)), max_ids=3)[0])
+
+
+class BatchConditionsTestCase(unittest.TestCase):
+    """Test case for the selection of a batch delete or update"""
+
+    def test_ids_and_filter(self):
+        conditions, error = get_batch_conditions({'ids': [3, 1, 3], 'filter': {'category': 2}})
+        self.assertIsNone(error)
+        self.assertEqual(len(conditions), 2)
+
+    def test_ids_must_be_integers(self):
+        # int() would have turned true into question 1
+        for ids in ([True], [False], [1.0], [1.5], ['1'], [None], [[1]]):
+            self.assertEqual(get_batch_conditions({'ids': ids}), (None, 'ids must be integers'), ids)
+
+    def test_filter_values_must_be_integers(self):
+        for value in (True, 2.0, '2', None):
+            conditions, error = get_batch_conditions({'filter': {'category': value}})
+            self.assertIsNone(conditions)
+            self.assertTrue(error.startswith('Invalid category value'))
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
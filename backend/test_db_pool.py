@@ -0,0 +1,120 @@
+"""
+Connection Pool Test Suite
+Tests the pool options, pre-ping by idle interval and pool statistics (no database server required)
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool, QueuePool
+
+import db_pool
+from db_pool import PoolStats, get_engine_options, get_pool_status, instrument_engine
+
+
+class EngineOptionsTestCase(unittest.TestCase):
+    """Test case for the create_engine options of each pool mode"""
+
+    def test_queue_mode(self):
+        options = get_engine_options('postgresql://localhost/trivia')
+        self.assertIs(options['poolclass'], QueuePool)
+        self.assertEqual(options['pool_size'], db_pool.DB_POOL_SIZE)
+        self.assertTrue(options['pool_use_lifo'])
+        # Pings are done by instrument_engine once a connection sat idle
+        self.assertFalse(options['pool_pre_ping'])
+
+    def test_pgbouncer_mode(self):
+        with mock.patch.object(db_pool, 'DB_POOL_MODE', 'pgbouncer'):
+            options = get_engine_options('postgresql://localhost/trivia')
+            self.assertIs(options['poolclass'], NullPool)
+            self.assertNotIn('pool_size', options)
+
+            options = get_engine_options('postgresql+asyncpg://localhost/trivia', is_async=True)
+            self.assertEqual(options['connect_args']['statement_cache_size'], 0)
+
+    def test_unknown_mode_fails(self):
+        with mock.patch.object(db_pool, 'DB_POOL_MODE', 'session'):
+            with self.assertRaises(ValueError):
+                get_engine_options('postgresql://localhost/trivia')
+
+    def test_sqlite_memory_keeps_default_pool(self):
+        self.assertEqual(get_engine_options('sqlite://'), {})
+
+
+class PoolInstrumentationTestCase(unittest.TestCase):
+    """Test case for pre-ping by interval and the pool statistics"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.stats = PoolStats()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def create_engine(self, pre_ping_interval):
+        url = f'sqlite:///{self.path}'
+        engine = create_engine(url, **get_engine_options(url, stats=self.stats))
+        instrument_engine(engine, self.stats, pre_ping_interval=pre_ping_interval)
+        self.addCleanup(engine.dispose)
+        return engine
+
+    def query(self, engine):
+        with engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+
+    def test_checkouts_are_counted(self):
+        engine = self.create_engine(pre_ping_interval=60)
+        for _ in range(3):
+            self.query(engine)
+
+        status = get_pool_status(engine, self.stats)
+        self.assertEqual(status['mode'], 'queue')
+        self.assertEqual(status['checkouts'], 3)
+        self.assertEqual(status['connects'], 1)
+        self.assertEqual(status['checked_out'], 0)
+        self.assertEqual(status['timeouts'], 0)
+
+    def test_busy_connections_are_not_pinged(self):
+        engine = self.create_engine(pre_ping_interval=60)
+        for _ in range(3):
+            self.query(engine)
+        self.assertEqual(self.stats.pings, 0)
+
+    def test_idle_connections_are_pinged(self):
+        engine = self.create_engine(pre_ping_interval=0.001)
+        self.query(engine)
+        with mock.patch('db_pool.time.monotonic', return_value=float('inf')):
+            self.query(engine)
+        self.assertEqual(self.stats.pings, 1)
+        self.assertEqual(self.stats.ping_failures, 0)
+
+    def test_stats_survive_dispose(self):
+        engine = self.create_engine(pre_ping_interval=60)
+        self.query(engine)
+        engine.dispose()
+        self.query(engine)
+        self.assertEqual(get_pool_status(engine, self.stats)['checkouts'], 2)
+
+    def test_forked_process_drops_inherited_connections(self):
+        engine = self.create_engine(pre_ping_interval=60)
+        self.query(engine)
+        inherited = engine.pool
+        self.addCleanup(inherited.dispose)
+
+        with mock.patch.dict(db_pool.pools, {'default': (engine, self.stats)}, clear=True):
+            db_pool.dispose_pools_after_fork()
+
+        # The parent's connection is left open for the parent
+        self.assertIsNot(engine.pool, inherited)
+        self.assertEqual(inherited.checkedin(), 1)
+        self.query(engine)
+        self.assertEqual(self.stats.connects, 2)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
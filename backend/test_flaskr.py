@@ -81,6 +81,25 @@ class TriviaTestCase(unittest.TestCase):
         self.assertIsNotNone(data['questions'])
         self.assertIsNotNone(data['total_questions'])
 
+    def test_search_questions_paginated(self):
+        res = self.client().post('/questions/search',
+                                 json={'searchTerm': 'a', 'page': 1, 'per_page': 2})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertLessEqual(len(data['questions']), 2)
+        self.assertGreaterEqual(data['total_questions'], len(data['questions']))
+
+    def test_search_questions_substring_mode(self):
+        res = self.client().post('/questions/search',
+                                 json={'searchTerm': 'a', 'mode': 'substring', 'include_answers': True})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['total_questions'])
+
     def test_fail_search_questions(self):
         search_data = {
             'searchTerm': 'eafdadcaatea',
@@ -129,6 +148,32 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['questions'])
 
+    def test_get_questions_by_category_per_page(self):
+        res = self.client().get('categories/1/questions?page=1&per_page=2')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertLessEqual(len(data['questions']), 2)
+        self.assertGreaterEqual(data['total_questions'], len(data['questions']))
+
+    def test_get_questions_by_category_cursor(self):
+        res = self.client().get('categories/1/questions?cursor=&per_page=1&include_total=false')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['questions']), 1)
+        self.assertIsNone(data['total_questions'])
+        self.assertIn('next_cursor', data)
+
+    def test_fail_get_questions_by_category_cursor(self):
+        res = self.client().get('categories/1/questions?cursor=not-a-cursor')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     def test_fail_get_questions_by_category(self):
         res = self.client().get('categories/1000/questions')
         data = json.loads(res.data)
@@ -147,6 +192,79 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['question'])
         self.assertEqual(data['question']['category'], 1)
 
+    def test_get_quiz_skips_previous_questions(self):
+        res = self.client().post('/quizzes',
+                                 json={'previous_questions': [],
+                                       'quiz_category': {'id': 0}})
+        first = json.loads(res.data)['question']
+
+        res = self.client().post('/quizzes',
+                                 json={'previous_questions': [first['id']],
+                                       'quiz_category': {'id': 0}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        if data['question'] is not None:
+            self.assertNotEqual(data['question']['id'], first['id'])
+
+    def test_quiz_session(self):
+        res = self.client().post('/quizzes/sessions',
+                                 json={'quiz_category': {'id': '1', 'type': 'Science'}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['session_id'])
+
+        res = self.client().post('/quizzes', json={'session_id': data['session_id']})
+        question_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(question_data['question'])
+        self.assertEqual(question_data['remaining'], data['total_questions'] - 1)
+
+    def test_fail_quiz_session(self):
+        res = self.client().post('/quizzes', json={'session_id': 'does-not-exist'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    def test_ramped_quiz(self):
+        body = {'mode': 'ramp', 'seed': 'cup', 'step': 0, 'quiz_category': {'id': 0, 'type': 'click'}}
+        first = json.loads(self.client().post('/quizzes', json=body).data)
+        again = json.loads(self.client().post('/quizzes', json=body).data)
+
+        self.assertEqual(first['success'], True)
+        self.assertEqual(first['question'], again['question'])
+        self.assertEqual(first['next_step'], 1)
+        self.assertTrue(first['total_steps'])
+        self.assertEqual(first['deck_version'], again['deck_version'])
+
+    def test_fail_ramped_quiz(self):
+        res = self.client().post('/quizzes', json={'mode': 'ramp', 'step': 0,
+                                                   'quiz_category': {'id': 0, 'type': 'click'}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_prefetch_ramped_quiz(self):
+        body = {'mode': 'ramp', 'seed': 'cup', 'step': 0, 'count': 3, 'quiz_category': {'id': 0, 'type': 'click'}}
+        res = self.client().post('/quizzes', json=body)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['questions']), len(data['steps']))
+        self.assertTrue(len(data['questions']))
+
+    def test_fail_prefetch_quiz(self):
+        res = self.client().post('/quizzes', json={'count': 3, 'quiz_category': {'id': 0, 'type': 'click'}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     def test_fail_get_quiz(self):
         res = self.client().post('/quizzes',
                                  json={
@@ -157,6 +275,13 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 500)
         self.assertEqual(data['success'], False)
 
+    def test_fail_get_metrics_without_token(self):
+        res = self.client().get('/metrics')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(data['code'], 'authorization_header_missing')
+
 
 
 # Make the tests conveniently executable
@@ -0,0 +1,181 @@
+"""
+Instrumentation Test Suite
+Tests the request phase timings, SQL counts, metrics rendering and profiler (no database server required)
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from flask import Flask, jsonify
+from sqlalchemy import text
+
+import instrumentation
+from instrumentation import (Histogram, MetricsRegistry, SamplingProfiler, authorize_metrics,
+                             boot_gauges, boot_step, init_instrumentation, phase)
+from models import db, setup_db, Category
+
+
+class InstrumentedAppTestCase(unittest.TestCase):
+    """Test case for the metrics recorded for requests"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.profile_dir = tempfile.mkdtemp()
+
+        self.app = Flask(__name__)
+        setup_db(self.app, database_path=f'sqlite:///{self.path}', replica_paths=[])
+        self.registry = MetricsRegistry()
+        self.profiler = SamplingProfiler(sample_rate=0, interval=0.001, slow_seconds=0,
+                                         directory=self.profile_dir)
+        with self.app.app_context():
+            init_instrumentation(self.app, db, registry=self.registry, request_profiler=self.profiler)
+
+        @self.app.route('/categories/<int:count>')
+        def categories(count):
+            for _ in range(count):
+                Category.query.all()
+            with phase('auth'):
+                pass
+            return jsonify({'success': True})
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.engine.dispose()
+        os.remove(self.path)
+        shutil.rmtree(self.profile_dir)
+
+    def sample(self, name, **labels):
+        for sample_name, sample_labels, value in self.registry.phases.samples() + \
+                self.registry.queries.samples() + self.registry.requests.samples():
+            if sample_name == name and sample_labels == tuple(labels.values()):
+                return value
+        return None
+
+    def test_statements_are_counted_per_route(self):
+        self.client.get('/categories/3')
+        self.client.get('/categories/1')
+        self.assertEqual(self.sample('trivia_request_queries_sum', route='/categories/<int:count>'), 4)
+        self.assertEqual(self.sample('trivia_request_queries_count', route='/categories/<int:count>'), 2)
+
+    def test_phases_are_recorded(self):
+        self.client.get('/categories/1')
+        for name in ('auth', 'db', 'serialization', 'app'):
+            self.assertEqual(self.sample('trivia_request_phase_seconds_count',
+                                         route='/categories/<int:count>', phase=name), 1)
+        self.assertGreater(self.sample('trivia_request_phase_seconds_sum',
+                                       route='/categories/<int:count>', phase='db'), 0)
+
+    def test_unmatched_routes_share_a_label(self):
+        self.client.get('/missing/1')
+        self.client.get('/missing/2')
+        self.assertEqual(self.sample('trivia_requests_total', route='<unmatched>', method='GET',
+                                     status='404'), 2)
+
+    def test_queries_outside_requests_are_ignored(self):
+        with self.app.app_context():
+            db.session.execute(text('SELECT 1'))
+        self.assertEqual(self.registry.queries.samples(), [])
+
+    def test_slow_sampled_request_is_profiled(self):
+        self.profiler.sample_rate = 1
+
+        @self.app.route('/slow')
+        def slow():
+            time.sleep(0.05)
+            return jsonify({'success': True})
+
+        self.client.get('/slow')
+        profiles = os.listdir(self.profile_dir)
+        self.assertEqual(len(profiles), 1)
+        with open(os.path.join(self.profile_dir, profiles[0])) as f:
+            stack, count = f.readline().rsplit(' ', 1)
+        self.assertIn('slow (test_instrumentation.py', stack)
+        self.assertGreater(int(count), 0)
+
+
+class MetricsRenderingTestCase(unittest.TestCase):
+    """Test case for the Prometheus text format"""
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(('/a',), value)
+        samples = {(name, labels): value for name, labels, value in histogram.samples()}
+        self.assertEqual(samples[('latency_seconds_bucket', ('/a', '0.1'))], 1)
+        self.assertEqual(samples[('latency_seconds_bucket', ('/a', '1'))], 2)
+        self.assertEqual(samples[('latency_seconds_bucket', ('/a', '+Inf'))], 3)
+        self.assertEqual(samples[('latency_seconds_count', ('/a',))], 3)
+
+    def test_render_escapes_labels_and_adds_collectors(self):
+        registry = MetricsRegistry(collectors=[lambda: [('pool_size', 'Pool size', ('pool',),
+                                                         [(('default',), 10)])]])
+        registry.requests.inc(('/a"b', 'GET', '200'))
+        rendered = registry.render()
+        self.assertIn('# TYPE trivia_requests_total counter', rendered)
+        self.assertIn(f'trivia_requests_total{{pid="{os.getpid()}",route="/a\\"b",method="GET",'
+                      f'status="200"}} 1', rendered)
+        self.assertIn(f'pool_size{{pid="{os.getpid()}",pool="default"}} 10', rendered)
+
+    def test_boot_steps_are_rendered(self):
+        with mock.patch.dict(instrumentation.boot_times, clear=True):
+            with boot_step('setup_db'):
+                pass
+            rendered = MetricsRegistry(collectors=[boot_gauges]).render()
+        self.assertIn('# TYPE trivia_boot_seconds gauge', rendered)
+        self.assertIn(f'trivia_boot_seconds{{pid="{os.getpid()}",step="setup_db"}}', rendered)
+
+    def test_metrics_token(self):
+        # Without a configured token only Trivia Manager tokens are accepted by the route
+        self.assertFalse(authorize_metrics(None, token=None))
+        self.assertFalse(authorize_metrics('Bearer anything', token=None))
+        self.assertFalse(authorize_metrics(None, token='secret'))
+        self.assertFalse(authorize_metrics('Bearer other', token='secret'))
+        self.assertTrue(authorize_metrics('Bearer secret', token='secret'))
+
+
+class SamplingProfilerTestCase(unittest.TestCase):
+    """Test case for the background sampling thread"""
+
+    @staticmethod
+    def busy(seconds):
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            pass
+
+    def wait_until_idle(self, profiler):
+        deadline = time.monotonic() + 1
+        while profiler._wake.is_set() and time.monotonic() < deadline:
+            time.sleep(0.005)
+        self.assertFalse(profiler._wake.is_set())
+
+    def test_thread_sleeps_without_targets(self):
+        profiler = SamplingProfiler(sample_rate=1, interval=0.001, slow_seconds=0)
+        samples = profiler.start()
+        self.busy(0.05)
+        profiler.stop()
+        self.assertTrue(samples)
+
+        self.wait_until_idle(profiler)
+        with mock.patch.object(instrumentation.sys, '_current_frames') as current_frames:
+            time.sleep(0.05)
+        current_frames.assert_not_called()
+
+        # A new target wakes the same thread up again
+        thread = profiler._thread
+        samples = profiler.start()
+        self.busy(0.05)
+        profiler.stop()
+        self.assertTrue(samples)
+        self.assertIs(profiler._thread, thread)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
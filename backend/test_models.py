@@ -0,0 +1,180 @@
+"""
+Model Test Suite
+Tests the cache version counters and the schema migrations against SQLite (no database server required)
+"""
+
+import importlib.util
+import os
+import tempfile
+import threading
+import unittest
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from flask import Flask
+from sqlalchemy import create_engine, event, inspect, text
+
+from models import db, setup_db, bump_version, get_version
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations', 'versions')
+
+
+def load_migration(revision):
+    """Imports the migration script of a revision"""
+    name = next(name for name in os.listdir(MIGRATIONS_DIR) if name.startswith(f'{revision}_'))
+    spec = importlib.util.spec_from_file_location(f'migration_{revision}', os.path.join(MIGRATIONS_DIR, name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class CacheVersionTestCase(unittest.TestCase):
+    """Test case for the named version counters bumped by writes"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.app = Flask(__name__)
+        setup_db(self.app, database_path=f'sqlite:///{self.path}')
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.engine.dispose()
+        os.remove(self.path)
+
+    def test_first_bump_creates_the_counter(self):
+        with self.app.app_context():
+            self.assertEqual(get_version('categories'), 0)
+            bump_version('categories')
+            db.session.commit()
+            self.assertEqual(get_version('categories'), 1)
+
+            bump_version('categories')
+            bump_version('categories')
+            db.session.commit()
+            self.assertEqual(get_version('categories'), 3)
+            self.assertEqual(get_version('questions'), 0)
+
+    def test_bump_is_a_single_upsert(self):
+        statements = []
+        with self.app.app_context():
+            event.listen(db.engine, 'before_cursor_execute',
+                         lambda conn, cursor, statement, *args: statements.append(statement))
+            bump_version('categories')
+            db.session.commit()
+
+        # No UPDATE-then-INSERT window in which a concurrent first writer could insert the row
+        writes = [statement for statement in statements if 'cache_versions' in statement]
+        self.assertEqual(len(writes), 1)
+        self.assertIn('ON CONFLICT', writes[0])
+
+    def test_bump_is_part_of_the_transaction(self):
+        with self.app.app_context():
+            bump_version('categories')
+            db.session.rollback()
+            self.assertEqual(get_version('categories'), 0)
+
+    def test_concurrent_first_bumps(self):
+        errors = []
+
+        def bump():
+            try:
+                with self.app.app_context():
+                    bump_version('categories')
+                    db.session.commit()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=bump) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        with self.app.app_context():
+            self.assertEqual(get_version('categories'), 8)
+
+
+class CategoryForeignKeyMigrationTestCase(unittest.TestCase):
+    """Test case for the migration of questions.category from strings to an integer foreign key"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.engine = create_engine(f'sqlite:///{self.path}')
+        self.baseline = load_migration('f153a284ead8')
+        self.migration = load_migration('5805e3fce6b9')
+
+        # A database at the baseline revision, with categories stored as strings
+        self.run_migration(self.baseline.upgrade)
+        with self.engine.begin() as connection:
+            connection.execute(text("INSERT INTO categories (id, type) VALUES (1, 'Science'), (2, 'Art')"))
+            connection.execute(text(
+                "INSERT INTO questions (id, question, answer, category, difficulty) VALUES "
+                "(1, 'Q1', 'A1', '1', 1), (2, 'Q2', 'A2', '2', 3), (3, 'Q3', 'A3', '2', 5)"))
+
+    def tearDown(self):
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def run_migration(self, step):
+        with self.engine.begin() as connection:
+            with Operations.context(MigrationContext.configure(connection)):
+                step()
+
+    def category_column(self):
+        inspector = inspect(self.engine)
+        return next(column for column in inspector.get_columns('questions') if column['name'] == 'category')
+
+    def questions(self):
+        with self.engine.connect() as connection:
+            return connection.execute(text(
+                "SELECT id, category, typeof(category) FROM questions ORDER BY id")).all()
+
+    def test_upgrade_converts_categories(self):
+        self.assertEqual(self.questions()[0][2], 'text')
+        self.run_migration(self.migration.upgrade)
+
+        self.assertEqual(str(self.category_column()['type']), 'INTEGER')
+        self.assertEqual(self.questions(), [(1, 1, 'integer'), (2, 2, 'integer'), (3, 2, 'integer')])
+
+        inspector = inspect(self.engine)
+        foreign_keys = inspector.get_foreign_keys('questions')
+        self.assertEqual([(foreign_key['name'], foreign_key['constrained_columns'],
+                           foreign_key['referred_table'], foreign_key['referred_columns'])
+                          for foreign_key in foreign_keys],
+                         [('fk_questions_category_categories', ['category'], 'categories', ['id'])])
+        indexes = {index['name']: index['column_names'] for index in inspector.get_indexes('questions')}
+        self.assertEqual(indexes, {'ix_questions_category_id': ['category', 'id'],
+                                   'ix_questions_category_difficulty': ['category', 'difficulty']})
+
+        # The difficulty check survives the table rebuild
+        with self.assertRaises(Exception):
+            with self.engine.begin() as connection:
+                connection.execute(text(
+                    "INSERT INTO questions (question, answer, category, difficulty) VALUES ('Q', 'A', 1, 9)"))
+
+    def test_upgrade_is_idempotent(self):
+        self.run_migration(self.migration.upgrade)
+        # A database already at the target schema (db.create_all, trivia.psql) is left unchanged
+        self.run_migration(self.migration.upgrade)
+        self.assertEqual(len(inspect(self.engine).get_foreign_keys('questions')), 1)
+        self.assertEqual(len(inspect(self.engine).get_indexes('questions')), 2)
+
+    def test_downgrade_round_trips(self):
+        self.run_migration(self.migration.upgrade)
+        self.run_migration(self.migration.downgrade)
+
+        self.assertIn('VARCHAR', str(self.category_column()['type']))
+        self.assertEqual(inspect(self.engine).get_foreign_keys('questions'), [])
+        self.assertEqual(inspect(self.engine).get_indexes('questions'), [])
+        self.assertEqual(self.questions(), [(1, '1', 'text'), (2, '2', 'text'), (3, '2', 'text')])
+
+        self.run_migration(self.migration.upgrade)
+        self.assertEqual(self.questions(), [(1, 1, 'integer'), (2, 2, 'integer'), (3, 2, 'integer')])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,253 @@
+"""
+Quiz Deck Test Suite
+Tests the quiz pool and ramped quiz decks against a SQLite database (no database server required)
+"""
+
+import os
+import tempfile
+import unittest
+from array import array
+from unittest import mock
+
+from flask import Flask
+
+from flaskr import quiz
+from flaskr.quiz import (ALL_CATEGORIES, QuestionIdPool, QuizDeckStore, draw_ramp_questions, parse_bands,
+                         parse_prefetch_count, parse_ramp_request)
+from models import db, setup_db, Category, Question
+
+
+class QuizDeckStoreTestCase(unittest.TestCase):
+    """Test case for building decks and stepping through ramped quizzes"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.app = Flask(__name__)
+        setup_db(self.app, database_path=f'sqlite:///{self.path}', replica_paths=[])
+        with self.app.app_context():
+            for category_type in ('Science', 'Art'):
+                Category(category_type).insert()
+            db.session.add_all([Question(f'Question {i}', 'Answer', (i % 2) + 1, (i % 5) + 1)
+                                for i in range(60)])
+            db.session.commit()
+            self.difficulty = {question.id: question.difficulty for question in Question.query}
+            self.category = {question.id: question.category for question in Question.query}
+
+        self.decks = QuizDeckStore(bands='1-2,3,4-5', ttl=3600, steps_per_band=4)
+        with self.app.app_context():
+            self.decks.ensure_loaded(self.app)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.engine.dispose()
+        os.remove(self.path)
+
+    def play(self, category_id, seed, version=None):
+        return [self.decks.step(category_id, seed, step, version)[0]
+                for step in range(self.decks.total_steps(category_id, version))]
+
+    def test_quiz_ramps_difficulty_without_repeats(self):
+        ids = self.play(ALL_CATEGORIES, 'tournament')
+        # 4 easy, 4 medium, then all 24 hard questions
+        self.assertEqual(len(ids), 32)
+        self.assertEqual(len(set(ids)), 32)
+        difficulties = [self.difficulty[question_id] for question_id in ids]
+        self.assertTrue(all(difficulty <= 2 for difficulty in difficulties[:4]))
+        self.assertTrue(all(difficulty == 3 for difficulty in difficulties[4:8]))
+        self.assertTrue(all(difficulty >= 4 for difficulty in difficulties[8:]))
+        self.assertEqual(self.decks.step(ALL_CATEGORIES, 'tournament', 32), (None, None))
+
+    def test_same_seed_gives_same_sequence(self):
+        self.assertEqual(self.play(ALL_CATEGORIES, 'a'), self.play(ALL_CATEGORIES, 'a'))
+        self.assertNotEqual(self.play(ALL_CATEGORIES, 'a'), self.play(ALL_CATEGORIES, 'b'))
+
+        # A rebuild from the same questions keeps the sequences
+        before = self.play(ALL_CATEGORIES, 'a')
+        version = self.decks.resolve_version()
+        with self.app.app_context():
+            self.decks.load()
+        self.assertEqual(self.play(ALL_CATEGORIES, 'a'), before)
+        self.assertEqual(self.decks.resolve_version(), version)
+
+    def test_quiz_keeps_its_decks_across_rebuilds(self):
+        version = self.decks.resolve_version()
+        before = self.play(ALL_CATEGORIES, 'a', version)
+        with self.app.app_context():
+            db.session.add_all([Question(f'New {i}', 'Answer', 1, 5) for i in range(10)])
+            db.session.commit()
+            self.decks.load()
+
+        self.assertNotEqual(self.decks.resolve_version(), version)
+        self.assertEqual(self.decks.resolve_version(version), version)
+        self.assertEqual(self.play(ALL_CATEGORIES, 'a', version), before)
+        self.assertEqual(len(self.play(ALL_CATEGORIES, 'a')), len(before) + 10)
+
+    def test_evicted_version_falls_back_to_current_decks(self):
+        version = self.decks.resolve_version()
+        decks = QuizDeckStore(bands='1-2,3,4-5', ttl=3600, steps_per_band=4, history=1)
+        with self.app.app_context():
+            decks.load()
+            Question('New', 'Answer', 1, 5).insert()
+            decks.load()
+        self.assertEqual(decks.resolve_version(version), decks.resolve_version())
+        self.assertEqual(decks.resolve_version('unknown'), decks.resolve_version())
+
+    def test_category_decks_only_hold_the_category(self):
+        ids = self.play(2, 'a')
+        self.assertTrue(ids)
+        self.assertTrue(all(self.category[question_id] == 2 for question_id in ids))
+
+    def test_unknown_category_has_no_steps(self):
+        self.assertEqual(self.decks.total_steps(99), 0)
+        self.assertEqual(self.decks.step(99, 'a', 0), (None, None))
+
+    def test_prefetch_skips_deleted_questions(self):
+        ids = self.play(ALL_CATEGORIES, 'a')
+        with self.app.app_context():
+            db.session.get(Question, ids[1]).delete()
+            original, quiz.quiz_decks = quiz.quiz_decks, self.decks
+            try:
+                drawn, next_step, version = draw_ramp_questions(self.app, ALL_CATEGORIES, 'a', 0, 3)
+                rest, end, _ = draw_ramp_questions(self.app, ALL_CATEGORIES, 'a', next_step, 100, version)
+            finally:
+                quiz.quiz_decks = original
+
+        self.assertEqual([(step, row[0]) for step, _, row in drawn],
+                         [(0, ids[0]), (2, ids[2]), (3, ids[3])])
+        self.assertEqual(next_step, 4)
+        self.assertEqual([row[0] for _, _, row in rest], ids[4:])
+        self.assertIsNone(end)
+
+
+class QuestionIdPoolTestCase(unittest.TestCase):
+    """Test case for rebuilding the quiz pool while questions change"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.app = Flask(__name__)
+        setup_db(self.app, database_path=f'sqlite:///{self.path}', replica_paths=[])
+        with self.app.app_context():
+            Category('Science').insert()
+            db.session.add_all([Question(f'Question {i}', 'Answer', 1, 1) for i in range(5)])
+            db.session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.engine.dispose()
+        os.remove(self.path)
+
+    def load_while_changing(self, pool):
+        query = db.session.query
+
+        def query_during_writes(*args):
+            # Another request inserts 100 and deletes 1 while the rebuild scans the table
+            pool.add(100, 1)
+            pool.discard(1)
+            return query(*args)
+
+        with mock.patch.object(db.session, 'query', side_effect=query_during_writes):
+            pool.load()
+
+    def test_cold_load_replays_changes(self):
+        pool = QuestionIdPool()
+        with self.app.app_context():
+            self.load_while_changing(pool)
+        self.assertEqual(list(pool.snapshot(ALL_CATEGORIES)), [2, 3, 4, 5, 100])
+        self.assertEqual(list(pool.snapshot(1)), [2, 3, 4, 5, 100])
+
+    def test_rebuild_replays_changes(self):
+        pool = QuestionIdPool()
+        with self.app.app_context():
+            pool.load()
+            self.load_while_changing(pool)
+        self.assertEqual(list(pool.snapshot(ALL_CATEGORIES)), [2, 3, 4, 5, 100])
+
+    def test_invalidate_during_load_discards_snapshot(self):
+        pool = QuestionIdPool()
+        query = db.session.query
+
+        def query_during_bulk_write(*args):
+            pool.invalidate()
+            return query(*args)
+
+        with self.app.app_context():
+            with mock.patch.object(db.session, 'query', side_effect=query_during_bulk_write):
+                pool.load()
+        self.assertFalse(pool.is_loaded)
+
+
+class QuestionIdPoolPickTestCase(unittest.TestCase):
+    """Test case for picking ids once most of a category is excluded (no database required)"""
+
+    def setUp(self):
+        self.pool = QuestionIdPool()
+        self.pool._ids = {ALL_CATEGORIES: array('l', range(0, 2000, 2))}
+
+    def test_picks_only_ids_left(self):
+        left = {10, 500, 1998}
+        exclude = set(range(0, 2000, 2)) - left
+        # Ids outside the category do not count as excluded ones
+        exclude |= {1, 3, 5000}
+        picked = {self.pool.pick(ALL_CATEGORIES, exclude) for _ in range(200)}
+        self.assertEqual(picked, left)
+
+    def test_every_id_excluded(self):
+        self.assertIsNone(self.pool.pick(ALL_CATEGORIES, set(range(0, 2000, 2))))
+        self.assertIsNone(self.pool.pick(7, set()))
+
+    def test_cost_depends_on_the_exclusions_not_the_category(self):
+        ids = CountingArray(array('l', range(100000)))
+        self.pool._ids = {ALL_CATEGORIES: ids}
+        exclude = set(range(0, 100000, 2000))
+        # Skip rejection sampling, as after unlucky samples
+        with mock.patch('flaskr.quiz.QUIZ_SAMPLE_ATTEMPTS', 0):
+            for _ in range(20):
+                self.assertNotIn(self.pool.pick(ALL_CATEGORIES, exclude), exclude)
+        # A binary search per excluded id, instead of a pass over 100000 ids per pick
+        self.assertLess(ids.reads, 20 * len(exclude) * 20)
+
+
+class CountingArray:
+    """Sorted id array counting its item reads"""
+
+    def __init__(self, items):
+        self.items = items
+        self.reads = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        self.reads += 1
+        return self.items[index]
+
+
+class RampRequestTestCase(unittest.TestCase):
+    """Test case for parsing bands and ramped quiz requests"""
+
+    def test_parse_bands(self):
+        self.assertEqual(parse_bands('1-2,3,4-5'), [(1, 2), (3, 3), (4, 5)])
+        with self.assertRaises(ValueError):
+            parse_bands('3-4,1-2')
+
+    def test_parse_ramp_request(self):
+        self.assertEqual(parse_ramp_request({'seed': 42}), ('42', 0, None))
+        self.assertEqual(parse_ramp_request({'seed': 'cup', 'step': 7, 'deck_version': 'v1'}),
+                         ('cup', 7, 'v1'))
+        for body in ({}, {'seed': ''}, {'seed': 'cup', 'step': -1}, {'seed': 'cup', 'step': '1'},
+                     {'seed': True}, {'seed': 'x' * 129}, {'seed': 'cup', 'deck_version': 1},
+                     {'seed': 'cup', 'deck_version': 'x' * 65}):
+            self.assertEqual(parse_ramp_request(body), (None, None, None))
+
+    def test_parse_prefetch_count(self):
+        self.assertIsNone(parse_prefetch_count({}))
+        self.assertEqual(parse_prefetch_count({'count': 10}), 10)
+        for count in (0, -1, 51, '5', True):
+            self.assertEqual(parse_prefetch_count({'count': count}), 0)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+"""
+Quiz Session Test Suite
+Tests the per-worker and shared quiz session stores (no database required)
+"""
+
+import threading
+import unittest
+
+from flaskr.quiz import ALL_CATEGORIES, QuizSessionStore, SharedQuizSessionStore
+
+
+class ListBackend:
+    """In-memory stand-in for a shared cache backend with list support"""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def delete(self, key):
+        return self.data.pop(key, None) is not None
+
+    def set_list(self, key, values, ttl):
+        self.data[key] = [str(value).encode() for value in values]
+        return True
+
+    def list_item(self, key, index, ttl):
+        values = self.data.get(key)
+        if values is None:
+            return None
+        return (values[index] if index < len(values) else None), len(values)
+
+    def incr(self, key, ttl):
+        with self.lock:
+            self.data[key] = self.data.get(key, 0) + 1
+            return self.data[key]
+
+
+class QuizSessionStoreTestCase(unittest.TestCase):
+    """Test case for the per-worker session store"""
+
+    def test_draws_every_id_once(self):
+        store = QuizSessionStore()
+        session_id, total = store.create(ALL_CATEGORIES, [1, 2, 3])
+        self.assertEqual(total, 3)
+        drawn = [store.draw(session_id) for _ in range(4)]
+        self.assertEqual(sorted(question_id for question_id, _ in drawn[:3]), [1, 2, 3])
+        self.assertEqual([remaining for _, remaining in drawn], [2, 1, 0, 0])
+        self.assertEqual(drawn[3], (None, 0))
+
+    def test_sessions_share_the_deck_of_a_category(self):
+        store = QuizSessionStore()
+        with self.assertRaises(KeyError):
+            store.create(ALL_CATEGORIES)
+        first, _ = store.create(ALL_CATEGORIES, range(1000))
+        second, total = store.create(ALL_CATEGORIES)
+        self.assertEqual(total, 1000)
+
+        # Sessions hold a position, not a copy of the ids, and walk different orders
+        self.assertIs(store._sessions[first].deck, store._sessions[second].deck)
+        first_drawn = [store.draw(first)[0] for _ in range(1000)]
+        second_drawn = [store.draw(second)[0] for _ in range(1000)]
+        self.assertEqual(sorted(first_drawn), list(range(1000)))
+        self.assertEqual(sorted(second_drawn), list(range(1000)))
+        self.assertNotEqual(first_drawn, second_drawn)
+
+    def test_deck_is_rebuilt_after_deck_ttl(self):
+        store = QuizSessionStore(deck_ttl=0)
+        store.create(2, [1, 2])
+        with self.assertRaises(KeyError):
+            store.create(2)
+        session_id, total = store.create(2, [1, 2, 3])
+        self.assertEqual(total, 3)
+
+    def test_discarded_session_is_gone(self):
+        store = QuizSessionStore()
+        session_id, _ = store.create(ALL_CATEGORIES, [1])
+        self.assertTrue(store.discard(session_id))
+        self.assertFalse(store.discard(session_id))
+        with self.assertRaises(KeyError):
+            store.draw(session_id)
+
+
+class SharedQuizSessionStoreTestCase(unittest.TestCase):
+    """Test case for sessions shared by several workers through one backend"""
+
+    def setUp(self):
+        self.backend = ListBackend()
+        # Two stores over one backend stand in for two gunicorn workers
+        self.first = SharedQuizSessionStore(self.backend)
+        self.second = SharedQuizSessionStore(self.backend)
+
+    def test_any_worker_draws_from_a_session(self):
+        session_id, total = self.first.create(ALL_CATEGORIES, range(1, 11))
+        self.assertEqual(total, 10)
+        drawn = [(self.first if i % 2 else self.second).draw(session_id) for i in range(10)]
+        self.assertEqual(sorted(question_id for question_id, _ in drawn), list(range(1, 11)))
+        self.assertEqual([remaining for _, remaining in drawn], list(range(9, -1, -1)))
+        self.assertEqual(self.first.draw(session_id), (None, 0))
+        self.assertEqual(self.second.draw(session_id), (None, 0))
+
+    def test_sessions_share_the_deck_of_a_category(self):
+        sessions = [self.first.create(ALL_CATEGORIES, range(100))[0]]
+        sessions += [self.first.create(ALL_CATEGORIES)[0] for _ in range(3)]
+        self.assertEqual(len([key for key in self.backend.data if key.startswith('deck:')]), 1)
+        for session_id in sessions:
+            self.assertEqual(len(self.backend.data[session_id]), 1)
+            drawn = [self.second.draw(session_id)[0] for _ in range(100)]
+            self.assertEqual(sorted(drawn), list(range(100)))
+
+    def test_expired_deck_is_rebuilt(self):
+        self.first.create(ALL_CATEGORIES, [1, 2])
+        for key in [key for key in self.backend.data if key.startswith('deck:')]:
+            self.backend.delete(key)
+        with self.assertRaises(KeyError):
+            self.first.create(ALL_CATEGORIES)
+        session_id, _ = self.first.create(ALL_CATEGORIES, [1, 2])
+        self.assertIn(self.second.draw(session_id)[0], (1, 2))
+
+    def test_empty_session_is_exhausted_not_missing(self):
+        session_id, _ = self.first.create(ALL_CATEGORIES, [])
+        self.assertEqual(self.second.draw(session_id), (None, 0))
+
+    def test_concurrent_rounds_never_repeat(self):
+        session_id, _ = self.first.create(ALL_CATEGORIES, range(200))
+        drawn = []
+
+        def play(store):
+            for _ in range(50):
+                drawn.append(store.draw(session_id)[0])
+
+        threads = [threading.Thread(target=play, args=(store,))
+                   for store in (self.first, self.second) * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(drawn), list(range(200)))
+
+    def test_discard_from_another_worker(self):
+        session_id, _ = self.first.create(ALL_CATEGORIES, [1, 2])
+        self.first.draw(session_id)
+        self.assertTrue(self.second.discard(session_id))
+        self.assertFalse(self.first.discard(session_id))
+        with self.assertRaises(KeyError):
+            self.first.draw(session_id)
+
+    def test_unknown_session(self):
+        with self.assertRaises(KeyError):
+            self.second.draw('missing')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
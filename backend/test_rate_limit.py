@@ -0,0 +1,190 @@
+"""
+Rate Limit Storage Test Suite
+Tests the shared rate limit storages against a temporary file and a Redis stand-in
+"""
+
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+
+from flaskr.rate_limit import RedisCounterStorage, SharedMemoryStorage
+
+
+class StandInRedis:
+    """In-process stand-in for the subset of the Redis client the storage uses"""
+
+    def __init__(self):
+        self.values = {}
+        self.expiries = {}
+        self.round_trips = 0
+
+    def _expire(self, key):
+        if key in self.expiries and self.expiries[key] <= time.time():
+            self.values.pop(key, None)
+            self.expiries.pop(key, None)
+
+    def set(self, key, value, ex=None, nx=False):
+        self._expire(key)
+        if nx and key in self.values:
+            return None
+        self.values[key] = int(value)
+        if ex is not None:
+            self.expiries[key] = time.time() + ex
+        return True
+
+    def incrby(self, key, amount):
+        self._expire(key)
+        self.values[key] = self.values.get(key, 0) + amount
+        return self.values[key]
+
+    def get(self, key):
+        self.round_trips += 1
+        self._expire(key)
+        value = self.values.get(key)
+        return None if value is None else str(value).encode('ascii')
+
+    def pttl(self, key):
+        self._expire(key)
+        if key not in self.values:
+            return -2
+        return int((self.expiries[key] - time.time()) * 1000) if key in self.expiries else -1
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+            self.expiries.pop(key, None)
+        return len(keys)
+
+    def scan_iter(self, match=None):
+        prefix = (match or '').rstrip('*')
+        return [key for key in list(self.values) if key.startswith(prefix)]
+
+    def ping(self):
+        return True
+
+    def pipeline(self):
+        return StandInPipeline(self)
+
+
+class StandInPipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+        return queue
+
+    def execute(self):
+        self.client.round_trips += 1
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+
+def hit_shared_file(path, hits):
+    limiter = FixedWindowRateLimiter(storage_from_string(f'shm://{path}?batch=4'))
+    return sum(limiter.hit(parse('100/minute'), 'shared') for _ in range(hits))
+
+
+class SharedMemoryStorageTestCase(unittest.TestCase):
+    """Test case for the memory-mapped rate limit storage"""
+
+    def setUp(self):
+        descriptor, self.path = tempfile.mkstemp()
+        os.close(descriptor)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_fixed_window_limit(self):
+        limiter = FixedWindowRateLimiter(storage_from_string(f'shm://{self.path}'))
+        item = parse('3/minute')
+
+        self.assertEqual([limiter.hit(item, 'client') for _ in range(4)], [True, True, True, False])
+        self.assertTrue(limiter.hit(item, 'other'))
+
+    def test_counters_are_shared_between_instances(self):
+        first = storage_from_string(f'shm://{self.path}')
+        second = storage_from_string(f'shm://{self.path}')
+        first.incr('key', 60)
+        second.incr('key', 60)
+
+        self.assertIsInstance(first, SharedMemoryStorage)
+        self.assertEqual(first.get('key'), 2)
+        self.assertGreater(second.get_expiry('key'), time.time())
+
+    def test_expired_window_starts_over(self):
+        storage = storage_from_string(f'shm://{self.path}')
+        storage.incr('key', 1)
+        storage.incr('key', 1)
+        time.sleep(1.1)
+        self.assertEqual(storage.get('key'), 0)
+        self.assertEqual(storage.incr('key', 1), 1)
+
+    def test_clear_and_reset(self):
+        storage = storage_from_string(f'shm://{self.path}')
+        storage.incr('a', 60)
+        storage.incr('b', 60)
+        storage.clear('a')
+
+        self.assertEqual(storage.get('a'), 0)
+        self.assertEqual(storage.reset(), 1)
+        self.assertEqual(storage.get('b'), 0)
+
+    def test_full_bucket_recycles_a_slot(self):
+        storage = SharedMemoryStorage(f'shm://{self.path}?slots=16')
+        for index in range(40):
+            storage.incr(f'key-{index}', 60)
+        self.assertEqual(storage.get('key-39'), 1)
+
+    def test_batched_workers_never_exceed_the_limit(self):
+        context = multiprocessing.get_context('fork')
+        with context.Pool(4) as pool:
+            admitted = pool.starmap(hit_shared_file, [(self.path, 60)] * 4)
+
+        self.assertLessEqual(sum(admitted), 100)
+        self.assertGreater(sum(admitted), 100 - 4 * 3)
+
+
+class RedisCounterStorageTestCase(unittest.TestCase):
+    """Test case for the Redis-compatible rate limit storage"""
+
+    def setUp(self):
+        self.client = StandInRedis()
+
+    def test_fixed_window_limit(self):
+        storage = RedisCounterStorage('counter+redis://localhost:6379/0', client=self.client)
+        limiter = FixedWindowRateLimiter(storage)
+        item = parse('2/minute')
+
+        self.assertEqual([limiter.hit(item, 'client') for _ in range(3)], [True, True, False])
+        self.assertEqual(limiter.get_window_stats(item, 'client').remaining, 0)
+        self.assertEqual(self.client.round_trips, 4)
+
+    def test_batch_leases_hits(self):
+        storage = RedisCounterStorage('counter+redis://localhost:6379/0?batch=10', client=self.client)
+        limiter = FixedWindowRateLimiter(storage)
+        item = parse('25/minute')
+
+        results = [limiter.hit(item, 'client') for _ in range(30)]
+        self.assertEqual(results, [True] * 25 + [False] * 5)
+        self.assertEqual(self.client.round_trips, 3)
+
+    def test_reset(self):
+        storage = RedisCounterStorage('counter+redis://localhost:6379/0', client=self.client)
+        limiter = FixedWindowRateLimiter(storage)
+        limiter.hit(parse('2/minute'), 'a')
+        limiter.hit(parse('2/minute'), 'b')
+
+        self.assertEqual(storage.reset(), 2)
+        self.assertTrue(storage.check())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -180,6 +180,156 @@ class TriviaRBACTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(data['deleted'], str(question_id))
 
+    def test_trivia_manager_bulk_import_success(self):
+        """Test Trivia Manager can POST /questions/bulk and gets per-row errors"""
+        rows = [
+            {'question': 'Bulk question 1', 'answer': 'Bulk answer', 'difficulty': 1, 'category': 1},
+            {'question': 'Bulk question 2', 'answer': 'Bulk answer', 'difficulty': 9, 'category': 1},
+        ]
+        body = '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n'
+        res = self.client().post('/questions/bulk',
+                                  data=body,
+                                  content_type='application/x-ndjson',
+                                  headers=self.trivia_manager_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['failed'], 2)
+        self.assertEqual([error['line'] for error in data['errors']], [2, 3])
+
+    def test_trivia_manager_bulk_import_csv_success(self):
+        """Test Trivia Manager can POST a CSV file to /questions/bulk"""
+        body = 'question,answer,category,difficulty\n"Bulk, CSV question",Bulk answer,1,2\n'
+        res = self.client().post('/questions/bulk',
+                                  data=body,
+                                  content_type='text/csv',
+                                  headers=self.trivia_manager_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+
+    def test_trivia_manager_batch_delete_success(self):
+        """Test Trivia Manager can DELETE /questions by id list"""
+        ids = []
+        for index in range(3):
+            res = self.client().post('/questions',
+                                      json={'question': f'Batch delete {index}', 'answer': 'Gone',
+                                            'difficulty': 1, 'category': 1},
+                                      headers=self.trivia_manager_headers)
+            ids.append(json.loads(res.data)['created'])
+
+        res = self.client().delete('/questions',
+                                     json={'ids': ids},
+                                     headers=self.trivia_manager_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['deleted'], 3)
+
+    def test_trivia_manager_batch_update_success(self):
+        """Test Trivia Manager can PATCH /questions by id list"""
+        res = self.client().post('/questions',
+                                  json={'question': 'Batch update', 'answer': 'Moved',
+                                        'difficulty': 1, 'category': 1},
+                                  headers=self.trivia_manager_headers)
+        question_id = json.loads(res.data)['created']
+
+        res = self.client().patch('/questions',
+                                    json={'ids': [question_id], 'set': {'difficulty': 4}},
+                                    headers=self.trivia_manager_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated'], 1)
+
+    def test_trivia_manager_batch_delete_without_selection_fails(self):
+        """Test DELETE /questions refuses a request without ids or filter (400)"""
+        res = self.client().delete('/questions',
+                                     json={'filter': {}},
+                                     headers=self.trivia_manager_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_trivia_user_batch_delete_fails(self):
+        """Test Trivia User CANNOT DELETE /questions (403 Forbidden)"""
+        res = self.client().delete('/questions',
+                                     json={'ids': [1]},
+                                     headers=self.trivia_user_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(data['code'], 'unauthorized')
+
+    def test_trivia_user_export_questions_success(self):
+        """Test Trivia User can GET /questions/export as NDJSON"""
+        res = self.client().get('/questions/export?category=1',
+                                 headers=self.trivia_user_headers)
+        rows = [json.loads(line) for line in res.get_data().splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertTrue(len(rows))
+        self.assertTrue(all(row['category'] == 1 for row in rows))
+
+    def test_no_auth_export_questions_fails(self):
+        """Test that GET /questions/export requires authentication"""
+        res = self.client().get('/questions/export')
+
+        self.assertEqual(res.status_code, 401)
+
+    def test_trivia_user_bulk_import_fails(self):
+        """Test Trivia User CANNOT POST /questions/bulk (403 Forbidden)"""
+        res = self.client().post('/questions/bulk',
+                                  data='{}',
+                                  content_type='application/x-ndjson',
+                                  headers=self.trivia_user_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(data['code'], 'unauthorized')
+
+    def test_trivia_manager_pool_stats_success(self):
+        """Test Trivia Manager can GET /stats/pool"""
+        res = self.client().get('/stats/pool', headers=self.trivia_manager_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertIn('checked_out', data['pools']['default'])
+        self.assertIn('wait_max_ms', data['pools']['default'])
+
+    def test_trivia_user_pool_stats_fails(self):
+        """Test Trivia User CANNOT GET /stats/pool (403 Forbidden)"""
+        res = self.client().get('/stats/pool', headers=self.trivia_user_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(data['code'], 'unauthorized')
+
+    def test_trivia_manager_metrics_success(self):
+        """Test Trivia Manager can GET /metrics"""
+        self.client().post('/quizzes', json={'previous_questions': [], 'quiz_category': {'id': 0}})
+        res = self.client().get('/metrics', headers=self.trivia_manager_headers)
+        text = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('# TYPE trivia_request_duration_seconds histogram', text)
+        self.assertIn('route="/quizzes",phase="db"', text)
+
+    def test_trivia_user_metrics_fails(self):
+        """Test Trivia User CANNOT GET /metrics (403 Forbidden)"""
+        res = self.client().get('/metrics', headers=self.trivia_user_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(data['code'], 'unauthorized')
+
     # -------------------------------------------------------------------------
     # Tests for Invalid Tokens
     # -------------------------------------------------------------------------
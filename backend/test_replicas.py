@@ -0,0 +1,110 @@
+"""
+Read Replica Test Suite
+Tests query routing between a primary and a replica, using two SQLite databases
+"""
+
+import os
+import tempfile
+import unittest
+
+from flask import Flask, jsonify
+
+from models import db, setup_db, Category
+from replicas import ReplicaSet, read_replica
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """Test case for read replica routing"""
+
+    def setUp(self):
+        self.paths = []
+        for _ in range(2):
+            handle, path = tempfile.mkstemp(suffix='.db')
+            os.close(handle)
+            self.paths.append(path)
+        primary, replica = (f'sqlite:///{path}' for path in self.paths)
+
+        self.app = Flask(__name__)
+        setup_db(self.app, database_path=primary, replica_paths=[replica])
+        self.replicas = self.app.extensions['replicas']
+
+        with self.app.app_context():
+            db.metadata.create_all(db.engines['replica0'])
+            # Tell the databases apart by their rows
+            Category('Primary').insert()
+            with db.engines['replica0'].begin() as connection:
+                connection.execute(Category.__table__.insert(), [{'type': 'Replica'}])
+
+        @self.app.route('/read')
+        @read_replica
+        def read():
+            return jsonify([category.type for category in Category.query.all()])
+
+        @self.app.route('/read-primary')
+        def read_primary():
+            return jsonify([category.type for category in Category.query.all()])
+
+        @self.app.route('/write', methods=['POST'])
+        @read_replica
+        def write():
+            Category('Written').insert()
+            return jsonify([category.type for category in Category.query.all()])
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+        # init_app registers a metadata per bind on the shared db, and create_all of
+        # later apps without replicas would look for an engine for each of them
+        for key in self.replicas.keys:
+            db.metadatas.pop(key, None)
+        for path in self.paths:
+            os.remove(path)
+
+    def test_read_only_view_reads_from_replica(self):
+        self.assertEqual(self.client.get('/read').json, ['Replica'])
+
+    def test_other_views_read_from_primary(self):
+        self.assertEqual(self.client.get('/read-primary').json, ['Primary'])
+
+    def test_writes_go_to_primary(self):
+        res = self.client.post('/write')
+        self.assertEqual(res.json, ['Primary', 'Written'])
+
+    def test_client_reads_its_own_writes(self):
+        headers = {'Authorization': 'Bearer writer'}
+        self.client.post('/write', headers=headers)
+        self.assertEqual(self.client.get('/read', headers=headers).json, ['Primary', 'Written'])
+        # Other clients keep reading from the replica
+        self.assertEqual(self.client.get('/read').json, ['Replica'])
+
+    def test_unhealthy_replica_falls_back_to_primary(self):
+        self.replicas.mark_unhealthy('replica0', 'test')
+        self.assertEqual(self.client.get('/read').json, ['Primary'])
+
+        with self.app.app_context():
+            self.replicas.check(db.engines)
+        self.assertEqual(self.client.get('/read').json, ['Replica'])
+
+
+class ReplicaSetTestCase(unittest.TestCase):
+    """Test case for replica selection"""
+
+    def test_round_robin(self):
+        app = Flask(__name__)
+        replicas = ReplicaSet(['a', 'b'], health_interval=3600)
+        with app.app_context():
+            self.assertEqual([replicas.choose({}) for _ in range(4)], ['a', 'b', 'a', 'b'])
+            replicas.mark_unhealthy('a', 'test')
+            self.assertEqual([replicas.choose({}) for _ in range(2)], ['b', 'b'])
+
+    def test_unknown_strategy_fails(self):
+        with self.assertRaises(ValueError):
+            ReplicaSet(['a'], strategy='random')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+"""
+Response Cache Test Suite
+Tests ETag revalidation and invalidation of the HTTP response cache (no database server required)
+"""
+
+import os
+import tempfile
+import unittest
+
+from flask import Flask, jsonify
+
+from flaskr.response_cache import ResponseCache
+from models import db, setup_db, bump_version
+from test_auth import DictBackend
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    """Test case for the HTTP response cache"""
+
+    def setUp(self):
+        self.calls = 0
+        self.cache = ResponseCache(max_size=2, ttl=60, max_age=30, sync_interval=0)
+        self.app = self.create_app(self.cache)
+        self.client = self.app.test_client()
+
+    def create_app(self, cache):
+        app = Flask(__name__)
+
+        @app.route('/items')
+        @cache.cached()
+        def items():
+            self.calls += 1
+            return jsonify({'success': True, 'calls': self.calls})
+
+        @app.route('/private')
+        @cache.cached(public=False)
+        def private():
+            self.calls += 1
+            return jsonify({'success': True})
+
+        @app.route('/missing')
+        @cache.cached()
+        def missing():
+            self.calls += 1
+            return jsonify({'success': False}), 404
+
+        return app
+
+    def test_repeat_requests_are_served_from_cache(self):
+        first = self.client.get('/items?page=1')
+        second = self.client.get('/items?page=1')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+        self.assertEqual(first.headers['Cache-Control'], 'public, max-age=30')
+        self.assertEqual(self.calls, 1)
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get('/items').headers['ETag']
+        res = self.client.get('/items', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+        self.assertEqual(self.calls, 1)
+
+    def test_query_args_are_part_of_the_key(self):
+        self.client.get('/items?page=1&per_page=5')
+        self.client.get('/items?per_page=5&page=1')
+        self.client.get('/items?page=2')
+        self.assertEqual(self.calls, 2)
+
+    def test_escaped_query_does_not_share_a_key(self):
+        self.client.get('/items?page=2%26x%3D1')
+        res = self.client.get('/items?page=2&x=1')
+        self.assertEqual(res.get_json()['calls'], 2)
+        self.assertNotEqual(ResponseCache.make_key('1', '/items', [('page', '2&x=1')]),
+                            ResponseCache.make_key('1', '/items', [('page', '2'), ('x', '1')]))
+
+    def test_invalidate_changes_version(self):
+        etag = self.client.get('/items').headers['ETag']
+        self.cache.invalidate()
+        res = self.client.get('/items', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.calls, 2)
+
+    def test_private_responses_must_revalidate(self):
+        res = self.client.get('/private')
+        self.assertEqual(res.headers['Cache-Control'], 'private, no-cache')
+        self.assertIn('Authorization', res.headers['Vary'])
+
+    def test_errors_are_not_cached(self):
+        self.client.get('/missing')
+        res = self.client.get('/missing')
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(self.calls, 2)
+
+    def test_lru_is_bounded(self):
+        for page in range(5):
+            self.client.get(f'/items?page={page}')
+        self.assertEqual(self.cache.stats()['size'], 2)
+
+    def test_shared_backend_is_reused_by_other_workers(self):
+        backend = DictBackend()
+        worker_a = ResponseCache(max_size=2, ttl=60, backend=backend)
+        worker_b = ResponseCache(max_size=2, ttl=60, backend=backend)
+        worker_a.data_version = worker_b.data_version = lambda: '1.1'
+
+        first = self.create_app(worker_a).test_client().get('/items')
+        second = self.create_app(worker_b).test_client().get('/items')
+
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+        self.assertEqual(worker_b.stats()['shared_hits'], 1)
+        self.assertEqual(self.calls, 1)
+
+    @staticmethod
+    def dispose_engine(app):
+        with app.app_context():
+            db.engine.dispose()
+
+    def test_default_version_follows_writes_of_other_workers(self):
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        worker_a = ResponseCache(max_size=2, ttl=60)
+        worker_b = ResponseCache(max_size=2, ttl=60)
+        self.assertEqual(worker_b.sync_interval, 1)
+        app_a, app_b = self.create_app(worker_a), self.create_app(worker_b)
+        for app in (app_a, app_b):
+            setup_db(app, database_path=f'sqlite:///{path}')
+            self.addCleanup(self.dispose_engine, app)
+
+        client_b = app_b.test_client()
+        first = client_b.get('/items')
+        with app_a.app_context():
+            bump_version('questions')
+            db.session.commit()
+
+        # Worker b picks up the write from the shared counter once its sync interval has passed
+        worker_b._checked_at -= worker_b.sync_interval
+        second = client_b.get('/items', headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second.headers['ETag'], first.headers['ETag'])
+        self.assertEqual(self.calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
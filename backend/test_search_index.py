@@ -0,0 +1,151 @@
+"""
+Search Index Test Suite
+Tests the in-memory inverted index used by SEARCH_MODE=memory (no database required)
+"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+from flaskr.search_index import InvertedIndex, MemorySearch, search_terms
+from models import db, setup_db, question_changed, Category, Question
+
+
+class InvertedIndexTestCase(unittest.TestCase):
+    """Test case for the in-memory inverted index"""
+
+    def setUp(self):
+        self.index = InvertedIndex()
+        self.index.load([
+            (1, 'What is the heaviest organ in the human body?', 'The Liver', '1', 4),
+            (2, 'Who discovered penicillin?', 'Alexander Fleming', '1', 3),
+            (3, 'What is the largest lake in Africa?', 'Lake Victoria', '3', 2),
+        ])
+
+    def search(self, term, include_answers=False):
+        return list(self.index.search(search_terms(term), include_answers))
+
+    def test_multi_term_and_query(self):
+        self.assertEqual(self.search('what largest'), [3])
+        self.assertEqual(self.search('what'), [1, 3])
+
+    def test_prefix_query(self):
+        self.assertEqual(self.search('heav'), [1])
+        self.assertEqual(self.search('pen'), [2])
+
+    def test_answer_search(self):
+        self.assertEqual(self.search('fleming'), [])
+        self.assertEqual(self.search('fleming', include_answers=True), [2])
+
+    def test_incremental_updates(self):
+        self.index.add(4, 'What is the heaviest metal?', 'Osmium', '1', 4)
+        self.assertEqual(self.search('heaviest'), [1, 4])
+
+        self.index.remove(1)
+        self.assertEqual(self.search('heaviest'), [4])
+        self.assertEqual(self.search('organ'), [])
+
+        self.index.add(4, 'Which metal is densest?', 'Osmium', '1', 4)
+        self.assertEqual(self.search('heaviest'), [])
+        self.assertEqual(self.search('dense'), [4])
+
+
+class MemorySearchTestCase(unittest.TestCase):
+    """Test case for the memory search engine against a SQLite database"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.app = Flask(__name__)
+        setup_db(self.app, database_path=f'sqlite:///{self.path}', replica_paths=[])
+        with self.app.app_context():
+            Category('Science').insert()
+            db.session.add_all([Question(f'Planet {i}', 'Answer', 1, 1) for i in range(5)])
+            db.session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.engine.dispose()
+        os.remove(self.path)
+
+    def test_concurrent_cold_searches_build_once(self):
+        engine = MemorySearch(self.app)
+        build = engine.build
+        builds = []
+
+        def slow_build():
+            builds.append(1)
+            time.sleep(0.05)
+            return build()
+
+        engine.build = slow_build
+        totals = []
+
+        def search():
+            with self.app.app_context():
+                totals.append(engine.search('planet', False, 1, 10)[1])
+
+        threads = [threading.Thread(target=search) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(totals, [5] * 8)
+
+    def build_while_writing(self, engine):
+        load = InvertedIndex.load
+
+        def load_then_write(index, rows):
+            load(index, rows)
+            # Other requests commit writes after the build has read its rows
+            Question('Planet new', 'Answer', 1, 1).insert()
+            question = db.session.get(Question, 1)
+            question.question = 'Comet 0'
+            question.update()
+            db.session.get(Question, 2).delete()
+
+        with mock.patch.object(InvertedIndex, 'load', load_then_write):
+            engine.build()
+
+    def test_cold_build_replays_writes_made_during_the_scan(self):
+        engine = MemorySearch(self.app)
+        with self.app.app_context():
+            self.build_while_writing(engine)
+            questions, total = engine.search('planet', False, 1, 10)
+            self.assertEqual(total, 4)
+            self.assertEqual(sorted(question['id'] for question in questions), [3, 4, 5, 6])
+            self.assertEqual(engine.search('comet', False, 1, 10)[1], 1)
+
+    def test_rebuild_replays_writes_made_during_the_scan(self):
+        engine = MemorySearch(self.app)
+        with self.app.app_context():
+            engine.build()
+            self.build_while_writing(engine)
+            self.assertEqual(engine.search('planet', False, 1, 10)[1], 4)
+            self.assertEqual(engine.search('comet', False, 1, 10)[1], 1)
+
+
+    def test_bulk_write_during_cold_build_discards_the_snapshot(self):
+        engine = MemorySearch(self.app)
+        load = InvertedIndex.load
+
+        def load_then_bulk_write(index, rows):
+            load(index, rows)
+            question_changed.send(Question, action='bulk')
+
+        with self.app.app_context():
+            with mock.patch.object(InvertedIndex, 'load', load_then_bulk_write):
+                engine.build()
+        self.assertIsNone(engine.index)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
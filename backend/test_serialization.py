@@ -0,0 +1,71 @@
+"""
+Serialization Test Suite
+Tests the encoded question cache and JSON responses (no database required)
+"""
+
+import json
+import unittest
+
+from flask import Flask, jsonify
+
+from flaskr.serialization import Encoded, QuestionJSONCache, json_response
+
+
+def make_row(question_id, text='What is the capital of France?'):
+    return (question_id, text, 'Paris', 3, 2)
+
+
+class QuestionJSONCacheTestCase(unittest.TestCase):
+    """Test case for the encoded question cache"""
+
+    def test_rows_are_encoded_like_format(self):
+        cache = QuestionJSONCache(max_size=10)
+        questions = json.loads(cache.encode_rows([make_row(1), make_row(2)]))
+        self.assertEqual(questions[0], {
+            'id': 1,
+            'question': 'What is the capital of France?',
+            'answer': 'Paris',
+            'category': 3,
+            'difficulty': 2
+        })
+        self.assertEqual([question['id'] for question in questions], [1, 2])
+
+    def test_changed_row_is_encoded_again(self):
+        cache = QuestionJSONCache(max_size=10)
+        cache.encode_rows([make_row(1)])
+        questions = json.loads(cache.encode_rows([make_row(1, 'Edited?')]))
+        self.assertEqual(questions[0]['question'], 'Edited?')
+
+    def test_cache_is_bounded(self):
+        cache = QuestionJSONCache(max_size=2)
+        cache.encode_rows([make_row(question_id) for question_id in range(5)])
+        self.assertEqual(len(cache._entries), 2)
+
+    def test_disabled_cache(self):
+        cache = QuestionJSONCache(max_size=0)
+        self.assertEqual(cache.encode_rows([]), b'[]')
+        self.assertEqual(len(json.loads(cache.encode_rows([make_row(1)]))), 1)
+
+
+class JSONResponseTestCase(unittest.TestCase):
+    """Test case for responses assembled from encoded parts"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def test_plain_values_match_jsonify(self):
+        data = {'success': True, 'categories': {1: 'Science', 10: 'Art'}, 'current_category': None}
+        with self.app.app_context():
+            self.assertEqual(json_response(data).get_data(), jsonify(data).get_data())
+
+    def test_encoded_values_are_embedded(self):
+        with self.app.app_context():
+            response = json_response({'success': True, 'questions': Encoded(b'[{"id":1}]')}, 201)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(response.get_json(), {'success': True, 'questions': [{'id': 1}]})
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+Structured Logging Test Suite
+Tests the JSON format, the background queue handler, sampling and request ids (no database required)
+"""
+
+import io
+import json
+import logging
+import queue
+import unittest
+
+from flask import Flask, jsonify
+
+from structured_logging import (BackgroundQueueHandler, JSONFormatter, RequestContextFilter,
+                                end_request, init_request_ids, start_request)
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class StructuredLoggingTestCase(unittest.TestCase):
+    """Test case for formatting and filtering log records"""
+
+    def setUp(self):
+        self.logger = logging.getLogger('test_structured_logging')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.handler = RecordingHandler()
+        self.handler.addFilter(RequestContextFilter())
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        end_request()
+
+    def test_json_lines_carry_request_id_and_extra_fields(self):
+        start_request('req-1')
+        self.logger.info("Fetching page %s", 2, extra={'route': '/questions'})
+        entry = json.loads(JSONFormatter().format(self.handler.records[0]))
+        self.assertEqual(entry['message'], 'Fetching page 2')
+        self.assertEqual(entry['request_id'], 'req-1')
+        self.assertEqual(entry['route'], '/questions')
+        self.assertEqual(entry['level'], 'INFO')
+
+    def test_exceptions_are_included(self):
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            self.logger.exception("Failed")
+        entry = json.loads(JSONFormatter().format(self.handler.records[0]))
+        self.assertIn('ValueError: boom', entry['exception'])
+
+    def test_unsampled_requests_keep_only_warnings(self):
+        start_request('req-2', sample_rate=0)
+        self.logger.info("Dropped")
+        self.logger.warning("Kept")
+        self.assertEqual([record.getMessage() for record in self.handler.records], ['Kept'])
+
+        start_request('req-2', sample_rate=1)
+        self.logger.info("Kept too")
+        self.assertEqual(len(self.handler.records), 2)
+
+    def test_invalid_request_id_is_replaced(self):
+        self.assertEqual(start_request('abc-123'), 'abc-123')
+        self.assertNotEqual(start_request('bad id\n'), 'bad id\n')
+
+
+class BackgroundQueueHandlerTestCase(unittest.TestCase):
+    """Test case for the queue handler of the background writer"""
+
+    def test_message_is_formatted_by_the_writer(self):
+        handler = BackgroundQueueHandler(queue.Queue())
+        record = logging.LogRecord('test', logging.INFO, __file__, 1, "Found %s questions", (3,), None)
+        handler.handle(record)
+        queued = handler.queue.get_nowait()
+        self.assertEqual(queued.msg, "Found %s questions")
+        self.assertEqual(queued.getMessage(), "Found 3 questions")
+
+    def test_full_queue_drops_records(self):
+        handler = BackgroundQueueHandler(queue.Queue(1))
+        for _ in range(3):
+            handler.handle(logging.LogRecord('test', logging.INFO, __file__, 1, "Hit", (), None))
+        self.assertEqual(handler.queue.qsize(), 1)
+        self.assertEqual(handler.dropped, 2)
+
+
+class RequestIdTestCase(unittest.TestCase):
+    """Test case for the request id of Flask requests"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        init_request_ids(self.app)
+        self.stream = io.StringIO()
+        self.handler = logging.StreamHandler(self.stream)
+        self.handler.setFormatter(JSONFormatter())
+        self.handler.addFilter(RequestContextFilter())
+        logging.getLogger('test_request_id').addHandler(self.handler)
+
+        @self.app.route('/')
+        def index():
+            logging.getLogger('test_request_id').warning("Handled")
+            return jsonify({'success': True})
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        logging.getLogger('test_request_id').removeHandler(self.handler)
+
+    def test_incoming_request_id_is_kept(self):
+        res = self.client.get('/', headers={'X-Request-ID': 'client-42'})
+        self.assertEqual(res.headers['X-Request-ID'], 'client-42')
+        self.assertEqual(json.loads(self.stream.getvalue())['request_id'], 'client-42')
+
+    def test_request_id_is_generated(self):
+        res = self.client.get('/')
+        self.assertEqual(len(res.headers['X-Request-ID']), 32)
+        self.assertEqual(json.loads(self.stream.getvalue())['request_id'], res.headers['X-Request-ID'])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()